@@ -0,0 +1,346 @@
+"""
+Per-participant statistics of the generated stimuli, as one consolidated table.
+
+For every (seed, sequence) pair the table holds note counts per hand, hand
+balance, finger usage, note density per measure, hand switches and the notes
+shared between consecutive states. Nothing is parsed back from the .pv.json
+files: the statistics are computed from the same inputs render_seed uses
+(load_sequences + generate_states with main.py's configuration).
+
+The work is split so it scales with the number of seeds:
+
+  - A sequence is the same for every participant; only the 9 chords behind
+    its state indices differ. Each sequence is therefore reduced once to
+    state counts, transition counts and the distinct per-measure state
+    compositions (SequenceProfile).
+  - Per seed, each statistic is then a small dot product of those counts
+    with the seed's per-state values (notes per hand, fingers, pitch masks),
+    independent of the sequence length. Seeds are processed in chunks on a
+    process pool.
+
+The table is a CSV (default generated_midis/analysis.csv). Re-running with
+more seeds only computes the missing rows and appends them; rows computed
+from different inputs (changed configuration or sequences) are recomputed.
+Rows of seeds (or sequences) a run does not cover are kept as they are.
+Transition counts are identical for all seeds, so they go to a separate
+per-sequence table (analysis_transitions.csv) instead of being repeated.
+
+Examples:
+    python src/analyze.py --seeds 1-300
+    python src/analyze.py --seeds 1-20000 --workers 8 --out results/analysis.csv
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+import generate_states
+import load_sequences
+import main as config
+from build_cache import input_key
+from note_capture import HandMaps, build_default_maps
+from pitch_mask import pitch_mask, popcount
+
+# Bump when a statistic is added or computed differently (stale rows are recomputed)
+ANALYSIS_VERSION = 1
+TABLE_NAME = "analysis.csv"
+TRANSITIONS_NAME = "analysis_transitions.csv"
+CHUNK_SIZE = 500
+TIME_SIGNATURE = (4, 4)   # what render_sequence writes (its ts default)
+FINGERS = range(1, 6)
+
+COLUMNS = (
+    ["seed", "sequence", "inputs", "steps", "notes", "notes_right", "notes_left",
+     "hand_balance"]
+    + [f"finger_r{f}" for f in FINGERS] + [f"finger_l{f}" for f in FINGERS]
+    + ["unfingered", "measures", "density_mean", "density_min", "density_max",
+       "hand_switches", "shared_notes"]
+)
+
+
+class SequenceProfile(NamedTuple):
+    """Seed-independent summary of one state sequence."""
+    steps: int
+    state_counts: Tuple[int, ...]                      # occurrences per state index
+    transitions: Dict[Tuple[int, int], int]            # (state, next state) -> count
+    measures: int
+    compositions: Dict[Tuple[int, ...], int]           # per-measure state counts -> measures
+
+
+def profile_sequence(seq: Iterable[int], n_states: int = 9,
+                     beats_per_measure: float = 4.0, step_beats: float = 1.0) -> SequenceProfile:
+    """
+    Reduce a sequence to the counts every statistic is computed from, in one
+    pass (generated sequences are read lazily).
+
+    Steps are placed like capture_notes places them (step i starts at beat
+    i * step_beats); measures are musical measures of the time signature.
+    """
+    counts = [0] * n_states
+    transitions: Counter = Counter()
+    compositions: Counter = Counter()
+    current = -1
+    in_measure = [0] * n_states
+    prev = None
+    steps = 0
+    for i, d in enumerate(seq):
+        counts[d] += 1
+        if prev is not None:
+            transitions[prev, d] += 1
+        prev = d
+        m = int(i * step_beats // beats_per_measure)
+        if m != current:
+            if current >= 0:
+                compositions[tuple(in_measure)] += 1
+                in_measure = [0] * n_states
+            current = m
+        in_measure[d] += 1
+        steps += 1
+    if current >= 0:
+        compositions[tuple(in_measure)] += 1
+    return SequenceProfile(steps, tuple(counts), dict(transitions), current + 1,
+                           dict(compositions))
+
+
+class StateStats(NamedTuple):
+    """Per-state values of one seed (index = state index)."""
+    right: Tuple[int, ...]               # right-hand notes
+    left: Tuple[int, ...]                # left-hand notes
+    fingers: Tuple[Counter, ...]         # ("r" | "l", finger) -> notes
+    masks: Tuple[int, ...]               # chord pitch masks
+    hands: Tuple[int, ...]               # 1 = right only, 2 = left only, 3 = both
+
+
+def state_stats(chords: Sequence[frozenset], maps: HandMaps) -> StateStats:
+    """Route each chord's notes to hands and fingers (as StateTemplates does)."""
+    track_table, finger_table = maps.track_table, maps.finger_table
+    right, left, fingers, hands = [], [], [], []
+    for chord in chords:
+        n_left = sum(track_table[p] for p in chord)
+        right.append(len(chord) - n_left)
+        left.append(n_left)
+        fingers.append(Counter(("l" if track_table[p] else "r", finger_table[p])
+                               for p in chord))
+        hands.append((1 if len(chord) > n_left else 0) | (2 if n_left else 0))
+    return StateStats(tuple(right), tuple(left), tuple(fingers),
+                      tuple(pitch_mask(c) for c in chords), tuple(hands))
+
+
+def sequence_row(seed: int, name: str, inputs: str, prof: SequenceProfile,
+                 st: StateStats) -> Dict[str, object]:
+    """One table row: the statistics of sequence `name` for one seed."""
+    counts = prof.state_counts
+    notes_right = sum(c * n for c, n in zip(counts, st.right))
+    notes_left = sum(c * n for c, n in zip(counts, st.left))
+    notes = notes_right + notes_left
+    fingers: Counter = Counter()
+    for c, per_state in zip(counts, st.fingers):
+        if c:
+            for key, n in per_state.items():
+                fingers[key] += c * n
+    sizes = [r + l for r, l in zip(st.right, st.left)]
+    densities = [sum(c * s for c, s in zip(comp, sizes)) for comp in prof.compositions]
+
+    row = {
+        "seed": seed, "sequence": name, "inputs": inputs,
+        "steps": prof.steps, "notes": notes,
+        "notes_right": notes_right, "notes_left": notes_left,
+        # +1: only right hand, -1: only left hand
+        "hand_balance": round((notes_right - notes_left) / notes, 6) if notes else 0.0,
+    }
+    for f in FINGERS:
+        row[f"finger_r{f}"] = fingers["r", f]
+    for f in FINGERS:
+        row[f"finger_l{f}"] = fingers["l", f]
+    row["unfingered"] = fingers["r", 0] + fingers["l", 0]
+    row["measures"] = prof.measures
+    row["density_mean"] = round(notes / prof.measures, 6) if prof.measures else 0.0
+    row["density_min"] = min(densities, default=0)
+    row["density_max"] = max(densities, default=0)
+    row["hand_switches"] = sum(c for (a, b), c in prof.transitions.items()
+                               if st.hands[a] != st.hands[b])
+    row["shared_notes"] = sum(c * popcount(st.masks[a] & st.masks[b])
+                              for (a, b), c in prof.transitions.items())
+    return row
+
+
+# --- Process pool ---
+
+# per-process inputs (filled once per worker by _init_analysis)
+_shared: Dict[str, object] = {}
+
+
+def _init_analysis(profiles: Dict[str, SequenceProfile], inputs: Dict[str, str],
+                   maps: HandMaps) -> None:
+    _shared.update(profiles=profiles, inputs=inputs, maps=maps)
+
+
+def _analyze_chunk(todo: List[Tuple[int, List[str]]]) -> List[Dict[str, object]]:
+    """Rows for a chunk of (seed, sequence names) pairs."""
+    profiles, inputs, maps = _shared["profiles"], _shared["inputs"], _shared["maps"]
+    rows = []
+    for seed, names in todo:
+        chords, _ = generate_states.generate_states(
+            config.pitches_left, config.pitches_right,
+            n_left=config.CHORDS_LEFT_HAND, n_right=config.CHORDS_RIGHT_HAND,
+            n_cross=config.CHORDS_CROSS_HAND, fingers_used=config.FINGERS_USED,
+            seed=seed, sampler=config.SAMPLER,
+        )
+        st = state_stats(chords, maps)
+        for name in names:
+            rows.append(sequence_row(seed, name, inputs[name], profiles[name], st))
+    return rows
+
+
+# --- Table ---
+
+def _read_table(path: Path) -> Tuple[List[Dict[str, str]], bool]:
+    """Existing rows and whether the header matches COLUMNS (empty if no table)."""
+    try:
+        with open(path, newline="", encoding="utf-8") as fh:
+            reader = csv.DictReader(fh)
+            return list(reader), reader.fieldnames == COLUMNS
+    except FileNotFoundError:
+        return [], True
+
+
+def _write_rows(path: Path, rows: Iterable[Dict[str, object]], *, append: bool) -> None:
+    if append:
+        with open(path, "a", newline="", encoding="utf-8") as fh:
+            csv.DictWriter(fh, COLUMNS).writerows(rows)
+        return
+    # write a new table next to the old one, then swap it in
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.DictWriter(fh, COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+
+def write_transitions(path: Path, profiles: Dict[str, SequenceProfile]) -> None:
+    """Per-sequence transition counts (sequence, from_state, to_state, count)."""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(["sequence", "from_state", "to_state", "count"])
+        for name in sorted(profiles):
+            for (a, b), c in sorted(profiles[name].transitions.items()):
+                writer.writerow([name, a, b, c])
+    os.replace(tmp, path)
+
+
+def analyze(seeds: Sequence[int], state_sequences: Dict[str, Sequence[int]], maps: HandMaps,
+            table: Path, *, workers: int = None, force: bool = False) -> Tuple[int, int]:
+    """
+    Bring the consolidated table up to date for `seeds` x all sequences.
+
+    Args:
+        seeds: Seeds (participants) to include.
+        state_sequences: Sequences as returned by load_sequences.
+        maps: Hand routing + fingerings (build_default_maps).
+        table: CSV to create or update; the transitions table is written next to it.
+        workers: Worker processes (default: CPU count). 1 runs in-process.
+        force: Recompute every row of `seeds`.
+
+    Returns:
+        Tuple[int, int]: (rows computed, rows kept from the existing table,
+            including those of seeds and sequences this run does not cover).
+    """
+    table = Path(table)
+    table.parent.mkdir(parents=True, exist_ok=True)
+    ts_num, ts_den = TIME_SIGNATURE
+    profiles = {name: profile_sequence(seq, beats_per_measure=ts_num * (4.0 / ts_den))
+                for name, seq in state_sequences.items()}
+    setup = dict(pitches_left=config.pitches_left, pitches_right=config.pitches_right,
+                 chords=(config.CHORDS_LEFT_HAND, config.CHORDS_RIGHT_HAND,
+                         config.CHORDS_CROSS_HAND),
+                 fingers_used=config.FINGERS_USED, sampler=config.SAMPLER,
+                 lh_fingers=maps.lh_fingers, rh_fingers=maps.rh_fingers,
+                 lh_keys=maps.lh_keys, rh_keys=maps.rh_keys, version=ANALYSIS_VERSION)
+    # short content address of everything a sequence's rows depend on (except the seed)
+    inputs = {name: input_key(setup=setup, sequence=seq.cache_spec()
+                              if hasattr(seq, "cache_spec") else seq)[:16]
+              for name, seq in state_sequences.items()}
+
+    old_rows, header_ok = _read_table(table)
+    if not header_ok:
+        old_rows = []   # another table layout; nothing can be carried over
+    requested = set(seeds)
+    # an existing row is kept if this run does not cover it, or (unless forced)
+    # if it was computed from the current inputs
+    kept, done = [], set()
+    for row in old_rows:
+        key = (int(row["seed"]), row["sequence"])
+        if key in done:
+            continue
+        covered = key[0] in requested and key[1] in inputs
+        if not covered or (not force and inputs[key[1]] == row["inputs"]):
+            kept.append(row)
+            done.add(key)
+    # a replaced row (stale, forced or duplicate) means rewriting rather than appending
+    append = header_ok and len(kept) == len(old_rows) and table.exists()
+
+    todo = [(seed, [n for n in state_sequences if (seed, n) not in done])
+            for seed in dict.fromkeys(seeds)]
+    todo = [(seed, names) for seed, names in todo if names]
+    chunks = [todo[i:i + CHUNK_SIZE] for i in range(0, len(todo), CHUNK_SIZE)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(chunks) or 1))
+
+    if workers == 1:
+        _init_analysis(profiles, inputs, maps)
+        results = [_analyze_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_analysis,
+                                 initargs=(profiles, inputs, maps)) as pool:
+            results = list(pool.map(_analyze_chunk, chunks))
+    new_rows = [row for rows in results for row in rows]
+
+    if append:
+        if new_rows:
+            _write_rows(table, new_rows, append=True)
+    else:
+        _write_rows(table, kept + new_rows, append=False)
+    write_transitions(table.with_name(TRANSITIONS_NAME), profiles)
+    return len(new_rows), len(kept)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute per-participant stimulus statistics.")
+    parser.add_argument("--seeds", type=config.parse_seeds, required=True,
+                        help='seeds (participants) to analyze, e.g. "1-300"')
+    parser.add_argument("--out", type=Path, default=None,
+                        help=f"table to create/update (default: generated_midis/{TABLE_NAME})")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="recompute every row of --seeds")
+    args = parser.parse_args(argv)
+
+    here = Path(__file__).parent
+    table = args.out or here.parent / "generated_midis" / TABLE_NAME
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+    try:
+        state_sequences = load_sequences.load_sequences(here / "state_sequences")
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    if not state_sequences:
+        sys.exit("Error: no sequences found in state_sequences/")
+
+    t0 = time.perf_counter()
+    try:
+        computed, kept = analyze(args.seeds, state_sequences, maps, table,
+                                 workers=args.workers, force=args.force)
+    except OSError as e:
+        sys.exit(f"Error: could not write the table: {e}")
+    print(f"Analyzed {len(args.seeds)} seeds x {len(state_sequences)} sequences in "
+          f"{time.perf_counter() - t0:.2f}s: {computed} rows computed, {kept} kept")
+    print(f"Wrote: {table}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+import instrument
+from bundle import BundleWriter, MemoryBundle, bundle_path
+from note_capture import HandMaps
+
+# Shared, read-only state for worker processes. Filled once per worker by
+# _init_worker so sequences and hand maps are not re-sent with every seed.
+_shared: Dict[str, object] = {}
+
+
+def _init_worker(state_sequences: Dict[str, List[int]], maps: HandMaps, out_root: Path,
+                 force: bool = False, write_threads: int = 0,
+                 bundle_mode: str = None, bundle_format: str = "zip",
+                 chunk_steps: int = None, tempo=None) -> None:
+    """Pool initializer: store the parsed sequences + hand maps in this worker."""
+    _shared["state_sequences"] = state_sequences
+    _shared["maps"] = maps
+    _shared["out_root"] = out_root
+    _shared["force"] = force
+    _shared["write_threads"] = write_threads
+    _shared["bundle_mode"] = bundle_mode
+    _shared["bundle_format"] = bundle_format
+    _shared["chunk_steps"] = chunk_steps
+    _shared["tempo"] = tempo
+
+
+def _init_pool_worker(*args) -> None:
+    """Pool initializer for worker processes."""
+    _init_worker(*args)
+    # forked workers inherit the parent's recorded trace events; drop those copies
+    instrument.drain()
+
+
+def _render_one(seed: int):
+    """
+    Render all sequences for a single seed inside a worker.
+
+    Returns:
+        (seed, n_files, n_bytes, n_notes, seconds, n_hits, n_rebuilds, trace_events, members);
+        n_notes estimates the notes of the rebuilt sequences (FINGERS_USED per step;
+        not counted from the captured notes), trace_events is empty unless tracing,
+        members holds the (name, bytes) archive members in "batch" bundle mode.
+    """
+    # imported here so the worker picks up the same config constants as main
+    import main
+
+    state_sequences = _shared["state_sequences"]
+    out_root = _shared["out_root"]
+    mode, fmt = _shared["bundle_mode"], _shared["bundle_format"]
+    t0 = time.perf_counter()
+    if mode == "seed":
+        with BundleWriter(bundle_path(out_root, f"seed_{seed}", fmt), out_root, fmt) as bundle:
+            created, cache = main.render_seed(seed, state_sequences, _shared["maps"], out_root,
+                                              verbose=False, bundle=bundle,
+                                              tempo=_shared["tempo"])
+    elif mode == "batch":
+        # collect the files here; the parent process owns the archive
+        bundle = MemoryBundle(out_root)
+        created, cache = main.render_seed(seed, state_sequences, _shared["maps"], out_root,
+                                          verbose=False, bundle=bundle,
+                                          tempo=_shared["tempo"])
+    else:
+        bundle = None
+        created, cache = main.render_seed(seed, state_sequences, _shared["maps"], out_root,
+                                          verbose=False, force=_shared["force"],
+                                          write_threads=_shared["write_threads"],
+                                          chunk_steps=_shared["chunk_steps"],
+                                          tempo=_shared["tempo"])
+    elapsed = time.perf_counter() - t0
+
+    if bundle is None:
+        n_bytes = sum(p.stat().st_size for p in created)
+    else:
+        n_bytes = sum(bundle.size(p) for p in created)
+    members = bundle.members if isinstance(bundle, MemoryBundle) else []
+    # an estimate: every state is a chord of exactly FINGERS_USED pitches
+    n_notes = main.FINGERS_USED * sum(len(state_sequences[name]) for name in cache.rebuilds)
+    return (seed, len(created), n_bytes, n_notes, elapsed, len(cache.hits), len(cache.rebuilds),
+            instrument.drain(), members)
+
+
+def run_batch(seeds: Sequence[int],
+              state_sequences: Dict[str, List[int]],
+              maps: HandMaps,
+              out_root: Path,
+              *,
+              workers: int = None,
+              force: bool = False,
+              write_threads: int = 0,
+              bundle_mode: str = None,
+              bundle_format: str = "zip",
+              chunk_steps: int = None,
+              tempo=None,
+              on_result: Callable[[tuple], None] = None) -> List[tuple]:
+    """
+    Render many seeds, fanning generate_states + render_sequence out over a process pool.
+
+    Each seed goes through exactly the same code path as a single-seed run
+    (main.render_seed), so generated_midis/seed_<n>/ is byte-identical.
+
+    Args:
+        seeds: Seeds to render.
+        state_sequences: Parsed sequences (from load_sequences), shared with all workers.
+        maps: HandMaps (from build_default_maps), shared with all workers.
+        out_root: Root output folder.
+        workers: Number of worker processes (default: CPU count). 1 runs in-process.
+        force: Ignore the per-seed build caches and re-render everything.
+        write_threads: Writer threads per worker for pipelined rendering (0 = off).
+        bundle_mode: None (loose files), "seed" (out_root/seed_<n>.<fmt> per seed) or
+            "batch" (one out_root/seeds_<first>-<last>.<fmt> archive; workers send their
+            files to this process, which appends them as they complete).
+        bundle_format: "zip" or "tar".
+        chunk_steps: Render sequences in windows of this many steps (bounded memory).
+        tempo: BPM or TempoMap for every seed (None = main's configured tempo).
+        on_result: Called with each seed's result tuple as soon as the seed is done
+            (e.g. to record completion; see shard.py).
+
+    Returns:
+        List of per-seed result tuples
+        (seed, n_files, n_bytes, n_notes, seconds, n_hits, n_rebuilds, trace_events),
+        in completion order: _render_one's result without the archive members,
+        which are appended to the batch bundle here. n_notes is an estimate (see
+        _render_one). Trace events from workers are also merged into this
+        process's instrument buffer.
+    """
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(seeds)))
+    results = []
+
+    print(f"Rendering {len(seeds)} seeds with {workers} worker(s) into: {out_root}")
+    t0 = time.perf_counter()
+
+    archive = None
+    if bundle_mode == "batch":
+        archive = BundleWriter(bundle_path(out_root, f"seeds_{seeds[0]}-{seeds[-1]}",
+                                           bundle_format), out_root, bundle_format)
+
+    def _collect(res):
+        instrument.extend(res[7])
+        if archive is not None:
+            archive.add_members(res[8])
+        _print_seed(res)
+        results.append(res[:8])
+        if on_result is not None:
+            on_result(res[:8])
+
+    try:
+        if workers == 1:
+            _init_worker(state_sequences, maps, out_root, force, write_threads,
+                         bundle_mode, bundle_format, chunk_steps, tempo)
+            for seed in seeds:
+                _collect(_render_one(seed))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_pool_worker,
+                                     initargs=(state_sequences, maps, out_root, force,
+                                               write_threads, bundle_mode,
+                                               bundle_format, chunk_steps, tempo)) as pool:
+                futures = [pool.submit(_render_one, seed) for seed in seeds]
+                for fut in as_completed(futures):
+                    _collect(fut.result())
+    except BaseException:
+        if archive is not None:
+            # a seed failed: don't leave an archive that looks complete
+            archive.abort()
+        raise
+    if archive is not None:
+        archive.close()
+        print(f"Wrote bundle: {archive.path}")
+
+    wall = time.perf_counter() - t0
+    _print_summary(results, wall, workers)
+    return results
+
+
+def _print_seed(res) -> None:
+    seed, n_files, n_bytes, n_notes, secs, hits, rebuilds = res[:7]
+    rate = n_notes / secs if secs > 0 else float("inf")
+    print(f" - seed {seed}: {n_files} files, {n_bytes / 1e6:.2f} MB, "
+          f"~{n_notes} notes in {secs:.3f}s ({rate:,.0f} notes/s); "
+          f"cache {hits} up to date, {rebuilds} rebuilt")
+
+
+def _print_summary(results, wall: float, workers: int) -> None:
+    n_seeds = len(results)
+    n_files = sum(r[1] for r in results)
+    n_bytes = sum(r[2] for r in results)
+    n_notes = sum(r[3] for r in results)
+    cpu = sum(r[4] for r in results)
+    hits = sum(r[5] for r in results)
+    rebuilds = sum(r[6] for r in results)
+    wall = wall if wall > 0 else float("nan")
+    print(f"Done: {n_seeds} seeds, {n_files} files, {n_bytes / 1e6:.2f} MB in {wall:.2f}s wall "
+          f"({n_seeds / wall:.2f} seeds/s, ~{n_notes / wall:,.0f} notes/s, "
+          f"{n_bytes / 1e6 / wall:.2f} MB/s; worker time {cpu:.2f}s on {workers} worker(s))")
+    print(f"Build cache: {hits} sequences up to date, {rebuilds} rebuilt")
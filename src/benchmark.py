@@ -0,0 +1,472 @@
+"""
+Benchmark the generate -> capture -> write pipeline stage by stage.
+
+Every grid point (sequence length x FINGERS_USED x seed count x SCROLL_SPEED)
+times each stage separately and records its peak traced memory:
+
+    generate_states, load_sequences, capture_notes, write_midi, build_json, json_dump
+
+Results are written as JSON so runs can be compared; --compare checks a new
+run against a stored one and exits non-zero on a regression.
+
+--micro times the per-note routing of the capture loop (hand + finger of
+every played pitch) with the set/dict lookups against the pitch-indexed
+HandMaps tables, and seed_scan-style chord checks on frozensets against
+pitch bitmasks.
+
+--memory-check instead renders lazily generated sequences of growing length
+in chunked mode (render_sequence(chunk_steps=...)) and fails if the traced
+peak memory grows with the length.
+
+--startup times cold starts of main.py (fresh interpreters) and fails if
+they take more than STARTUP_BUDGET_MS longer than a bare interpreter, or
+if a mode imports a module it should not need (per `python -X importtime`).
+
+Examples:
+    python src/benchmark.py --out bench.json
+    python src/benchmark.py --grid full --out bench_full.json
+    python src/benchmark.py --lengths 72,100000 --fingers 1-5 --compare bench.json --threshold 0.2
+    python src/benchmark.py --memory-check --lengths 10000,100000
+    python src/benchmark.py --micro --lengths 100000
+    python src/benchmark.py --startup
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import generate_states
+import load_sequences
+import main as config
+from json_writer import PianoVisionJsonWriter
+from midi_writer import write_midi
+from note_capture import StateTemplates, build_default_maps, capture_notes_columnar
+from pitch_mask import pitch_mask, popcount
+from renderer import render_sequence
+from sequence_grammar import GeneratedSequence, TransitionGrammar
+
+STAGES = ("generate_states", "load_sequences", "capture_notes",
+          "write_midi", "build_json", "json_dump")
+
+GRIDS = {
+    "quick": dict(lengths=[72, 10_000], fingers=[2], seeds=[1], scroll_speeds=[20.0]),
+    "full": dict(lengths=[72, 1_000, 10_000, 100_000, 1_000_000], fingers=list(range(1, 11)),
+                 seeds=[1, 10], scroll_speeds=[1.0, 20.0]),
+}
+
+# --memory-check defaults: sequence lengths, window size, and allowed peak growth
+MEMORY_LENGTHS = [5_000, 20_000, 80_000]
+MEMORY_CHUNK_STEPS = 4096
+MEMORY_TOLERANCE = 0.25
+
+# --startup: main.py arguments timed per case, and modules each may not import
+STARTUP_CASES = {
+    "help": ["--help"],
+    "states-only": ["--states-only"],
+}
+STARTUP_FORBIDDEN = {
+    "states-only": ("midiutil", "midi_writer", "json_writer", "renderer", "note_capture"),
+    "json-only": ("midiutil", "midi_writer"),
+}
+STARTUP_BUDGET_MS = 35.0   # allowed cold start on top of a bare interpreter (measured ~29 ms)
+
+
+class _Stage:
+    """Context manager timing one stage; tracemalloc peak is taken when tracing."""
+
+    def __init__(self, record: dict, name: str):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.t0
+        entry = self.record.setdefault(self.name, {"seconds": 0.0, "peak_bytes": 0})
+        entry["seconds"] += elapsed
+        if tracemalloc.is_tracing():
+            entry["peak_bytes"] = max(entry["peak_bytes"], tracemalloc.get_traced_memory()[1])
+        return False
+
+
+def _tile(sequences, length):
+    """Concatenate the loaded sequences (in order, repeating) up to `length` steps."""
+    pool = [d for seq in sequences.values() for d in seq]
+    reps, rest = divmod(length, len(pool))
+    return pool * reps + pool[:rest]
+
+
+def run_point(length, fingers, n_seeds, scroll_speed, out_dir, sequences_folder):
+    """Run the pipeline once for one grid point; returns {stage: {seconds, peak_bytes}}."""
+    stages: dict = {}
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+
+    with _Stage(stages, "load_sequences"):
+        state_sequences = load_sequences.load_sequences(sequences_folder)
+    seq = _tile(state_sequences, length)
+
+    for seed in range(n_seeds):
+        with _Stage(stages, "generate_states"):
+            chords, _ = generate_states.generate_states(
+                config.pitches_left, config.pitches_right,
+                n_left=config.CHORDS_LEFT_HAND, n_right=config.CHORDS_RIGHT_HAND,
+                n_cross=config.CHORDS_CROSS_HAND, fingers_used=fingers, seed=seed,
+            )
+        with _Stage(stages, "capture_notes"):
+            templates = StateTemplates(chords, maps)
+            notes = capture_notes_columnar(seq, chords, fingers, config.TEMPO, maps,
+                                           templates=templates)
+        with _Stage(stages, "write_midi"):
+            midi_path = write_midi("bench", notes, tempo=config.TEMPO, seed=seed, out_root=out_dir)
+        writer = PianoVisionJsonWriter(bpm=config.TEMPO, visual_speed=scroll_speed)
+        with _Stage(stages, "build_json"):
+            right, left = notes.hand(0), notes.hand(1)
+            writer.build_json(right, left, "bench")
+        with _Stage(stages, "json_dump"):
+            writer.write(midi_path.with_suffix(writer.suffix), right, left, "bench")
+    return stages, len(notes) * n_seeds
+
+
+def run_grid(lengths, fingers, seeds, scroll_speeds, *, repeat=1, memory=True):
+    """
+    Run every grid point. Timings are the best of `repeat` runs without tracing;
+    peak memory comes from one extra traced run when `memory` is set.
+    """
+    sequences_folder = Path(__file__).parent / "state_sequences"
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        out_dir = Path(tmp)
+        for length in lengths:
+            for f in fingers:
+                for n_seeds in seeds:
+                    for speed in scroll_speeds:
+                        params = {"length": length, "fingers_used": f,
+                                  "seeds": n_seeds, "scroll_speed": speed}
+                        entry = {"params": params}
+                        try:
+                            best = None
+                            for _ in range(repeat):
+                                stages, n_notes = run_point(length, f, n_seeds, speed,
+                                                            out_dir, sequences_folder)
+                                if best is None:
+                                    best = stages
+                                else:
+                                    for name, st in stages.items():
+                                        best[name]["seconds"] = min(best[name]["seconds"],
+                                                                    st["seconds"])
+                            if memory:
+                                tracemalloc.start()
+                                traced, _ = run_point(length, f, n_seeds, speed,
+                                                      out_dir, sequences_folder)
+                                tracemalloc.stop()
+                                for name, st in traced.items():
+                                    best[name]["peak_bytes"] = st["peak_bytes"]
+                            entry["notes"] = n_notes
+                            entry["stages"] = best
+                        except Exception as e:
+                            # e.g. FINGERS_USED=10 cannot produce 9 distinct states
+                            if tracemalloc.is_tracing():
+                                tracemalloc.stop()
+                            entry["error"] = f"{type(e).__name__}: {e}"
+                        results.append(entry)
+                        _print_entry(entry)
+    return results
+
+
+def memory_check(lengths, chunk_steps=MEMORY_CHUNK_STEPS, scroll_speed=20.0):
+    """
+    Render one uniformly random generated sequence per length in chunked mode.
+
+    The sequences come from a sequence_grammar.GeneratedSequence, so no index
+    list exists either; only the rendering's own memory is measured.
+
+    Returns:
+        list[tuple[int, int, float]]: (length, peak traced bytes, seconds) per length.
+    """
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+    chords, _ = generate_states.generate_states(
+        config.pitches_left, config.pitches_right,
+        n_left=config.CHORDS_LEFT_HAND, n_right=config.CHORDS_RIGHT_HAND,
+        n_cross=config.CHORDS_CROSS_HAND, fingers_used=config.FINGERS_USED, seed=1,
+    )
+    templates = StateTemplates(chords, maps)
+    grammar = TransitionGrammar([[1] * len(chords)] * len(chords))
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for length in lengths:
+            # the JSON encoder leaves reference cycles behind; don't count the last run's
+            gc.collect()
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            render_sequence("memcheck", GeneratedSequence(grammar, length, seed=1), chords,
+                            config.FINGERS_USED, tempo=config.TEMPO, maps=maps,
+                            out_root=Path(tmp), seed=1, scroll_speed=scroll_speed,
+                            templates=templates, chunk_steps=chunk_steps)
+            elapsed = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows.append((length, peak, elapsed))
+            print(f"len={length:>9}  peak={peak / 1e6:6.2f}MB  {elapsed:7.2f}s")
+    return rows
+
+
+def _imported_modules(args, out_dir):
+    """Names of all modules a main.py run with these arguments imports."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", str(Path(config.__file__)),
+                           *args, "--out-root", str(out_dir)],
+                          capture_output=True, text=True, check=True)
+    return {line.rsplit("|", 1)[1].strip() for line in proc.stderr.splitlines()
+            if line.startswith("import time:") and "|" in line}
+
+
+def startup_check(repeat=5):
+    """
+    Time cold starts of main.py against a bare interpreter and check which
+    modules each mode imports.
+
+    Returns:
+        (rows, problems): rows of (case, best seconds, seconds over the bare
+        interpreter); problems lists budget overruns and forbidden imports.
+    """
+    def cold(cmd):
+        return lambda: subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+
+    main_py = str(Path(config.__file__))
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        bare = _best_of(cold([sys.executable, "-c", "pass"]), repeat)
+        rows = [("bare python", bare, 0.0)]
+        for case, args in STARTUP_CASES.items():
+            best = _best_of(cold([sys.executable, main_py, *args, "--out-root", tmp]), repeat)
+            rows.append((case, best, best - bare))
+            if (best - bare) * 1e3 > STARTUP_BUDGET_MS:
+                problems.append(f"{case}: {(best - bare) * 1e3:.1f}ms over a bare interpreter "
+                                f"(budget {STARTUP_BUDGET_MS:.0f}ms)")
+        for case, modules in STARTUP_FORBIDDEN.items():
+            imported = _imported_modules([f"--{case}"], tmp)
+            for name in modules:
+                if name in imported:
+                    problems.append(f"{case}: imports {name}")
+    return rows, problems
+
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def micro_routing(length, repeat=3):
+    """
+    Time the capture loop's per-note routing and chord set operations, with
+    sets/dicts and with tables/bitmasks, on a random `length`-step sequence.
+
+    Returns:
+        list[tuple[str, float, float]]: (case, seconds with sets, seconds with masks).
+    """
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+    chords, _ = generate_states.generate_states(
+        config.pitches_left, config.pitches_right,
+        n_left=config.CHORDS_LEFT_HAND, n_right=config.CHORDS_RIGHT_HAND,
+        n_cross=config.CHORDS_CROSS_HAND, fingers_used=config.FINGERS_USED, seed=1,
+    )
+    rng = random.Random(1)
+    seq = [rng.randrange(len(chords)) for _ in range(length)]
+    masks = [pitch_mask(c) for c in chords]
+    lh_keys, lh_fingers, rh_fingers = maps.lh_keys, maps.lh_fingers, maps.rh_fingers
+    track_table, finger_table = maps.track_table, maps.finger_table
+    pitch_tuples = [tuple(c) for c in chords]
+
+    # both walk the same pitch tuples and keep what they routed; only the lookups differ
+    def route_sets():
+        routed = []
+        for d in seq:
+            for p in pitch_tuples[d]:
+                t = 1 if p in lh_keys else 0
+                routed.append((t, (lh_fingers.get(p) if t == 1 else rh_fingers.get(p)) or 0))
+        return routed
+
+    def route_tables():
+        routed = []
+        for d in seq:
+            for p in pitch_tuples[d]:
+                routed.append((track_table[p], finger_table[p]))
+        return routed
+
+    lh_set, lh_mask = frozenset(lh_keys), maps.lh_mask
+
+    def overlap_sets():
+        prev = chords[seq[0]]
+        for d in seq:
+            cur = chords[d]
+            len(cur & prev)
+            len(cur & lh_set)
+            prev = cur
+
+    def overlap_masks():
+        prev = masks[seq[0]]
+        for d in seq:
+            cur = masks[d]
+            popcount(cur & prev)
+            popcount(cur & lh_mask)
+            prev = cur
+
+    return [("route notes", _best_of(route_sets, repeat), _best_of(route_tables, repeat)),
+            ("chord overlap", _best_of(overlap_sets, repeat), _best_of(overlap_masks, repeat))]
+
+
+def _print_entry(entry):
+    p = entry["params"]
+    head = (f"len={p['length']:>8} fingers={p['fingers_used']:>2} "
+            f"seeds={p['seeds']:>3} speed={p['scroll_speed']:>5}")
+    if "error" in entry:
+        print(f"{head}  skipped ({entry['error']})")
+        return
+    cells = "  ".join(f"{name}={entry['stages'][name]['seconds'] * 1e3:8.1f}ms"
+                      for name in STAGES)
+    peak = max(st["peak_bytes"] for st in entry["stages"].values())
+    print(f"{head}  {cells}  peak={peak / 1e6:.1f}MB")
+
+
+def compare(current, baseline, threshold):
+    """
+    Compare stage timings of two result lists (matched by params).
+
+    Returns a list of (params, stage, old_seconds, new_seconds) for every stage
+    that got slower by more than `threshold` (e.g. 0.2 = 20%).
+    """
+    def _key(entry):
+        return json.dumps(entry["params"], sort_keys=True)
+
+    old = {_key(e): e for e in baseline if "stages" in e}
+    regressions = []
+    for entry in current:
+        ref = old.get(_key(entry))
+        if ref is None or "stages" not in entry:
+            continue
+        for name in STAGES:
+            before = ref["stages"].get(name, {}).get("seconds")
+            after = entry["stages"].get(name, {}).get("seconds")
+            if before and after and after > before * (1.0 + threshold):
+                regressions.append((entry["params"], name, before, after))
+    return regressions
+
+
+def _int_list(text):
+    return config.parse_seeds(text)
+
+
+def _float_list(text):
+    return [float(x) for x in text.split(",") if x.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the stimulus generation pipeline.")
+    parser.add_argument("--grid", choices=sorted(GRIDS), default="quick",
+                        help="preset parameter grid (individual options override it)")
+    parser.add_argument("--lengths", type=_int_list, help='sequence lengths, e.g. "72,1000000"')
+    parser.add_argument("--fingers", type=_int_list, help='FINGERS_USED values, e.g. "1-10"')
+    parser.add_argument("--seeds", type=_int_list, help='seed counts per point, e.g. "1,10"')
+    parser.add_argument("--scroll-speeds", type=_float_list, help='SCROLL_SPEED values, e.g. "1,20"')
+    parser.add_argument("--repeat", type=int, default=3, help="timing runs per point (best is kept)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced peak-memory run")
+    parser.add_argument("--micro", action="store_true",
+                        help="time note routing / chord checks with sets vs pitch tables "
+                             "and bitmasks (length: first of --lengths, default 100000)")
+    parser.add_argument("--memory-check", action="store_true",
+                        help="check that chunked rendering keeps peak memory flat as the "
+                             f"sequence grows (default lengths: {MEMORY_LENGTHS})")
+    parser.add_argument("--chunk-steps", type=int, default=MEMORY_CHUNK_STEPS,
+                        help="window size for --memory-check")
+    parser.add_argument("--startup", action="store_true",
+                        help="check main.py cold-start time against STARTUP_BUDGET_MS and that "
+                             "--states-only / --json-only skip the modules they do not need")
+    parser.add_argument("--out", type=Path, help="write results JSON here")
+    parser.add_argument("--compare", type=Path, help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown per stage before it counts as a regression")
+    args = parser.parse_args(argv)
+
+    if args.micro:
+        length = (args.lengths or [100_000])[0]
+        for case, sets, masks in micro_routing(length, max(1, args.repeat)):
+            print(f"{case:<14} {length} steps: sets {sets * 1e3:8.1f}ms  "
+                  f"tables/masks {masks * 1e3:8.1f}ms  ({sets / masks:.2f}x)")
+        return
+
+    if args.startup:
+        rows, problems = startup_check(max(1, args.repeat))
+        for case, best, over in rows:
+            print(f"{case:<12} {best * 1e3:7.1f}ms" + (f"  (+{over * 1e3:.1f}ms)" if over else ""))
+        if problems:
+            print(f"{len(problems)} startup problem(s):")
+            for problem in problems:
+                print(f" - {problem}")
+            sys.exit(1)
+        print(f"Cold starts within {STARTUP_BUDGET_MS:.0f}ms of a bare interpreter; "
+              f"no unneeded imports.")
+        return
+
+    if args.memory_check:
+        rows = memory_check(args.lengths or MEMORY_LENGTHS, args.chunk_steps)
+        base, worst = rows[0][1], max(peak for _, peak, _ in rows)
+        if worst > base * (1.0 + MEMORY_TOLERANCE):
+            print(f"Peak memory grew {worst / base - 1:+.0%} with the sequence length "
+                  f"(allowed: {MEMORY_TOLERANCE:.0%})")
+            sys.exit(1)
+        print(f"Peak memory flat within {MEMORY_TOLERANCE:.0%} "
+              f"({base / 1e6:.2f}MB -> {worst / 1e6:.2f}MB).")
+        return
+
+    grid = dict(GRIDS[args.grid])
+    for name in ("lengths", "fingers", "seeds", "scroll_speeds"):
+        if getattr(args, name):
+            grid[name] = getattr(args, name)
+
+    results = run_grid(grid["lengths"], grid["fingers"], grid["seeds"], grid["scroll_speeds"],
+                       repeat=max(1, args.repeat), memory=not args.no_memory)
+
+    if args.out:
+        payload = {
+            "meta": {
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "grid": grid,
+                "repeat": args.repeat,
+            },
+            "results": results,
+        }
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(payload, fh, indent=2)
+        print(f"Wrote benchmark results to: {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for params, stage, before, after in regressions:
+                print(f" - {params} {stage}: {before * 1e3:.1f}ms -> {after * 1e3:.1f}ms "
+                      f"({after / before - 1:+.0%})")
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
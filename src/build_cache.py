@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+# Bump when the manifest layout changes (old manifests are then ignored)
+MANIFEST_VERSION = 1
+MANIFEST_NAME = ".build_manifest.json"
+
+
+def input_key(**inputs: Any) -> str:
+    """
+    Hash the inputs of one render into a content address.
+
+    Values must be JSON-serializable after sets/frozensets are turned into
+    sorted lists (done here); dict keys are sorted so the key is stable.
+    """
+    def _plain(value):
+        if isinstance(value, (set, frozenset)):
+            return sorted(_plain(v) for v in value)
+        if isinstance(value, dict):
+            return {str(k): _plain(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [_plain(v) for v in value]
+        if hasattr(value, "tolist"):      # array.array
+            return value.tolist()
+        return value
+
+    blob = json.dumps(_plain(inputs), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class BuildCache:
+    """
+    Per-seed manifest of rendered outputs, keyed by a hash of their inputs.
+
+    The manifest lives in the seed folder (seed_<n>/.build_manifest.json), so
+    batch workers rendering different seeds never touch the same file. An
+    entry is up to date when its input key matches and every recorded output
+    still exists with the recorded size.
+    """
+
+    def __init__(self, seed_dir: Path, *, force: bool = False):
+        self.path = Path(seed_dir) / MANIFEST_NAME
+        self.force = force
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.hits: List[str] = []
+        self.rebuilds: List[str] = []
+        if not force:
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == MANIFEST_VERSION:
+            self.entries = data.get("outputs", {})
+
+    def is_fresh(self, name: str, key: str, paths: Sequence[Path]) -> bool:
+        """Return True (and count a hit) if `name` was built from `key` and is intact."""
+        entry = self.entries.get(name)
+        fresh = (
+            not self.force
+            and entry is not None
+            and entry.get("key") == key
+            and entry.get("files") == [p.name for p in paths]
+            and all(p.is_file() and p.stat().st_size == size
+                    for p, size in zip(paths, entry.get("sizes", [])))
+        )
+        if fresh:
+            self.hits.append(name)
+        return fresh
+
+    def record(self, name: str, key: str, paths: Sequence[Path]) -> None:
+        """Record that `name` was (re)built from `key` into `paths`."""
+        self.entries[name] = {
+            "key": key,
+            "files": [p.name for p in paths],
+            "sizes": [p.stat().st_size for p in paths],
+        }
+        self.rebuilds.append(name)
+
+    def save(self) -> None:
+        """Write the manifest atomically (temp file + replace)."""
+        if not self.rebuilds and self.path.exists():
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump({"version": MANIFEST_VERSION, "outputs": self.entries}, fh,
+                      indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
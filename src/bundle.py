@@ -0,0 +1,299 @@
+"""
+Bundle output: write the files of a seed (or a whole batch) into one archive.
+
+Instead of one .mid, .pv.json and states_seed_<n>.txt file per output, every
+file goes into a single .zip or (uncompressed) .tar archive, under the same
+relative path it would have in generated_midis/ (e.g. seed_4/seed_4_Block_1.mid).
+An index.json member listing every file (seed, kind, size) is written last.
+
+Both formats can be read without unpacking everything: zip through its
+central directory, tar by seeking from header to header. To pull out one
+participant's files:
+
+    python src/bundle.py generated_midis/seeds_1-300.zip --seed 42 --out extracted/
+    python src/bundle.py generated_midis/seed_20.tar --list
+"""
+import argparse
+import io
+import json
+import os
+import re
+import tarfile
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+FORMATS = ("zip", "tar")
+INDEX_NAME = "index.json"
+INDEX_VERSION = 1
+
+_SEED_RE = re.compile(r"^(?:seed_|states_seed_)(-?\d+)(?:[/._]|$)")
+_KINDS = ((".pv.json.gz", "json"), (".pv.json", "json"), (".mid", "midi"), (".txt", "states"))
+
+
+def _describe(arcname: str) -> Dict[str, object]:
+    """Index fields derived from an archive member name (seed + kind of file)."""
+    m = _SEED_RE.match(arcname)
+    kind = next((k for suffix, k in _KINDS if arcname.endswith(suffix)), "other")
+    return {"seed": int(m.group(1)) if m else None, "kind": kind}
+
+
+class _Bundle(ABC):
+    """Common part of the archive sinks: path mapping and the index."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.index: Dict[str, Dict[str, object]] = {}
+
+    def arcname(self, path: Path) -> str:
+        """Archive member name for a path under root (the layout of generated_midis/)."""
+        return PurePosixPath(Path(path).relative_to(self.root)).as_posix()
+
+    def size(self, path: Path) -> int:
+        """Size in bytes of a file already written to the bundle."""
+        return self.index[self.arcname(path)]["size"]
+
+    @contextmanager
+    def open(self, path: Path) -> Iterator[io.BufferedIOBase]:
+        """Binary file object for `path`; the member is complete when the block exits."""
+        buf = io.BytesIO()
+        yield buf
+        self.add(path, buf.getvalue())
+
+    def add(self, path: Path, data: bytes) -> None:
+        arcname = self.arcname(path)
+        self._add(arcname, data)
+        self.index[arcname] = dict(_describe(arcname), size=len(data))
+
+    @abstractmethod
+    def _add(self, arcname: str, data: bytes) -> None:
+        """Store one complete member."""
+
+    def index_bytes(self) -> bytes:
+        return json.dumps({"version": INDEX_VERSION, "files": self.index},
+                          indent=2, sort_keys=True).encode("utf-8")
+
+
+class BundleWriter(_Bundle):
+    """
+    Stream files into one .zip or .tar archive at `archive_path`.
+
+    Paths passed to open()/add() must lie under `root`; they are stored
+    relative to it. Use as a context manager; index.json is added on close.
+    If the block raises, the partial archive is deleted instead (abort()), so
+    an archive with an index is always complete. Not thread-safe: write from one thread at a time.
+    """
+
+    def __init__(self, archive_path: Path, root: Path, fmt: str = "zip",
+                 compress: bool = False):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown bundle format {fmt!r} (expected one of {FORMATS})")
+        super().__init__(root)
+        self.path = Path(archive_path)
+        self.fmt = fmt
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # fixed member timestamps keep the archive reproducible
+        if fmt == "zip":
+            self._zip = zipfile.ZipFile(
+                self.path, "w",
+                compression=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+            self._tar = None
+        else:
+            self._zip = None
+            self._tar = tarfile.open(self.path, "w", format=tarfile.PAX_FORMAT)
+
+    @contextmanager
+    def open(self, path: Path) -> Iterator[io.BufferedIOBase]:
+        if self._zip is None:
+            # tar headers need the size up front, so buffer the member
+            with super().open(path) as fh:
+                yield fh
+            return
+        arcname = self.arcname(path)
+        info = zipfile.ZipInfo(arcname, date_time=(1980, 1, 1, 0, 0, 0))
+        info.compress_type = self._zip.compression
+        with self._zip.open(info, "w", force_zip64=True) as fh:
+            yield fh
+        self.index[arcname] = dict(_describe(arcname), size=info.file_size)
+
+    def _add(self, arcname: str, data: bytes) -> None:
+        if self._zip is not None:
+            info = zipfile.ZipInfo(arcname, date_time=(1980, 1, 1, 0, 0, 0))
+            self._zip.writestr(info, data, compress_type=self._zip.compression)
+        else:
+            info = tarfile.TarInfo(arcname)
+            info.size = len(data)
+            info.mtime = 0
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def add_members(self, members: List[Tuple[str, bytes]]) -> None:
+        """Add members collected elsewhere (e.g. a MemoryBundle from a batch worker)."""
+        for arcname, data in members:
+            self._add(arcname, data)
+            self.index[arcname] = dict(_describe(arcname), size=len(data))
+
+    def close(self) -> None:
+        """Write index.json and finish the archive."""
+        archive = self._zip or self._tar
+        if archive is None:
+            return
+        self._add(INDEX_NAME, self.index_bytes())
+        archive.close()
+        self._zip = self._tar = None
+
+    def abort(self) -> None:
+        """Close the archive without an index and delete it (it would be incomplete)."""
+        archive = self._zip or self._tar
+        if archive is None:
+            return
+        self._zip = self._tar = None
+        try:
+            archive.close()
+        finally:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+
+class MemoryBundle(_Bundle):
+    """
+    Collect bundle members in memory (batch workers hand them to the process
+    that owns the archive).
+    """
+
+    def __init__(self, root: Path):
+        super().__init__(root)
+        self.members: List[Tuple[str, bytes]] = []
+
+    def _add(self, arcname: str, data: bytes) -> None:
+        self.members.append((arcname, data))
+
+
+Bundle = Union[BundleWriter, MemoryBundle]
+
+
+def bundle_path(out_root: Path, name: str, fmt: str = "zip") -> Path:
+    """Archive path for a bundle, e.g. out_root/seed_20.zip."""
+    return Path(out_root) / f"{name}.{fmt}"
+
+
+# --- Reading ---
+
+def read_index(archive_path: Path) -> Dict[str, Dict[str, object]]:
+    """Return the index ({member name: {seed, kind, size}}) of a bundle."""
+    with _Reader(archive_path) as reader:
+        return reader.index()
+
+
+def extract_seed(archive_path: Path, seed: int, dest: Path) -> List[Path]:
+    """
+    Extract the files of one seed (participant) from a bundle into dest.
+
+    Only the seed's members are read; the rest of the archive is skipped.
+    Files keep their relative layout (dest/seed_<n>/..., dest/states_seed_<n>.txt).
+
+    Returns:
+        List[Path]: The extracted files.
+    """
+    dest = Path(dest)
+    written = []
+    with _Reader(archive_path) as reader:
+        names = [name for name, entry in reader.index().items() if entry.get("seed") == seed]
+        for name in names:
+            target = dest / PurePosixPath(name)
+            if dest.resolve() not in target.resolve().parents:
+                raise ValueError(f"Refusing to extract {name!r} outside {dest}")
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with open(target, "wb") as fh:
+                fh.write(reader.read(name))
+            written.append(target)
+    return written
+
+
+class _Reader:
+    """Random access to the members of a zip or uncompressed tar bundle."""
+
+    def __init__(self, archive_path: Path):
+        self.path = Path(archive_path)
+        if zipfile.is_zipfile(self.path):
+            self._zip: Optional[zipfile.ZipFile] = zipfile.ZipFile(self.path)
+            self._tar = None
+            self._members = None
+        else:
+            self._zip = None
+            # plain "r:" lets tarfile seek past member data while listing headers
+            self._tar = tarfile.open(self.path, "r:")
+            self._members = {m.name: m for m in self._tar.getmembers()}
+
+    def index(self) -> Dict[str, Dict[str, object]]:
+        try:
+            data = json.loads(self.read(INDEX_NAME))
+        except KeyError:
+            data = None
+        if data and data.get("version") == INDEX_VERSION:
+            return data["files"]
+        # no (usable) index: rebuild it from the member list
+        if self._zip is not None:
+            sizes = {i.filename: i.file_size for i in self._zip.infolist()}
+        else:
+            sizes = {name: m.size for name, m in self._members.items()}
+        return {name: dict(_describe(name), size=size)
+                for name, size in sizes.items() if name != INDEX_NAME}
+
+    def read(self, name: str) -> bytes:
+        if self._zip is not None:
+            return self._zip.read(name)
+        return self._tar.extractfile(self._members[name]).read()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        (self._zip or self._tar).close()
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List or extract files from an output bundle.")
+    parser.add_argument("archive", type=Path, help="bundle archive (.zip or .tar)")
+    parser.add_argument("--seed", type=int, help="extract the files of this seed")
+    parser.add_argument("--out", type=Path, default=Path("."),
+                        help="folder to extract into (default: current folder)")
+    parser.add_argument("--list", action="store_true", help="list the seeds in the bundle")
+    args = parser.parse_args(argv)
+
+    if args.seed is None or args.list:
+        per_seed: Dict[object, List[int]] = {}
+        for entry in read_index(args.archive).values():
+            counts = per_seed.setdefault(entry.get("seed"), [0, 0])
+            counts[0] += 1
+            counts[1] += entry.get("size", 0)
+        for seed, (n, size) in sorted(per_seed.items(), key=lambda kv: (kv[0] is None, kv[0] or 0)):
+            print(f" - seed {seed}: {n} files, {size / 1e6:.2f} MB")
+        if args.seed is None:
+            return
+
+    t0 = time.perf_counter()
+    files = extract_seed(args.archive, args.seed, args.out)
+    if not files:
+        raise SystemExit(f"Error: seed {args.seed} is not in {args.archive}")
+    print(f"Extracted {len(files)} files for seed {args.seed} to {args.out} "
+          f"in {time.perf_counter() - t0:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,152 @@
 import random, itertools
 from collections import defaultdict
+from collections.abc import Sequence
+from math import ceil, comb, log
+
+from pitch_mask import pitch_mask
 
 # 2 nur links 2 nur recht 5 beide
 
+SAMPLERS = ("legacy", "floyd")
+
 
-def generate_states(pitches_left, pitches_right, n_left, n_right,n_cross, fingers_used = 2,  seed = None,):
+class CombinationSpace(Sequence):
     """
-    Generate chord states from two pitch dictionaries. A seed is manditory to replicate states if needed.
-    It generets chords left-left, right-right, left-right
-    The order of the chords will be shuffeld before returned
+    Lazy, indexable view of itertools.combinations(items, k) in its usual
+    lexicographic order, optionally restricted to combinations that take at
+    least one item from each hand (the first `n_first` items vs the rest).
 
-    Args:
-        pitches_left (dict[str, int]): Mapping note names to MIDI values for left hand.
-        pitches_right (dict[str, int]): Mapping note names to MIDI values for right hand.
-        n_left (int): Number of left-hand chords to sample.
-        n_right (int): Number of right-hand chords to sample.
-        n_cross (int): Number of cross-hand chords to sample.
-        seed (int | None): Random seed for reproducibility.
+    Nothing is materialized: len() is computed by counting and the r-th
+    combination is produced by unranking, in O(len(items) * k) time and
+    O(k) memory. Items are returned as frozensets like the old lists held.
+    """
 
-    Returns:
-        list[frozenset[int]]: A list of chords, where each chord is a frozenset of two MIDI pitches.
-        int seed (which seed)
+    def __init__(self, items, k, n_first=None):
+        self.items = list(items)
+        self.k = k
+        self.n_first = n_first      # None = no "both hands" constraint
+        self._len = self._count(0, k, False, False) if k >= 0 else 0
 
-    Example:
-        >>> generate_states({"C4": 60, "D4": 62}, {"C5": 72, "E5": 76}, seed=1)
-        [frozenset({60, 62}), frozenset({72, 76}), frozenset({60, 72})]
+    def _count(self, start, r, has_first, has_second):
+        """Number of valid completions choosing r more items from positions >= start."""
+        n = len(self.items) - start
+        total = comb(n, r) if n >= 0 else 0
+        if self.n_first is None:
+            return total
+        n_first = max(self.n_first - start, 0)
+        n_second = n - n_first
+        # inclusion–exclusion over "no first-hand item" / "no second-hand item"
+        if not has_first:
+            total -= comb(n_second, r)
+        if not has_second:
+            total -= comb(n_first, r)
+        if not has_first and not has_second and r == 0:
+            total += 1
+        return total
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, rank):
+        if rank < 0:
+            rank += self._len
+        if not 0 <= rank < self._len:
+            raise IndexError("combination rank out of range")
+        chosen = []
+        has_first = has_second = False
+        pos = 0
+        for r in range(self.k, 0, -1):
+            # skip candidate positions whose block of completions lies before `rank`
+            while True:
+                first = self.n_first is not None and pos < self.n_first
+                block = self._count(pos + 1, r - 1,
+                                    has_first or first,
+                                    has_second or (self.n_first is not None and not first))
+                if rank < block:
+                    break
+                rank -= block
+                pos += 1
+            chosen.append(self.items[pos])
+            if self.n_first is not None:
+                if pos < self.n_first:
+                    has_first = True
+                else:
+                    has_second = True
+            pos += 1
+        return frozenset(chosen)
+
+    def __iter__(self):
+        items = self.items
+        for idx in itertools.combinations(range(len(items)), self.k):
+            if self.n_first is None or (idx and idx[0] < self.n_first <= idx[-1]):
+                yield frozenset(items[i] for i in idx)
+
+
+def sample_ranks(rng, n, k, sampler="legacy"):
     """
-    if seed is None:
-        raise ValueError("You must provide a random seed for reproducibility.")
-    
-    rng = random.Random(seed)
-    
+    Draw k distinct ranks from range(n) without building the population.
+
+    sampler="legacy" makes exactly the random draws of rng.sample(population, k)
+    for a population of length n, so seeds keep selecting the same chords they
+    did when generate_states sampled from materialized lists. The pool
+    swaps are kept in a dict, so memory stays O(k).
+
+    sampler="floyd" uses Robert Floyd's algorithm: exactly k draws, O(k) memory.
+    Selections differ from "legacy" for the same seed.
+    """
+    if not 0 <= k <= n:
+        raise ValueError("Sample larger than population or is negative")
+    if sampler == "floyd":
+        selected = {}
+        for j in range(n - k, n):
+            t = rng.randrange(j + 1)
+            selected[j if t in selected else t] = None
+        ranks = list(selected)
+        rng.shuffle(ranks)
+        return ranks
+    if sampler != "legacy":
+        raise ValueError(f"Unknown sampler {sampler!r} (expected one of {SAMPLERS})")
+
+    # mirrors random.Random.sample (CPython 3.x) step for step
+    result = []
+    setsize = 21
+    if k > 5:
+        setsize += 4 ** ceil(log(k * 3, 4))
+    if n <= setsize:
+        pool = {}                      # sparse Fisher–Yates pool: index -> rank
+        for i in range(k):
+            j = rng.randrange(n - i)
+            result.append(pool.get(j, j))
+            pool[j] = pool.get(n - i - 1, n - i - 1)
+    else:
+        selected = set()
+        for i in range(k):
+            j = rng.randrange(n)
+            while j in selected:
+                j = rng.randrange(n)
+            selected.add(j)
+            result.append(j)
+    return result
+
+
+def _sample_space(rng, space, k, sampler):
+    return [space[r] for r in sample_ranks(rng, len(space), k, sampler)]
+
 
+def plan_states(pitches_left, pitches_right, n_left, n_right, n_cross, fingers_used=2):
+    """
+    Build the seed-independent part of generate_states: which chord spaces are
+    sampled from, how many chords each, in draw order.
+
+    Returns:
+        list[tuple[Sequence[frozenset[int]], int]]: (chord space, number of chords) pairs.
+    """
     L = list(pitches_left.values())
     R = list(pitches_right.values())
 
     if fingers_used <= 5:
-        all_chords_left = [frozenset(combo) for combo in itertools.combinations(L, fingers_used)]
-        all_chords_right = [frozenset(combo) for combo in itertools.combinations(R,fingers_used)]
+        all_chords_left = CombinationSpace(L, fingers_used)
+        all_chords_right = CombinationSpace(R, fingers_used)
     else:
         n_left = 0
         n_right = 0
@@ -45,16 +154,19 @@ def generate_states(pitches_left, pitches_right, n_left, n_right,n_cross, finger
 
 
     # Cross-hand: mindestens 1 von links UND mindestens 1 von rechts
-    all_chords_cross = []
     if fingers_used <= 1:
-        all_chords_cross = [frozenset(combo) for combo in itertools.combinations(L+R, fingers_used)]
-    else:
+        all_chords_cross = CombinationSpace(L+R, fingers_used)
+    elif pitch_mask(L) & pitch_mask(R):
+        # a pitch in both hands counts for both sides; keep the original filter
+        mask_l, mask_r = pitch_mask(L), pitch_mask(R)
+        all_chords_cross = []
         for combo in itertools.combinations(L+R, fingers_used):
             # Prüfe ob mindestens eine Note aus L und mindestens eine aus R dabei ist
-            has_left = any(note in L for note in combo)
-            has_right = any(note in R for note in combo)
-            if has_left and has_right:
+            combo_mask = pitch_mask(combo)
+            if combo_mask & mask_l and combo_mask & mask_r:
                 all_chords_cross.append(frozenset(combo))
+    else:
+        all_chords_cross = CombinationSpace(L+R, fingers_used, n_first=len(L))
 
     # to prevent errors that not enough chords for rng.sample
     if fingers_used == 4:
@@ -76,12 +188,55 @@ def generate_states(pitches_left, pitches_right, n_left, n_right,n_cross, finger
         x = 9 - (n_left+n_right+n_cross)
         n_cross += x
 
-    states = []
+    plan = []
     if fingers_used <=5: ## one handed not possible therefore deactivated
-        states.extend(rng.sample(all_chords_left, n_left))
-        states.extend(rng.sample(all_chords_right, n_right))
-    states.extend(rng.sample(all_chords_cross, n_cross))
+        plan.append((all_chords_left, n_left))
+        plan.append((all_chords_right, n_right))
+    plan.append((all_chords_cross, n_cross))
+    return plan
+
+
+def draw_states(rng, plan, sampler="legacy"):
+    """Sample the chords of a plan_states plan with rng and shuffle them (generate_states order)."""
+    states = []
+    for space, n in plan:
+        states.extend(_sample_space(rng, space, n, sampler))
     rng.shuffle(states)
+    return states
+
+
+def generate_states(pitches_left, pitches_right, n_left, n_right,n_cross, fingers_used = 2,  seed = None,
+                    sampler = "legacy"):
+    """
+    Generate chord states from two pitch dictionaries. A seed is manditory to replicate states if needed.
+    It generets chords left-left, right-right, left-right
+    The order of the chords will be shuffeld before returned
+
+    Args:
+        pitches_left (dict[str, int]): Mapping note names to MIDI values for left hand.
+        pitches_right (dict[str, int]): Mapping note names to MIDI values for right hand.
+        n_left (int): Number of left-hand chords to sample.
+        n_right (int): Number of right-hand chords to sample.
+        n_cross (int): Number of cross-hand chords to sample.
+        seed (int | None): Random seed for reproducibility.
+        sampler (str): "legacy" (default) reproduces the selections of earlier versions
+            for every seed; "floyd" uses Floyd's sampling (different selections).
+            Both draw chords by unranking, never materializing all combinations.
+
+    Returns:
+        list[frozenset[int]]: A list of chords, where each chord is a frozenset of two MIDI pitches.
+        int seed (which seed)
+
+    Example:
+        >>> generate_states({"C4": 60, "D4": 62}, {"C5": 72, "E5": 76}, seed=1)
+        [frozenset({60, 62}), frozenset({72, 76}), frozenset({60, 72})]
+    """
+    if seed is None:
+        raise ValueError("You must provide a random seed for reproducibility.")
+    
+    rng = random.Random(seed)
+    states = draw_states(rng, plan_states(pitches_left, pitches_right, n_left, n_right,
+                                          n_cross, fingers_used), sampler)
 
 
     ## create txt to list the states
@@ -111,21 +266,27 @@ def generate_states(pitches_left, pitches_right, n_left, n_right,n_cross, finger
     return states, states_listed
 
 
-def write_states_file(out_dir, states_listed, seed):
+def write_states_file(out_dir, states_listed, seed, verbose=True, bundle=None):
     """Write the human-readable states_listed to out_dir/states_seed_<seed>.txt.
 
     This is a small helper so callers (like main) can keep their code tidy.
     It swallows errors and prints a warning rather than raising.
+    Set verbose=False to skip the success message (used by batch workers).
+    With a bundle (see bundle.py) the file is added to that archive instead.
     """
     try:
         from pathlib import Path
         out_dir = Path(out_dir)
-        out_dir.mkdir(parents=True, exist_ok=True)
         out_file = out_dir / f"states_seed_{seed}.txt"
-        with open(out_file, "w", encoding="utf-8") as fh:
-            for idx, line in enumerate(states_listed):
-                fh.write(f"state{idx}: {line}\n")
-        print(f"Wrote states list to: {out_file}")
+        text = "".join(f"state{idx}: {line}\n" for idx, line in enumerate(states_listed))
+        if bundle is not None:
+            bundle.add(out_file, text.encode("utf-8"))
+        else:
+            out_dir.mkdir(parents=True, exist_ok=True)
+            with open(out_file, "w", encoding="utf-8") as fh:
+                fh.write(text)
+        if verbose:
+            print(f"Wrote states list to: {out_file}")
         # if states_listed:
         #     print("state0:", states_listed[0])
     except Exception as e:
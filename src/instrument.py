@@ -0,0 +1,180 @@
+"""
+Opt-in per-stage instrumentation for the render pipeline.
+
+Enable with the environment variables below (or main.py --trace / --profile,
+which set them so batch worker processes inherit the setting):
+
+    BIND_TRACE=trace.json     record every stage and write a Chrome trace-event
+                              file (open in chrome://tracing or ui.perfetto.dev)
+    BIND_PROFILE=prof_dir     run a cProfile session per rendered sequence and
+                              dump it to prof_dir/<seed>_<sequence>.prof
+
+When neither is set, stage() returns a shared no-op object, so the hooks cost
+one function call and a global check (and cProfile / json are never imported).
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ENV_TRACE = "BIND_TRACE"
+ENV_PROFILE = "BIND_PROFILE"
+
+_trace_path: Optional[str] = os.environ.get(ENV_TRACE) or None
+_profile_dir: Optional[str] = os.environ.get(ENV_PROFILE) or None
+_events: List[Dict[str, Any]] = []
+_lock = threading.Lock()
+
+
+def configure(trace: Optional[str] = None, profile_dir: Optional[str] = None) -> None:
+    """Enable tracing and/or profiling for this process and any worker it starts."""
+    global _trace_path, _profile_dir
+    if trace:
+        _trace_path = str(trace)
+        os.environ[ENV_TRACE] = _trace_path
+    if profile_dir:
+        _profile_dir = str(profile_dir)
+        os.environ[ENV_PROFILE] = _profile_dir
+
+
+def enabled() -> bool:
+    return _trace_path is not None
+
+
+class _NullStage:
+    """Stand-in returned by stage() while tracing is off. Falsy, so callers can
+    skip computing expensive counters with `if st:`."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def set(self, **counters) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """One timed stage: wall + CPU time, plus counters such as bytes and notes."""
+
+    def __init__(self, name: str, args: Dict[str, Any]):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.cpu0 = time.process_time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.t0
+        cpu = time.process_time() - self.cpu0
+        args = dict(self.args, wall_ms=round(wall * 1e3, 3), cpu_ms=round(cpu * 1e3, 3))
+        event = {
+            "name": self.name, "cat": "render", "ph": "X",
+            # trace-event timestamps are microseconds; perf_counter is process-local,
+            # which is fine since every event carries its own pid
+            "ts": round(self.t0 * 1e6, 1), "dur": round(wall * 1e6, 1),
+            "pid": os.getpid(), "tid": threading.get_ident() % 100000,
+            "args": args,
+        }
+        with _lock:
+            _events.append(event)
+        return False
+
+    def __bool__(self):
+        return True
+
+    def set(self, **counters) -> None:
+        """Attach counters (e.g. bytes=..., notes=...) to this stage."""
+        self.args.update(counters)
+
+
+def stage(name: str, **args):
+    """Context manager timing one pipeline stage (a no-op unless tracing is on)."""
+    if _trace_path is None:
+        return _NULL_STAGE
+    return _Stage(name, args)
+
+
+def profile(label: str):
+    """Context manager running cProfile for one unit of work, if profiling is on."""
+    if _profile_dir is None:
+        return _NULL_STAGE
+    return _Profile(Path(_profile_dir) / f"{label}.prof")
+
+
+class _Profile:
+    def __init__(self, path: Path):
+        import cProfile
+        self.path = path
+        self.prof = cProfile.Profile()
+
+    def __enter__(self):
+        self.prof.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.prof.disable()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.prof.dump_stats(str(self.path))
+        return False
+
+    def __bool__(self):
+        return True
+
+    def set(self, **counters) -> None:
+        pass
+
+
+def drain() -> List[Dict[str, Any]]:
+    """Remove and return the events recorded so far (used to ship them out of workers)."""
+    with _lock:
+        events = list(_events)
+        _events.clear()
+    return events
+
+
+def extend(events: List[Dict[str, Any]]) -> None:
+    """Add events recorded in another process."""
+    with _lock:
+        _events.extend(events)
+
+
+def write_trace(path: Optional[str] = None) -> Optional[Path]:
+    """Write all recorded events as Chrome trace-event JSON and print a stage summary."""
+    path = path or _trace_path
+    if path is None:
+        return None
+    import json
+    events = drain()
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fh)
+
+    totals: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for e in events:
+        t = totals[e["name"]]
+        t["count"] += 1
+        for key in ("wall_ms", "cpu_ms", "bytes", "notes"):
+            value = e["args"].get(key)
+            if isinstance(value, (int, float)):
+                t[key] += value
+    print(f"Wrote trace ({len(events)} events) to: {path}")
+    for name, t in sorted(totals.items(), key=lambda kv: -kv[1]["wall_ms"]):
+        extra = ""
+        if t.get("notes"):
+            extra += f", {int(t['notes'])} notes"
+        if t.get("bytes"):
+            extra += f", {t['bytes'] / 1e6:.2f} MB"
+        print(f" - {name}: {int(t['count'])}x, wall {t['wall_ms']:.1f} ms, "
+              f"cpu {t['cpu_ms']:.1f} ms{extra}")
+    return Path(path)
@@ -1,116 +1,488 @@
+import gzip
+import io
 import json
+import threading
+from array import array
+from collections.abc import Sequence
+from functools import lru_cache
+from math import ceil
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, BinaryIO, Callable, Iterable, Iterator, TextIO, Tuple, Union
 
-def _build_measures(bpm: float, ts: Tuple[int, int], song_len: float, ppq: int):
+from note_capture import HandNotes, as_hand_notes
+from tempo_map import Tempo, TempoMap, initial_bpm, normalize
+
+# Either columnar HandNotes or the dict-based list of note dicts
+Notes = Union[HandNotes, List[Dict[str, Any]]]
+
+# Bump whenever the JSON written for the same notes changes (invalidates build caches)
+WRITER_VERSION = 1
+
+def _build_measures(bpm: Tempo, ts: Tuple[int, int], song_len: float, ppq: int):
     """
     Build a list of measure objects for the given song length.
 
     Args:
-        bpm: Tempo in beats per minute.
+        bpm: Tempo in beats per minute, or a TempoMap.
         ts:  Time signature as (numerator, denominator).
         song_len: Total song length in seconds.
         ppq: Pulses per quarter note (MIDI resolution).
 
     Returns:
         measures: List of measure dicts with timing + tick info.
-        spm: Seconds per measure.
-    """
-    ts_num, ts_den = ts
-    spb = 60.0 / bpm                       # seconds per beat
-    beats_per_measure = ts_num * (4.0 / ts_den)
-    spm = spb * beats_per_measure          # seconds per measure
-
-    measures = []
-    t = 0.0
-    i = 0
-    # Keep building until the last measure covers the song length
-    while t < song_len - 1e-9 or i == 0:  # ensure at least one measure
-        measures.append({
-            "time": round(t, 12),
-            "timeSignature": [ts_num, ts_den],
-            "ticksPerMeasure": ppq * beats_per_measure,
-            "ticksStart": i * ppq * beats_per_measure,
-            "totalTicks": ppq * beats_per_measure,
+        spm: Seconds per measure (of the first measure for a TempoMap).
+    """
+    grid = measure_grid(bpm, ts, ppq)
+    return list(grid.view(song_len)), grid.spm
+
+
+@lru_cache(maxsize=32)
+def _measure_grid(bpm: Tempo, ts: Tuple[int, int], ppq: int) -> "MeasureGrid":
+    if isinstance(bpm, TempoMap):
+        return TempoMeasureGrid(bpm, ts, ppq)
+    return MeasureGrid(bpm, ts, ppq)
+
+
+def measure_grid(bpm: Tempo, ts: Tuple[int, int], ppq: int) -> "MeasureGrid":
+    """
+    Return the shared MeasureGrid for (bpm, ts, ppq).
+
+    Every block and seed rendered with the same settings reuses one grid. The
+    visual_speed is not part of the key: it only changes the song length, i.e.
+    how many measures are taken from the grid. A TempoMap gets a
+    TempoMeasureGrid (a constant one the plain closed-form grid).
+    """
+    return _measure_grid(normalize(bpm), (int(ts[0]), int(ts[1])), int(ppq))
+
+
+class MeasureGrid:
+    """
+    The measure start times of one (bpm, ts, ppq), computed in closed form.
+
+    Measure i starts at round(i * spm, 12). Start times are cached in a
+    growing prefix, so a longer song only computes the measures it adds, and
+    view(song_len) hands out measure objects lazily without building a list.
+    """
+
+    tempo_map = None
+
+    def __init__(self, bpm: float, ts: Tuple[int, int], ppq: int):
+        self.ts = ts
+        self.ppq = ppq
+        ts_num, ts_den = ts
+        self.spb = spb = 60.0 / bpm            # seconds per beat
+        self.beats_per_measure = ts_num * (4.0 / ts_den)
+        self.spm = spb * self.beats_per_measure  # seconds per measure
+        self._times = array("d", [0.0])
+        self._lock = threading.Lock()           # writer threads may share a grid
+
+    def time(self, i: int) -> float:
+        """Start time of measure i in seconds (rounded to 12 places)."""
+        times = self._times
+        if i >= len(times):
+            with self._lock:
+                spm = self.spm
+                times.extend(round(j * spm, 12) for j in range(len(times), i + 1))
+        return times[i]
+
+    def count(self, song_len: float) -> int:
+        """
+        Number of measures needed to cover song_len seconds (at least one).
+
+        This is the first i >= 1 whose start time reaches song_len - 1e-9;
+        the estimate from division is corrected against the rounded times.
+        """
+        limit = song_len - 1e-9
+        n = max(1, ceil(limit / self.spm)) if limit > 0 else 1
+        while n > 1 and self.time(n - 1) >= limit:
+            n -= 1
+        while self.time(n) < limit:
+            n += 1
+        return n
+
+    def measure(self, i: int) -> Dict[str, Any]:
+        """The measure object for measure i (a new dict on every call)."""
+        ticks = self.ppq * self.beats_per_measure
+        return {
+            "time": self.time(i),
+            "timeSignature": [self.ts[0], self.ts[1]],
+            "ticksPerMeasure": ticks,
+            "ticksStart": i * self.ppq * self.beats_per_measure,
+            "totalTicks": ticks,
             "type": 0 if i == 0 else 2   # 0 = start, 2 = normal
-        })
-        i += 1
-        t = round(i * spm, 12)
-    return measures, spm
+        }
+
+    def view(self, song_len: float) -> "MeasureView":
+        """Lazy sequence of the measures covering song_len seconds."""
+        return MeasureView(self, self.count(song_len))
+
+    def span(self, i: int) -> Tuple[float, float]:
+        """(time, timeEnd) of measure i's tracksV2 chunk."""
+        start = i * self.spm
+        return round(start, 12), round(start + self.spm, 12)
+
+    def chunk_notes(self, ids, midi, starts, durations, velocities, fingers,
+                    m_idx: int, hand_prefix: str) -> List[Dict[str, Any]]:
+        """The tracksV2 note objects of one measure (see _chunk_notes)."""
+        return _chunk_notes(ids, midi, starts, durations, velocities, fingers,
+                            m_idx, hand_prefix, self.spb, self.ppq, self.ts[0])
+
 
+# Slack for seconds rounded to 6 places when finding a note's measure under a
+# TempoMap (a note on a bar line must not land in the previous measure)
+_TIME_SLACK = 5e-7
 
-def _group_tracks_v2(notes: List[Dict[str, Any]], hand_prefix: str,
-                     bpm: float, ts: Tuple[int, int], ppq: int):
+
+class TempoMeasureGrid(MeasureGrid):
+    """
+    MeasureGrid under a TempoMap: measures stay a fixed number of beats long,
+    their start times come from the map (one bisect per measure).
+
+    As with a constant bpm, the map is applied to the JSON's time axis, i.e.
+    to visual_speed-scaled times.
+    """
+
+    def __init__(self, tempo_map: TempoMap, ts: Tuple[int, int], ppq: int):
+        super().__init__(tempo_map.bpm, ts, ppq)
+        self.tempo_map = tempo_map
+
+    def time(self, i: int) -> float:
+        times = self._times
+        if i >= len(times):
+            with self._lock:
+                seconds, bpmeasure = self.tempo_map.seconds, self.beats_per_measure
+                times.extend(round(seconds(j * bpmeasure), 12) for j in range(len(times), i + 1))
+        return times[i]
+
+    def count(self, song_len: float) -> int:
+        limit = song_len - 1e-9
+        n = max(1, ceil(self.tempo_map.beat_at(limit) / self.beats_per_measure)) if limit > 0 else 1
+        while n > 1 and self.time(n - 1) >= limit:
+            n -= 1
+        while self.time(n) < limit:
+            n += 1
+        return n
+
+    def measure_of(self, start: float) -> int:
+        """Index of the measure a note starting at `start` seconds belongs to."""
+        return int(self.tempo_map.beat_at(start + _TIME_SLACK) // self.beats_per_measure)
+
+    def span(self, i: int) -> Tuple[float, float]:
+        return self.time(i), self.time(i + 1)
+
+    def chunk_notes(self, ids, midi, starts, durations, velocities, fingers,
+                    m_idx: int, hand_prefix: str) -> List[Dict[str, Any]]:
+        """
+        _chunk_notes with tick positions read off the tempo map: every note's
+        start and end are converted to beats separately.
+        """
+        beat_at, ppq, ts_num = self.tempo_map.beat_at, self.ppq, self.ts[0]
+        notes = _chunk_notes(ids, midi, starts, durations, velocities, fingers,
+                             m_idx, hand_prefix, self.spb, ppq, ts_num)
+        for note in notes:
+            beat = beat_at(note["start"])
+            note["durationTicks"] = int(round((beat_at(note["end"]) - beat) * ppq))
+            note["ticksStart"] = int(round(beat * ppq))
+            note["measureBars"] = round(beat / ts_num, 6)
+        return notes
+
+
+class MeasureView(Sequence):
+    """Read-only, lazily built sequence over the first n measures of a grid."""
+
+    def __init__(self, grid: MeasureGrid, n: int):
+        self.grid = grid
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.grid.measure(i) for i in range(self.n)[index]]
+        if index < 0:
+            index += self.n
+        if not 0 <= index < self.n:
+            raise IndexError("measure index out of range")
+        return self.grid.measure(index)
+
+    def __iter__(self):
+        measure = self.grid.measure
+        for i in range(self.n):
+            yield measure(i)
+
+
+def _group_tracks_v2(notes: Notes, hand_prefix: str,
+                     bpm: Tempo, ts: Tuple[int, int], ppq: int):
     """
     Group notes into measure-based chunks for PianoVision.
 
     Args:
-        notes: List of note dicts (with midi, start, duration, velocity).
+        notes: HandNotes columns or list of note dicts (with midi, start, duration, velocity).
         hand_prefix: "r" or "l" (used to build note IDs).
-        bpm: Tempo in beats per minute.
+        bpm: Tempo in beats per minute, or a TempoMap.
         ts:  Time signature as (numerator, denominator).
         ppq: Pulses per quarter note.
 
     Returns:
         chunks: List of measure chunks, each containing notes + metadata.
     """
-    ts_num, ts_den = ts
-    spb = 60.0 / bpm
-    beats_per_measure = ts_num * (4.0 / ts_den)
-    spm = spb * beats_per_measure
-
-    # Group notes by measure index
-    buckets: Dict[int, List[Dict[str, Any]]] = {}
-    for i, n in enumerate(notes):
-        m_idx = int(n["start"] // spm)   # which measure this note starts in
-        entry = {
-            "note": n["midi"],
-            "durationTicks": int(round(n["duration"] / spb * ppq)),
-            "noteOffVelocity": n["velocity"],   # currently same as note-on velocity
-            "ticksStart": int(round(n["start"] / spb * ppq)),
-            "velocity": n["velocity"],
-            "measureBars": round((n["start"] / spb) / ts_num, 6),
-            "duration": n["duration"],
-            "noteName": None, "octave": None, "notePitch": None,  # placeholders
-            "start": n["start"],
-            "end": n["start"] + n["duration"],
-            "noteLengthType": "quarter",  # not computed, fixed as "quarter"
-            "group": -1,
-            "measureInd": m_idx,
-            "noteMeasureInd": 0,
-            "id": f"{hand_prefix}{i}",   # e.g. r0, r1, l0, l1 …
-            "finger": n.get("finger"),
-            "smp": None
-        }
-        buckets.setdefault(m_idx, []).append(entry)
-
-    # Convert grouped notes into chunk objects
-    chunks: List[Dict[str, Any]] = []
-    for m_idx in sorted(buckets.keys()):
-        start = m_idx * spm
-        end = start + spm
-        chunk_notes = buckets[m_idx]
-        chunks.append({
-            "direction": "down",
-            "time": round(start, 12),
-            "timeEnd": round(end, 12),
-            "timeSignature": [ts_num, ts_den],
-            "notes": chunk_notes,
-            "max": max(e["note"] for e in chunk_notes),
-            "min": min(e["note"] for e in chunk_notes),
-            "measureTicksStart": m_idx * ppq * beats_per_measure,
-            "measureTicksEnd": (m_idx + 1) * ppq * beats_per_measure,
-            "rests": [],
-            "groups": []
-        })
-    return chunks
+    return list(_iter_tracks_v2(notes, hand_prefix, bpm, ts, ppq))
+
+
+def _iter_tracks_v2(notes: Notes, hand_prefix: str,
+                    bpm: Tempo, ts: Tuple[int, int], ppq: int,
+                    scale: float = 1.0) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the measure chunks of _group_tracks_v2 one at a time.
+
+    capture_notes emits notes in time order, which _hand_chunks turns into
+    chunks in a single pass. Unordered input is stably sorted by measure
+    first (note ids keep the original positions), which yields the same
+    chunks as bucketing.
+
+    scale multiplies start/duration as they are read (visual_speed), so no
+    scaled copy of the columns is needed.
+    """
+    grid = measure_grid(bpm, ts, ppq)
+    notes = as_hand_notes(notes)
+    if _time_ordered(notes):
+        return _hand_chunks((notes,), hand_prefix, grid, scale)
+
+    if grid.tempo_map is None:
+        measure_of = [int((start * scale) // grid.spm) for start in notes.start]
+    else:
+        measure_of = [grid.measure_of(start * scale) for start in notes.start]
+    order = sorted(range(len(notes)), key=measure_of.__getitem__)
+    ordered = HandNotes(*([col[i] for i in order] for col in (
+        notes.midi, notes.start, notes.duration, notes.velocity, notes.finger)))
+    return _hand_chunks((ordered,), hand_prefix, grid, scale, ids=order)
+
+
+def _time_ordered(notes: HandNotes) -> bool:
+    """True if start times never decrease (so measure indices don't either)."""
+    starts = notes.start
+    return all(a <= b for a, b in zip(starts, starts[1:]))
+
+
+def _hand_chunks(blocks: Iterable[HandNotes], hand_prefix: str, grid: "MeasureGrid",
+                 scale: float = 1.0, ids: Sequence[int] = None,
+                 supporting: List[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yield one hand's tracksV2 chunks from its notes, given as consecutive
+    HandNotes blocks (a single block, or e.g. the windows of a chunked render).
+
+    A single pass: each note is scaled once as it is read, and only the open
+    measure's columns are buffered (a measure spanning two blocks is carried
+    over). Note ids are positions across all blocks, or `ids` for notes that
+    were reordered. With `supporting`, the hand's supportingTracks notes are
+    appended to that list in the same pass.
+
+    Raises:
+        ValueError: The notes are not in measure order (there is no whole
+            column to sort; see _iter_tracks_v2).
+    """
+    spm = grid.spm
+    measure_of = None if grid.tempo_map is None else grid.measure_of
+
+    current = None
+    lo = offset = 0
+    # columns of the measure being filled (reused from measure to measure)
+    cols = c_midi, c_start, c_dur, c_vel, c_finger = [], [], [], [], []
+
+    def close(hi):
+        chunk_notes = grid.chunk_notes(range(lo, hi) if ids is None else ids[lo:hi],
+                                       c_midi, c_start, c_dur, c_vel, c_finger,
+                                       current, hand_prefix)
+        chunk = _chunk(current, chunk_notes, c_midi, grid)
+        for col in cols:
+            col.clear()
+        return chunk
+
+    for block in blocks:
+        for i, (m, s, d, v, f) in enumerate(zip(block.midi, block.start, block.duration,
+                                                block.velocity, block.finger), offset):
+            start = s * scale
+            duration = d * scale
+            if supporting is not None:
+                supporting.append({"midi": m, "time": start, "velocity": v, "duration": duration})
+            m_idx = int(start // spm) if measure_of is None else measure_of(start)
+            if m_idx != current:
+                if current is not None:
+                    if m_idx < current:
+                        raise ValueError("measure chunks need notes in time order")
+                    yield close(i)
+                current, lo = m_idx, i
+            c_midi.append(m)
+            c_start.append(start)
+            c_dur.append(duration)
+            c_vel.append(v)
+            c_finger.append(f)
+        offset += len(block)
+
+    if current is not None:
+        yield close(offset)
+
+
+def _chunk_notes(ids, midi, starts, durations, velocities, fingers,
+                 m_idx: int, hand_prefix: str, spb: float, ppq: int,
+                 ts_num: int) -> List[Dict[str, Any]]:
+    """Build the tracksV2 note objects of one measure from its (scaled) columns."""
+    return [{
+        "note": note,
+        "durationTicks": int(round(duration / spb * ppq)),
+        "noteOffVelocity": velocity,   # currently same as note-on velocity
+        "ticksStart": int(round(start / spb * ppq)),
+        "velocity": velocity,
+        "measureBars": round((start / spb) / ts_num, 6),
+        "duration": duration,
+        "noteName": None, "octave": None, "notePitch": None,  # placeholders
+        "start": start,
+        "end": start + duration,
+        "noteLengthType": "quarter",  # not computed, fixed as "quarter"
+        "group": -1,
+        "measureInd": m_idx,
+        "noteMeasureInd": 0,
+        "id": f"{hand_prefix}{i}",   # e.g. r0, r1, l0, l1 …
+        "finger": finger or None,
+        "smp": None
+    } for i, note, start, duration, velocity, finger in zip(
+        ids, midi, starts, durations, velocities, fingers)]
+
+
+def _chunk(m_idx: int, chunk_notes: List[Dict[str, Any]], chunk_midi,
+           grid: MeasureGrid) -> Dict[str, Any]:
+    """Wrap one measure's notes in its tracksV2 chunk object."""
+    ts, ppq, beats_per_measure = grid.ts, grid.ppq, grid.beats_per_measure
+    time, time_end = grid.span(m_idx)
+    return {
+        "direction": "down",
+        "time": time,
+        "timeEnd": time_end,
+        "timeSignature": [ts[0], ts[1]],
+        "notes": chunk_notes,
+        "max": max(chunk_midi),
+        "min": min(chunk_midi),
+        "measureTicksStart": m_idx * ppq * beats_per_measure,
+        "measureTicksEnd": (m_idx + 1) * ppq * beats_per_measure,
+        "rests": [],
+        "groups": []
+    }
+
+
+def _supporting_notes(blocks: Iterable[HandNotes], scale: float) -> Iterator[Dict[str, Any]]:
+    """One hand's supportingTracks notes, scaled as they are read."""
+    for notes in blocks:
+        for m, s, d, v in zip(notes.midi, notes.start, notes.duration, notes.velocity):
+            yield {"midi": m, "time": s * scale, "velocity": v, "duration": d * scale}
+
+
+class _Stream:
+    """
+    Placeholder for a JSON array inside a payload template whose items are
+    produced lazily by an iterable (written element by element, never held as a list).
+
+    Up to `batch` consecutive items are encoded together; raise it for streams
+    of small items (see _SMALL_ITEM_BATCH).
+    """
+    __slots__ = ("items", "batch")
+
+    def __init__(self, items: Iterable[Any], batch: int = 1):
+        self.items = items
+        self.batch = batch
+
+
+def _materialize(value: Any) -> Any:
+    """Turn a payload template into plain JSON data (expanding every _Stream)."""
+    if isinstance(value, _Stream):
+        return [_materialize(v) for v in value.items]
+    if isinstance(value, dict):
+        return {k: _materialize(v) for k, v in value.items()}
+    return value
+
+
+def _contains_stream(value: Any) -> bool:
+    if isinstance(value, _Stream):
+        return True
+    if isinstance(value, dict):
+        return any(_contains_stream(v) for v in value.values())
+    return False
+
+
+# Items per encode() call for streams of small items (notes, measures): each
+# call builds encoder closures that only the cyclic GC frees
+_SMALL_ITEM_BATCH = 256
+
+
+def _stream_json(fh: TextIO, value: Any, encoder: json.JSONEncoder, level: int = 0) -> None:
+    """
+    Write a payload template to fh, streaming every _Stream chunk by chunk.
+
+    Output matches json.dump(value, fh, indent=encoder.indent) byte for byte
+    (or the compact form when encoder.indent is None).
+    """
+    indent = encoder.indent
+    if indent is None:
+        item_sep, key_sep = ",", ":"
+        def newline(lvl):
+            return ""
+    else:
+        item_sep, key_sep = ",", ": "
+        def newline(lvl):
+            return "\n" + " " * (indent * lvl)
+
+    if isinstance(value, _Stream):
+        first = True
+        batch = []
+
+        def flush():
+            nonlocal first
+            text = encoder.encode(batch)
+            if indent is None:
+                text = text[1:-1]
+            else:
+                text = text[1:-2].replace("\n", newline(level))
+            fh.write(("[" if first else item_sep) + text)
+            first = False
+            batch.clear()
+
+        for item in value.items:
+            if _contains_stream(item):
+                if batch:
+                    flush()
+                fh.write("[" if first else item_sep)
+                first = False
+                fh.write(newline(level + 1))
+                _stream_json(fh, item, encoder, level + 1)
+            else:
+                batch.append(item)
+                if len(batch) >= value.batch:
+                    flush()
+        if batch:
+            flush()
+        fh.write("[]" if first else newline(level) + "]")
+    elif isinstance(value, dict) and value and _contains_stream(value):
+        first = True
+        for key, item in value.items():
+            fh.write("{" if first else item_sep)
+            first = False
+            fh.write(newline(level + 1))
+            fh.write(encoder.encode(key) + key_sep)
+            _stream_json(fh, item, encoder, level + 1)
+        fh.write(newline(level) + "}")
+    else:
+        text = encoder.encode(value)
+        if indent is not None and level:
+            text = text.replace("\n", newline(level))
+        fh.write(text)
 
 
 class PianoVisionJsonWriter:
     """
-    Build and write PianoVision-compatible JSON from note dicts.
+    Build and write PianoVision-compatible JSON from notes.
 
-    Expects right_notes / left_notes with fields:
+    Expects right_notes / left_notes as HandNotes columns (NoteBuffer.hand) or
+    as lists of note dicts with fields:
       - midi: MIDI pitch number
       - start: start time in seconds
       - duration: duration in seconds
@@ -118,7 +490,8 @@ class PianoVisionJsonWriter:
       - finger: (optional) finger number
     """
 
-    def __init__(self, bpm: float, ts=(4, 4), ppq=960, visual_speed: float = 1.0):
+    def __init__(self, bpm: Tempo, ts=(4, 4), ppq=960, visual_speed: float = 1.0,
+                 compact: bool = False, gzip: bool = False):
         """
         visual_speed: multiplier for the visual scroll speed. Values >1.0 make visuals
         move faster (notes appear/finish sooner), values <1.0 make visuals slower.
@@ -126,41 +499,86 @@ class PianoVisionJsonWriter:
         Internally this writer scales the note 'start' and 'duration' times by 1/visual_speed
         when producing the JSON. The MIDI tempo (bpm) is left unchanged so audio playback
         remains the same while visuals can be sped up or slowed down independently.
+
+        compact: write without indentation/whitespace (same data, much smaller files).
+        gzip: gzip-compress the output (use the `suffix` attribute for the file name).
+
+        bpm may be a TempoMap: tempos lists every segment and measure times follow it.
         """
-        self.bpm = float(bpm)
+        self.tempo = normalize(bpm)
+        self.bpm = initial_bpm(self.tempo)
         self.ts = ts
         self.ppq = int(ppq)
         # store visual speed multiplier (>1 speeds up visuals)
         self.visual_speed = float(visual_speed) if visual_speed and visual_speed > 0 else 1.0
+        self.compact = bool(compact)
+        self.gzip = bool(gzip)
 
-    def build_json(self, right_notes: List[Dict[str, Any]],
-                   left_notes: List[Dict[str, Any]],
+    @property
+    def suffix(self) -> str:
+        """File suffix matching the output mode (".pv.json" or ".pv.json.gz")."""
+        return ".pv.json.gz" if self.gzip else ".pv.json"
+
+    def build_json(self, right_notes: Notes,
+                   left_notes: Notes,
                    name: str = "unknown") -> Dict[str, Any]:
         """
         Construct the full PianoVision JSON payload (as a dict).
+
+        Each hand is traversed once: visual_speed scaling, the song length,
+        the supportingTracks notes and the tracksV2 chunks all come out of the
+        same pass, without scaled copies of the note columns.
         """
-        # Apply visual speed scaling to notes without mutating the originals.
-        # A visual_speed > 1.0 results in shorter visual times (faster scroll).
         scale = 1.0 / self.visual_speed
-        def _scale_notes(notes):
-            return [
-                {**n, "start": n["start"] * scale, "duration": n["duration"] * scale}
-                for n in notes
-            ]
+        right_notes, left_notes = as_hand_notes(right_notes), as_hand_notes(left_notes)
+        if not (_time_ordered(right_notes) and _time_ordered(left_notes)):
+            # notes out of time order: the general (sorting) path
+            return _materialize(self._payload(right_notes, left_notes, name))
 
-        scaled_right = _scale_notes(right_notes)
-        scaled_left = _scale_notes(left_notes)
+        grid = measure_grid(self.tempo, self.ts, self.ppq)
+        right_support, left_support = [], []
+        right = list(_hand_chunks((right_notes,), "r", grid, scale, supporting=right_support))
+        left = list(_hand_chunks((left_notes,), "l", grid, scale, supporting=left_support))
+        song_len = max((n["time"] + n["duration"] for notes in (right_support, left_support)
+                        for n in notes), default=0.0)
+        return self._document(
+            song_len, name,
+            supporting=[{"notes": notes, "myInstrument": -5, "theirInstrument": 0}
+                        for notes in (left_support, right_support)],
+            measures=list(grid.view(song_len)),
+            right=right, left=left,
+        )
 
-        song_len = self._song_length(scaled_right, scaled_left)
-        measures, _ = _build_measures(self.bpm, self.ts, song_len, self.ppq)
+    def _payload(self, right_notes: Notes, left_notes: Notes, name: str) -> Dict[str, Any]:
+        """
+        Construct the payload template: the large arrays (supportingTracks notes,
+        measures, tracksV2 chunks) are lazy _Stream objects.
+        """
+        # Apply visual speed scaling while reading the notes; the originals are
+        # never copied or mutated. A visual_speed > 1.0 results in shorter visual
+        # times (faster scroll).
+        scale = 1.0 / self.visual_speed
+        right_notes, left_notes = as_hand_notes(right_notes), as_hand_notes(left_notes)
+        song_len = self._song_length(right_notes, left_notes, scale)
+        return self._document(
+            song_len, name,
+            # use scaled notes so visuals match tracksV2
+            supporting=_Stream(self._iter_supporting_tracks(right_notes, left_notes, scale)),
+            measures=_Stream(measure_grid(self.tempo, self.ts, self.ppq).view(song_len),
+                             _SMALL_ITEM_BATCH),
+            right=_Stream(_iter_tracks_v2(right_notes, "r", self.tempo, self.ts, self.ppq, scale)),
+            left=_Stream(_iter_tracks_v2(left_notes, "l", self.tempo, self.ts, self.ppq, scale)),
+        )
 
+    def _document(self, song_len: float, name: str, *, supporting, measures,
+                  right, left) -> Dict[str, Any]:
+        """Lay out the top-level JSON object around the (built or streamed) arrays."""
         return {
-            # include original supportingTracks times? use scaled notes so visuals match tracksV2
-            "supportingTracks": self._supporting_tracks(scaled_right, scaled_left),
+            "supportingTracks": supporting,
             "start_time": 0,
             "song_length": round(song_len, 6),
             "resolution": self.ppq,
-            "tempos": [{"bpm": self.bpm, "ticks": 0, "time": 0}],
+            "tempos": self._tempos(),
             "keySignatures": [],
             "timeSignatures": [
                 {"measures": 0, "ticks": 0,
@@ -168,13 +586,13 @@ class PianoVisionJsonWriter:
             ],
             "measures": measures,
             "tracksV2": {
-                "right": _group_tracks_v2(scaled_right, "r", self.bpm, self.ts, self.ppq),
-                "left":  _group_tracks_v2(scaled_left,  "l", self.bpm, self.ts, self.ppq)
+                "right": right,
+                "left":  left
             },
             "original": {"header": {
                 "keySignatures": [], "meta": [], "name": "",
                 "ppq": self.ppq,
-                "tempos": [{"bpm": self.bpm, "ticks": 0}],
+                "tempos": [{"bpm": t["bpm"], "ticks": t["ticks"]} for t in self._tempos()],
                 "timeSignatures": []
             }},
             "name": name,
@@ -182,46 +600,119 @@ class PianoVisionJsonWriter:
             "visual_speed": self.visual_speed,
         }
 
+    def _tempos(self) -> List[Dict[str, Any]]:
+        """The tempos field: one entry per tempo segment."""
+        if not isinstance(self.tempo, TempoMap):
+            return [{"bpm": self.bpm, "ticks": 0, "time": 0}]
+        return [{"bpm": bpm, "ticks": int(round(beat * self.ppq)),
+                 "time": round(time, 12) if beat else 0}
+                for beat, bpm, time in self.tempo.segments()]
+
     def write(self, path: Path,
-              right_notes: List[Dict[str, Any]],
-              left_notes: List[Dict[str, Any]],
-              name: str) -> None:
+              right_notes: Notes,
+              left_notes: Notes,
+              name: str,
+              bundle=None) -> None:
+        """
+        Stream the JSON payload to disk at the given path.
+
+        Measures, supporting-track notes and tracksV2 chunks are serialized one by
+        one, so the full payload dict is never built. The default mode writes
+        exactly what json.dump(..., indent=2) would.
+
+        With a bundle (bundle.BundleWriter / MemoryBundle) the payload is streamed
+        into that archive under path's location instead.
+        """
+        with (open(path, "wb") if bundle is None else bundle.open(path)) as raw:
+            self._dump(raw, self._payload(right_notes, left_notes, name))
+
+    def write_blocks(self, path: Path, right_blocks: Callable[[], Iterable[HandNotes]],
+                     left_blocks: Callable[[], Iterable[HandNotes]], name: str) -> None:
         """
-        Write the JSON payload to disk at the given path.
+        Like write(), for notes that only exist as a series of HandNotes blocks
+        (see renderer's chunked mode): memory use is bounded by one block and
+        one measure, however long the song.
+
+        right_blocks / left_blocks are callables returning a fresh iterator over
+        the hand's blocks; each is read three times (song length, supporting
+        notes, tracksV2), since song_length and measures precede the notes in
+        the file. The output is identical to write() on the concatenated notes.
         """
-        payload = self.build_json(right_notes, left_notes, name)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
+        scale = 1.0 / self.visual_speed
+        grid = measure_grid(self.tempo, self.ts, self.ppq)
+        song_len = max((s * scale + d * scale
+                        for blocks in (right_blocks, left_blocks)
+                        for notes in blocks()
+                        for s, d in zip(notes.start, notes.duration)),
+                       default=0.0)
+        payload = self._document(
+            song_len, name,
+            supporting=_Stream({"notes": _Stream(_supporting_notes(blocks(), scale),
+                                                  _SMALL_ITEM_BATCH),
+                                "myInstrument": -5, "theirInstrument": 0}
+                               for blocks in (left_blocks, right_blocks)),
+            measures=_Stream(grid.view(song_len), _SMALL_ITEM_BATCH),
+            right=_Stream(_hand_chunks(right_blocks(), "r", grid, scale)),
+            left=_Stream(_hand_chunks(left_blocks(), "l", grid, scale)),
+        )
+        with open(path, "wb") as raw:
+            self._dump(raw, payload)
 
-    def _song_length(self,
-                     right_notes: List[Dict[str, Any]],
-                     left_notes: List[Dict[str, Any]]) -> float:
+    def encode(self, right_notes: Notes, left_notes: Notes, name: str) -> bytes:
         """
-        Compute song length in seconds as max(start + duration) across all notes.
+        Return the file contents write() would produce, as bytes.
+
+        Used by the write pipeline, which serializes on the rendering thread and
+        leaves only the disk write to its writer threads.
         """
-        return max((n["start"] + n["duration"]
-                    for n in (right_notes + left_notes)),
+        raw = io.BytesIO()
+        self._dump(raw, self._payload(right_notes, left_notes, name))
+        return raw.getvalue()
+
+    def _dump(self, raw: BinaryIO, payload: Dict[str, Any]) -> None:
+        """Serialize a (streamed) payload into a binary file object (gzipped if enabled)."""
+        if self.compact:
+            encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+        else:
+            encoder = json.JSONEncoder(ensure_ascii=False, indent=2)
+
+        if self.gzip:
+            # mtime=0 and no stored file name keep the archive reproducible
+            with gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0) as gz:
+                f = io.TextIOWrapper(gz, encoding="utf-8")
+                _stream_json(f, payload, encoder)
+                f.flush()
+                f.detach()
+        else:
+            f = io.TextIOWrapper(raw, encoding="utf-8")
+            _stream_json(f, payload, encoder)
+            f.flush()
+            f.detach()
+
+    def _song_length(self, right_notes: HandNotes, left_notes: HandNotes,
+                     scale: float = 1.0) -> float:
+        """
+        Compute song length in seconds as max(start + duration) across all notes
+        (after scaling start and duration by `scale`).
+        """
+        return max((s * scale + d * scale
+                    for notes in (right_notes, left_notes)
+                    for s, d in zip(notes.start, notes.duration)),
                    default=0.0)
 
-    def _supporting_tracks(self,
-                           right_notes: List[Dict[str, Any]],
-                           left_notes: List[Dict[str, Any]]):
+    def _supporting_tracks(self, right_notes: Notes, left_notes: Notes, scale: float = 1.0):
         """
         Build the 'supportingTracks' field expected by PianoVision.
 
         Each supporting track has a minimal set of note data (midi, time, velocity, duration).
         """
-        return [
-            {"notes": [
-                {"midi": n["midi"], "time": n["start"],
-                 "velocity": n["velocity"], "duration": n["duration"]}
-                for n in left_notes
-             ],
-             "myInstrument": -5, "theirInstrument": 0},
-            {"notes": [
-                {"midi": n["midi"], "time": n["start"],
-                 "velocity": n["velocity"], "duration": n["duration"]}
-                for n in right_notes
-             ],
-             "myInstrument": -5, "theirInstrument": 0},
-        ]
+        return _materialize(list(self._iter_supporting_tracks(right_notes, left_notes, scale)))
+
+    def _iter_supporting_tracks(self, right_notes: Notes, left_notes: Notes, scale: float = 1.0):
+        """
+        Yield the two supporting tracks (left, then right) with lazily streamed notes.
+        """
+        for notes in (left_notes, right_notes):
+            yield {"notes": _Stream(_supporting_notes((as_hand_notes(notes),), scale),
+                                    _SMALL_ITEM_BATCH),
+                   "myInstrument": -5, "theirInstrument": 0}
@@ -1,18 +1,27 @@
 from pathlib import Path
 
-def load_sequences(folder: Path):
+from sequence_grammar import SUFFIX as GRAMMAR_SUFFIX, load_grammar
+
+def load_sequences(folder: Path, n_states: int = 9):
     """
     Load state index sequences from all `.txt` files in a folder.
 
     Each text file is expected to contain one integer per line,
     representing the index of the chord/state to be played at that step.
+    `NAME.grammar.json` files describe generated sequences instead (see
+    sequence_grammar.py); they are loaded as lazy GeneratedSequence objects.
 
     Args:
         folder (Path): Path to the folder containing `.txt` sequence files.
+        n_states (int): Number of chord states the sequences index (generate_states
+            always fills up to 9); grammar matrices must have this many rows.
 
     Returns:
-        Dict[str, List[int]]: A dictionary mapping the filename (without extension)
-        to its corresponding sequence of integers.
+        Dict[str, List[int] | GeneratedSequence]: A dictionary mapping the filename
+        (without extension) to its corresponding sequence of integers.
+
+    Raises:
+        ValueError: A grammar file is invalid or does not match n_states.
     """
     sequences = {}
 
@@ -21,4 +30,7 @@ def load_sequences(folder: Path):
             seq = [int(line.strip()) for line in f if line.strip()]
         sequences[file.stem] = seq # use filename without extension as key
 
+    for file in folder.glob("*" + GRAMMAR_SUFFIX):
+        sequences[file.name[:-len(GRAMMAR_SUFFIX)]] = load_grammar(file, n_states)
+
     return sequences
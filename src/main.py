@@ -1,33 +1,355 @@
-from pathlib import Path
+import time
+_T0 = time.perf_counter()
+
+import os
 import sys
+from pathlib import Path
 
-import generate_states
-import load_sequences
+import instrument
 
-from note_capture import build_default_maps, capture_notes
-from midi_writer import write_midi
-from json_writer import PianoVisionJsonWriter
-from renderer import render_sequence
-import sys
+# Everything else is imported by the stage that needs it: `--help` and
+# `--states-only` never load the renderer, and `--json-only` never loads
+# midi_writer (or midiutil). See `--import-time` and benchmark.py --startup.
 
-# --- config (easy to tweak / pass via CLI later)
+# --- config (override with --config FILE / --set KEY=VALUE, see apply_config)
 TEMPO = 120
-SEED  = 20
+TEMPO_MAP = None  # tempo changes as [(beat, bpm), ...] from beat 0 (see tempo_map.py); overrides TEMPO
+SEED  = 20  # used when no --seeds are given on the command line
 FINGERS_USED = 2  # how many fingers per hand to use (for chord generation)
 SCROLL_SPEED = 20.0  # visual scroll speed multiplier for PianoVision JSON (>1 = faster visuals)
+JSON_COMPACT = False  # write PianoVision JSON without indentation (much smaller files)
+JSON_GZIP = False     # gzip the PianoVision JSON (.pv.json.gz)
+MIDI_BACKEND = "native"  # "native" built-in SMF encoder, or "midiutil" (fallback)
+WRITE_THREADS = 0     # >0: encode on the main thread, write files on this many threads
+WRITE_QUEUE = 4       # max sequences encoded but not yet written (bounds memory)
+BUNDLE = None         # None: loose files; "seed": one archive per seed; "batch": one per run
+BUNDLE_FORMAT = "zip"  # "zip" or "tar" (see bundle.py for reading single seeds back)
+CHUNK_STEPS = None    # render in windows of this many steps (bounded memory for very long sequences)
+WRITE_MIDI = True     # False: write only the PianoVision JSON (MIDI is never encoded)
 # how many chords to generate of each type (must sum to 9)
 CHORDS_LEFT_HAND = 2 # how many only left hand chords as states ()
 CHORDS_RIGHT_HAND = 2 # how many only right hand chords as states
 CHORDS_CROSS_HAND = 5 # how many cross hand chords as states
+SAMPLER = "legacy"  # chord sampler: "legacy" keeps the states of existing seeds, "floyd" is the newer scheme
 
 # --- pitches (note: your LH is higher than RH here; that's fine if intentional)
 pitches_left  = {"C4": 60, "D4": 62, "E4": 64, "F4": 65, "G4": 67}
 pitches_right = {"C5": 72, "D5": 74, "E5": 76, "F5": 77, "G5": 79}
 
-def main():
+# Overridable config: the constants above (case-insensitive in config files)
+CONFIG_KEYS = ("TEMPO", "TEMPO_MAP", "SEED", "FINGERS_USED", "SCROLL_SPEED", "JSON_COMPACT",
+               "JSON_GZIP", "MIDI_BACKEND", "WRITE_THREADS", "WRITE_QUEUE", "BUNDLE",
+               "BUNDLE_FORMAT", "CHUNK_STEPS", "WRITE_MIDI", "CHORDS_LEFT_HAND",
+               "CHORDS_RIGHT_HAND", "CHORDS_CROSS_HAND", "SAMPLER", "pitches_left", "pitches_right")
+# apply_config exports the overrides here (JSON) so batch workers, which
+# import this module afresh, see the same config
+ENV_CONFIG = "BIND_CONFIG"
+
+
+def apply_config(values, *, export=True):
+    """
+    Override config constants of this module, e.g. {"tempo": 100, "fingers_used": 3}.
+
+    Keys are matched case-insensitively against CONFIG_KEYS. With export, the
+    overrides (merged with earlier ones) are also stored in the BIND_CONFIG
+    environment variable for worker processes and later imports of main.
+
+    Raises:
+        ValueError: Unknown key.
+    """
+    by_name = {k.lower(): k for k in CONFIG_KEYS}
+    resolved = {}
+    for key, value in values.items():
+        name = by_name.get(str(key).lower())
+        if name is None:
+            raise ValueError(f"unknown config key {key!r} (known: {', '.join(CONFIG_KEYS)})")
+        resolved[name] = value
+    globals().update(resolved)
+    if export and resolved:
+        import json
+        merged = json.loads(os.environ.get(ENV_CONFIG) or "{}")
+        merged.update(resolved)
+        os.environ[ENV_CONFIG] = json.dumps(merged)
+
+
+def load_config_file(path):
+    """Read config overrides from a .json or .toml file (a flat table of KEY = value)."""
+    path = Path(path)
+    if path.suffix == ".toml":
+        import tomllib
+        with open(path, "rb") as fh:
+            return tomllib.load(fh)
+    import json
+    with open(path, encoding="utf-8") as fh:
+        values = json.load(fh)
+    if not isinstance(values, dict):
+        raise ValueError(f"{path}: expected a JSON object of config keys")
+    return values
+
+
+def _parse_set(text):
+    """--set KEY=VALUE: VALUE is JSON (numbers, true/false, null, lists), else a string."""
+    import json
+    key, sep, value = text.partition("=")
+    if not sep or not key.strip():
+        raise ValueError(f"Invalid --set {text!r}: expected KEY=VALUE")
+    try:
+        return key.strip(), json.loads(value)
+    except ValueError:
+        return key.strip(), value
+
+
+if os.environ.get(ENV_CONFIG):
+    import json
+    apply_config(json.loads(os.environ[ENV_CONFIG]), export=False)
+
+_IMPORT_SECONDS = time.perf_counter() - _T0   # this module's own imports (--import-time)
+
+def render_seed(seed, state_sequences, maps, out_root, *, verbose=True, force=False,
+                write_threads=None, bundle=None, chunk_steps=None, tempo=None):
+    """
+    Generate the states for one seed and render every sequence for it.
+
+    Args:
+        seed (int): Random seed for generate_states (also used in folder/file names).
+        state_sequences (dict[str, list[int]]): Sequences as returned by load_sequences.
+        maps (HandMaps): Hand routing + fingerings from build_default_maps.
+        out_root (Path): Root output folder (files go to out_root/seed_<seed>/).
+        verbose (bool): Print the "Wrote states list" line (batch workers turn this off).
+        force (bool): Ignore the build cache and re-render every sequence.
+        write_threads (int | None): Writer threads for pipelined rendering (0 = write
+            each file before rendering the next sequence; None = WRITE_THREADS).
+        bundle (bundle.BundleWriter | bundle.MemoryBundle): Write the states list and all
+            outputs into this archive instead of out_root (always rebuilds; no pipeline,
+            so WRITE_THREADS is not used).
+        chunk_steps (int | None): Render each sequence in windows of this many steps, so
+            memory stays flat however long it is (None = CHUNK_STEPS; no pipeline or bundle).
+        tempo (float | TempoMap | None): Tempo of every sequence (None = configured_tempo()).
+
+    Returns:
+        Tuple[list[Path], BuildCache]:
+            - Paths of all .mid (unless WRITE_MIDI is off) and .pv.json files
+              (rebuilt or already up to date)
+            - The seed's build cache (its hits / rebuilds lists tell which was which)
+
+    Raises:
+        ValueError: A bundle together with chunk_steps (or CHUNK_STEPS) or write_threads.
+    """
+    from contextlib import nullcontext
+    from build_cache import BuildCache
+    from note_capture import StateTemplates
+    from renderer import render_sequence
+
+    if chunk_steps is None:
+        chunk_steps = CHUNK_STEPS
+    if bundle is not None:
+        # bundled outputs are rendered whole and written in order (as the CLI checks)
+        if chunk_steps:
+            raise ValueError("chunk_steps cannot be combined with a bundle")
+        if write_threads:
+            raise ValueError("write_threads cannot be combined with a bundle")
+        write_threads = 0
+    if write_threads is None:
+        write_threads = WRITE_THREADS
+
+    # 1) chords + seed, and the seed's states list
+    chords = write_states(seed, out_root, verbose=verbose, bundle=bundle)
+
+    # 2) precompile the chord states once; every sequence of this seed reuses them
+    with instrument.stage("compile_templates", seed=seed):
+        templates = StateTemplates(chords, maps)
+
+    # outputs whose inputs did not change since the last run are skipped
+    cache = BuildCache(out_root / f"seed_{seed}", force=force)
+
+    # 3) render each sequence — collect generated file paths so we can print
+    # a single folder-wise summary instead of one line per file.
+    created_files = []
+    if chunk_steps:
+        write_threads = 0
+    if tempo is None:
+        tempo = configured_tempo()
+    if write_threads > 0:
+        from write_pipeline import WritePipeline
+        pipeline = WritePipeline(write_threads, WRITE_QUEUE)
+    else:
+        pipeline = None
+    with pipeline or nullcontext():
+        for name, seq in state_sequences.items():
+            midi_path, json_path = render_sequence(
+                seq_name=name,
+                state_sequence=seq,
+                chords=chords,
+                fingers_used=FINGERS_USED,
+                tempo=tempo,
+                scroll_speed=SCROLL_SPEED,
+                json_compact=JSON_COMPACT,
+                json_gzip=JSON_GZIP,
+                midi_backend=MIDI_BACKEND,
+                templates=templates,
+                # bundled outputs are always rebuilt: the archive is written as a whole
+                cache=cache if bundle is None else None,
+                pipeline=pipeline,
+                bundle=bundle,
+                chunk_steps=chunk_steps,
+                midi=WRITE_MIDI,
+                maps=maps,
+                out_root=out_root,
+                seed=seed,
+            )
+            if midi_path is not None:
+                created_files.append(midi_path)
+            created_files.append(json_path)
+    if bundle is not None:
+        cache.rebuilds.extend(state_sequences)
+        return created_files, cache
+    cache.save()
+    return created_files, cache
+
+
+def write_states(seed, out_root, *, verbose=True, bundle=None):
+    """
+    Generate the chord states of a seed and write its states list.
+
+    Returns:
+        The chords (see generate_states.generate_states).
+    """
+    import generate_states
+
+    # generate_states returns both chords and a human-readable list
+    with instrument.stage("generate_states", seed=seed):
+        chords, states_listed = generate_states.generate_states(
+            pitches_left,
+            pitches_right,
+            n_left=CHORDS_LEFT_HAND,
+            n_right=CHORDS_RIGHT_HAND,
+            n_cross=CHORDS_CROSS_HAND,
+            fingers_used=FINGERS_USED,
+            seed=seed,
+            sampler=SAMPLER,
+        )
+
+    # write states list once per seed
+    with instrument.stage("write_states_file", seed=seed):
+        generate_states.write_states_file(out_root, states_listed, seed, verbose=verbose,
+                                          bundle=bundle)
+    return chords
+
+
+def configured_tempo():
+    """TEMPO, or a TempoMap of TEMPO_MAP when that is set."""
+    if not TEMPO_MAP:
+        return TEMPO
+    from tempo_map import TempoMap
+    return TempoMap(TEMPO_MAP)
+
+
+def parse_seeds(text):
+    """
+    Parse a seed specification like "1-300", "4,8,15" or "1-10,42" into a list of ints.
+
+    Ranges are inclusive; duplicates are dropped while keeping the first occurrence.
+    """
+    seeds = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part[1:]:
+            # split on the first '-' that is not a leading minus sign
+            cut = part.index("-", 1)
+            lo, hi = int(part[:cut]), int(part[cut + 1:])
+            if hi < lo:
+                raise ValueError(f"Invalid seed range {part!r}: end is before start")
+            seeds.extend(range(lo, hi + 1))
+        else:
+            seeds.append(int(part))
+    return list(dict.fromkeys(seeds))
+
+
+def main(argv=None):
+    import argparse
+
+    # --config / --set are applied first, so the other defaults below show the result
+    config = argparse.ArgumentParser(add_help=False)
+    config.add_argument("--config", type=Path, default=None,
+                        help="config file (.json or .toml) overriding the constants at the top "
+                             "of main.py, e.g. tempo = 100 (keys are case-insensitive)")
+    config.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override one config constant, e.g. --set fingers_used=3 "
+                             "(VALUE is JSON, else a string; repeatable; applied after --config)")
+    known, _ = config.parse_known_args(argv)
+    try:
+        if known.config is not None:
+            apply_config(load_config_file(known.config))
+        apply_config(dict(_parse_set(item) for item in known.set))
+    except (OSError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+
+    parser = argparse.ArgumentParser(description="Generate MIDI + PianoVision JSON stimuli.",
+                                     parents=[config])
+    parser.add_argument("--seeds", type=str, default=None,
+                        help='batch mode: seed range or list, e.g. "1-300" or "4,8,15" '
+                             f"(default: single run with SEED={SEED})")
+    parser.add_argument("--manifest", type=Path, default=None,
+                        help="participant manifest CSV (participant,seed); renders its seeds "
+                             "in batch mode, or one shard of them with --shard")
+    parser.add_argument("--shard", type=str, default=None,
+                        help='render only shard i of N of the manifest, e.g. "2/4"; reruns '
+                             "resume unfinished seeds (see shard.py)")
+    parser.add_argument("--out-root", type=Path, default=None,
+                        help="output folder (default: generated_midis/ next to src/)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes for batch mode (default: CPU count)")
+    parser.add_argument("--force", action="store_true",
+                        help="ignore the build cache and re-render every output")
+    parser.add_argument("--write-threads", type=int, default=WRITE_THREADS,
+                        help="write files on this many threads while the next sequence is "
+                             f"rendered, at most WRITE_QUEUE={WRITE_QUEUE} sequences ahead "
+                             "(default: WRITE_THREADS; 0 = no pipelining)")
+    parser.add_argument("--bundle", choices=("seed", "batch"), default=BUNDLE,
+                        help="write one archive per seed or one for the whole batch "
+                             "instead of loose files (default: BUNDLE)")
+    # bundle.FORMATS, spelled out so --help does not import the archive modules
+    parser.add_argument("--bundle-format", choices=("zip", "tar"), default=BUNDLE_FORMAT,
+                        help="archive format for --bundle (default: BUNDLE_FORMAT)")
+    parser.add_argument("--chunk-steps", type=int, default=CHUNK_STEPS,
+                        help="render each sequence in windows of this many steps with flat "
+                             "memory use, for very long sequences (default: CHUNK_STEPS; "
+                             "not combined with --bundle or --write-threads)")
+    parser.add_argument("--tempo-map", type=str, default=None,
+                        help='tempo changes within each sequence, e.g. "0:100,16:100~32:140" '
+                             "(beat:bpm items; a~b ramps linearly in one-beat steps) "
+                             "(default: TEMPO_MAP, else constant TEMPO)")
+    parser.add_argument("--states-only", action="store_true",
+                        help="only generate and write the states lists of SEED or --seeds "
+                             "(nothing is rendered)")
+    parser.add_argument("--json-only", action="store_true",
+                        help="write only the PianoVision JSON, no MIDI (same as "
+                             "--set write_midi=false)")
+    parser.add_argument("--import-time", action="store_true",
+                        help="report how long imports took (see also benchmark.py --startup)")
+    parser.add_argument("--trace", type=str, default=None,
+                        help=f"write a Chrome trace-event JSON of all stages here "
+                             f"(same as {instrument.ENV_TRACE}=PATH)")
+    parser.add_argument("--profile", type=str, default=None,
+                        help=f"dump a cProfile file per rendered sequence into this folder "
+                             f"(same as {instrument.ENV_PROFILE}=DIR)")
+    args = parser.parse_args(argv)
+    if args.json_only:
+        apply_config({"WRITE_MIDI": False})
+    instrument.configure(trace=args.trace, profile_dir=args.profile)
+
+    with instrument.stage("main"):
+        _run(args)
+    instrument.write_trace()
+
+
+def _run(args):
+    """Validate the config, load shared inputs and render one seed or a batch."""
     here = Path(__file__).parent
     sequences_folder = here / "state_sequences"
-    out_root = here.parent / "generated_midis"
+    out_root = args.out_root or here.parent / "generated_midis"
 
     # Validation
     if CHORDS_LEFT_HAND + CHORDS_RIGHT_HAND + CHORDS_CROSS_HAND != 9:
@@ -36,58 +358,141 @@ def main():
         sys.exit("Error: FINGERS_USED cannot be more than 10! most people only have 10")
     if FINGERS_USED < 1:
         sys.exit("Error: FINGERS_USED must be at least 1!")
+    if args.chunk_steps and not args.states_only:
+        if args.bundle:
+            sys.exit("Error: --chunk-steps cannot be combined with --bundle "
+                     "(bundled outputs are rendered whole)")
+        if WRITE_MIDI and MIDI_BACKEND != "native":
+            sys.exit(f"Error: --chunk-steps needs the native MIDI backend "
+                     f"(MIDI_BACKEND is {MIDI_BACKEND!r}; or use --json-only)")
 
-    # 1) chords + seed (generate_states now returns both chords and a human-readable list)
-    chords, states_listed = generate_states.generate_states(
-        pitches_left,
-        pitches_right,
-        n_left=CHORDS_LEFT_HAND,
-        n_right=CHORDS_RIGHT_HAND,
-        n_cross=CHORDS_CROSS_HAND,
-        fingers_used=FINGERS_USED,
-        seed=SEED,
-    )
-
-    # write states list once per seed 
-    generate_states.write_states_file(out_root, states_listed, SEED)
-
-    # 2) build maps (hand routing + optional fingerings)
-    maps = build_default_maps(pitches_left, pitches_right)
-    
-    # 3) load sequences
-    state_sequences = load_sequences.load_sequences(sequences_folder)
-
-    # 4) render each sequence — collect generated file paths so we can print
-    # a single folder-wise summary instead of one line per file.
-    created_files = []
-    for name, seq in state_sequences.items():
-        midi_path, json_path = render_sequence(
-            seq_name=name,
-            state_sequence=seq,
-            chords=chords,
-            fingers_used=FINGERS_USED,
-            tempo=TEMPO,
-            scroll_speed=SCROLL_SPEED,
-            maps=maps,
-            out_root=out_root,
-            seed=SEED,
-        )
-        created_files.append(midi_path)
-        created_files.append(json_path)
+    if args.seeds is not None:
+        try:
+            seeds = parse_seeds(args.seeds)
+        except ValueError as e:
+            sys.exit(f"Error: {e}")
+        if not seeds:
+            sys.exit("Error: --seeds did not contain any seed")
+    else:
+        seeds = None
+
+    if args.states_only:
+        if args.manifest is not None or args.bundle:
+            sys.exit("Error: --states-only cannot be combined with --manifest or --bundle")
+        t0 = time.perf_counter()
+        try:
+            for seed in seeds or [SEED]:
+                write_states(seed, out_root, verbose=seeds is None)
+        except OSError as e:
+            sys.exit(f"Error: could not write output: {e}")
+        if seeds is not None:
+            print(f"Wrote {len(seeds)} states lists to: {out_root}")
+        _report_imports(args, time.perf_counter() - t0)
+        return
+
+    # Import the render stages (timed for --import-time). Everything is
+    # imported before any rendering, so batch workers forked later inherit it.
+    t0 = time.perf_counter()
+    import load_sequences
+    from note_capture import build_default_maps
+    import renderer  # noqa: F401  (used by render_seed)
+    if WRITE_MIDI:
+        import midi_writer  # noqa: F401  (used by renderer)
+    imports = time.perf_counter() - t0
+
+    try:
+        if args.tempo_map:
+            from tempo_map import parse_tempo_map
+            tempo = parse_tempo_map(args.tempo_map)
+        else:
+            tempo = configured_tempo()
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+
+    # build maps (hand routing + optional fingerings) and load sequences once;
+    # in batch mode both are shared with every worker process.
+    with instrument.stage("build_default_maps"):
+        maps = build_default_maps(pitches_left, pitches_right)
+    try:
+        with instrument.stage("load_sequences") as st:
+            state_sequences = load_sequences.load_sequences(sequences_folder)
+            st.set(sequences=len(state_sequences))
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+
+    _report_imports(args, imports)
+
+    if args.shard is not None or args.manifest is not None:
+        import shard
+        if args.seeds is not None:
+            sys.exit("Error: --seeds cannot be combined with --manifest")
+        if args.manifest is None:
+            sys.exit("Error: --shard needs a --manifest")
+        try:
+            participants = shard.read_manifest(args.manifest)
+            index, count = shard.parse_shard(args.shard or "1/1")
+        except (OSError, ValueError) as e:
+            sys.exit(f"Error: {e}")
+        if args.bundle == "batch":
+            sys.exit("Error: --bundle batch cannot be resumed per seed; use --bundle seed")
+        shard.run_shard(participants, index, count, state_sequences, maps, out_root,
+                        force=args.force, workers=args.workers,
+                        write_threads=args.write_threads, bundle_mode=args.bundle,
+                        bundle_format=args.bundle_format, chunk_steps=args.chunk_steps,
+                        tempo=tempo)
+        return
+
+    if seeds is not None:
+        from batch import run_batch
+        run_batch(seeds, state_sequences, maps, out_root, workers=args.workers,
+                  force=args.force, write_threads=args.write_threads,
+                  bundle_mode=args.bundle, bundle_format=args.bundle_format,
+                  chunk_steps=args.chunk_steps, tempo=tempo)
+        return
+
+    archive = None
+    try:
+        if args.bundle:
+            import bundle
+            archive = bundle.bundle_path(out_root, f"seed_{SEED}", args.bundle_format)
+            with bundle.BundleWriter(archive, out_root, args.bundle_format) as b:
+                created_files, cache = render_seed(SEED, state_sequences, maps, out_root,
+                                                   bundle=b, tempo=tempo)
+        else:
+            created_files, cache = render_seed(SEED, state_sequences, maps, out_root,
+                                               force=args.force,
+                                               write_threads=args.write_threads,
+                                               chunk_steps=args.chunk_steps,
+                                               tempo=tempo)
+    except OSError as e:
+        sys.exit(f"Error: could not write output: {e}")
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
 
     # Print a concise folder-wise summary for the seed folder
     try:
         seed_dir = out_root / f"seed_{SEED}"
         if created_files:
-            print(f"Wrote {len(created_files)} files to: {seed_dir}")
+            print(f"Wrote {len(created_files)} files to: {archive or seed_dir}")
             for p in created_files:
                 # print just the filename to keep the summary compact
                 print(" -", p.name)
+            print(f"Build cache: {len(cache.hits)} up to date, {len(cache.rebuilds)} rebuilt")
         else:
             print(f"No files created for seed {SEED}.")
     except Exception:
         # be resilient if something odd happened; don't crash
         pass
 
+
+def _report_imports(args, stage_seconds):
+    """Print the --import-time report: main.py's own imports and the stage imports."""
+    if args.import_time:
+        print(f"Import time: {_IMPORT_SECONDS * 1e3:.1f} ms for main.py, "
+              f"{stage_seconds * 1e3:.1f} ms for the "
+              f"{'states' if args.states_only else 'render'} stages "
+              f"({len(sys.modules)} modules loaded)")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,126 @@
+"""
+Minimal Standard MIDI File reader, enough to check what midi_writer writes.
+
+Reads type 0/1 files with ticks-per-quarter timing: channel voice messages
+(with running status), meta events and sysex. Only note events, track names
+and tempos are kept; everything else is skipped.
+"""
+import struct
+from typing import List, NamedTuple, Optional, Tuple
+
+
+class MidiNote(NamedTuple):
+    """One note, paired from its note-on and note-off."""
+    pitch: int
+    start: int        # tick of the note-on
+    duration: int     # ticks until the note-off (-1: never released)
+    velocity: int
+    channel: int
+
+
+class MidiTrack(NamedTuple):
+    name: Optional[str]
+    notes: List[MidiNote]                 # in note-on order
+    tempos: List[Tuple[int, int]]         # (tick, microseconds per quarter)
+
+
+class MidiFile(NamedTuple):
+    format: int
+    ppq: int
+    tracks: List[MidiTrack]
+
+
+def _vlq(data: bytes, pos: int) -> Tuple[int, int]:
+    value = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value = (value << 7) | (b & 0x7F)
+        if not b & 0x80:
+            return value, pos
+
+
+def read_smf(data: bytes) -> MidiFile:
+    """
+    Parse .mid file contents.
+
+    Note-offs (0x80, or 0x90 with velocity 0) close the oldest open note of the
+    same channel and pitch.
+
+    Raises:
+        ValueError: The data is not a well-formed SMF (the message says where).
+    """
+    if data[:4] != b"MThd":
+        raise ValueError("not a MIDI file (missing MThd header)")
+    hlen, fmt, ntrks, division = struct.unpack(">IHHH", data[4:14])
+    if division & 0x8000:
+        raise ValueError("SMPTE time division is not supported")
+    pos = 8 + hlen
+    tracks = []
+    for t in range(ntrks):
+        if data[pos:pos + 4] != b"MTrk":
+            raise ValueError(f"track {t}: missing MTrk chunk at byte {pos}")
+        (length,) = struct.unpack(">I", data[pos + 4:pos + 8])
+        start, end = pos + 8, pos + 8 + length
+        if end > len(data):
+            raise ValueError(f"track {t}: chunk runs past the end of the file")
+        try:
+            tracks.append(_read_track(data, start, end))
+        except IndexError:
+            raise ValueError(f"track {t}: truncated event data") from None
+        pos = end
+    return MidiFile(fmt, division, tracks)
+
+
+def _read_track(data: bytes, pos: int, end: int) -> MidiTrack:
+    name = None
+    notes: List[MidiNote] = []
+    tempos = []
+    open_notes = {}        # (channel, pitch) -> indices into notes of open note-ons
+    tick = 0
+    status = 0
+    while pos < end:
+        delta, pos = _vlq(data, pos)
+        tick += delta
+        b = data[pos]
+        if b & 0x80:
+            status = b
+            pos += 1
+        elif not status:
+            raise ValueError(f"data byte without a status at byte {pos}")
+        kind = status & 0xF0
+
+        if status == 0xFF:                    # meta event
+            mtype = data[pos]
+            length, pos = _vlq(data, pos + 1)
+            payload = data[pos:pos + length]
+            pos += length
+            if mtype == 0x03 and name is None:
+                name = payload.decode("ISO-8859-1")
+            elif mtype == 0x51:
+                tempos.append((tick, int.from_bytes(payload, "big")))
+            elif mtype == 0x2F:
+                break
+            status = 0
+        elif status in (0xF0, 0xF7):          # sysex
+            length, pos = _vlq(data, pos)
+            pos += length
+            status = 0
+        elif kind in (0x80, 0x90):
+            pitch, vel = data[pos], data[pos + 1]
+            pos += 2
+            ch = status & 0x0F
+            if kind == 0x90 and vel:
+                open_notes.setdefault((ch, pitch), []).append(len(notes))
+                notes.append(MidiNote(pitch, tick, -1, vel, ch))
+            else:
+                waiting = open_notes.get((ch, pitch))
+                if waiting:
+                    i = waiting.pop(0)
+                    notes[i] = notes[i]._replace(duration=tick - notes[i].start)
+        elif kind in (0xC0, 0xD0):
+            pos += 1
+        else:                                 # 0xA0, 0xB0, 0xE0
+            pos += 2
+
+    return MidiTrack(name, notes, tempos)
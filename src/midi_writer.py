@@ -1,42 +1,467 @@
+import io
+import shutil
+import struct
+import tempfile
 from pathlib import Path
-from typing import Dict, Any, Sequence, Tuple
-from midiutil import MIDIFile
+from typing import BinaryIO, Dict, Any, List, Sequence, Tuple, Union
+
+from note_capture import NoteBuffer
+from tempo_map import Tempo, TempoMap, normalize
+
+Events = Union[NoteBuffer, Sequence[Dict[str, Any]]]
+
+# Backends understood by write_midi
+BACKENDS = ("native", "midiutil")
+
+# Bump whenever the bytes written for the same notes change (invalidates build caches)
+WRITER_VERSION = 1
+
 
 def write_midi(
     seq_name: str,
-    events: Sequence[Dict[str, Any]],
+    events: Events,
     *,
-    tempo: float,
+    tempo: Tempo,
     seed: int,
     out_root: Path,
     track_names: Tuple[str, ...] = ("Right", "Left"),
     channel: int = 0,
+    backend: str = "native",
+    bundle=None,
 ) -> Path:
     """
     Write a MIDI file from note 'events'.
 
     Args:
         seq_name (str): Name of the sequence (used in the file name).
-        events (Sequence[Dict[str, Any]]): List of note events. Each event must have:
+        events (NoteBuffer | Sequence[Dict[str, Any]]): A columnar NoteBuffer from
+            capture_notes_columnar, or a list of note event dicts. Each event must have:
             - track (int): Which MIDI track the note belongs to (0=right, 1=left).
             - pitch (int): MIDI note number (0–127).
             - start_beats (float): Start time in beats.
             - duration_beats (float): Note duration in beats.
             - velocity (int): MIDI velocity (0–127).
-        tempo (float): Tempo in beats per minute (BPM).
+        tempo (float | TempoMap): Tempo in beats per minute (BPM), or a TempoMap
+            (one tempo event per segment).
         seed (int): Random seed or sequence ID (used in folder/file name).
         out_root (Path): Root folder where files should be saved.
         track_names (Tuple[str, ...]): Optional names for tracks (defaults: "Right", "Left").
         channel (int): MIDI channel number (default 0).
+        backend (str): "native" (built-in SMF encoder, default) or "midiutil".
+        bundle (bundle.BundleWriter | bundle.MemoryBundle): Optional archive to write
+            into instead of the file system (stored under the same relative path).
 
     Returns:
-        Path: Path to the written `.mid` file.
+        Path: Path to the written `.mid` file (its path inside out_root when bundled).
     """
+    data = encode_midi(events, tempo=tempo, track_names=track_names, channel=channel,
+                       backend=backend)
+
+    # --- Save MIDI file ---
+    # Build output path (e.g. "seed_4/seed_4_Block_1.mid") and create the seed folder
+    midi_path = midi_file_path(seq_name, seed, out_root)
+    if bundle is not None:
+        bundle.add(midi_path, data)
+        return midi_path
+    midi_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write binary MIDI file
+    with open(midi_path, "wb") as fh:
+        fh.write(data)
+
+    return midi_path
+
+
+def midi_file_path(seq_name: str, seed: int, out_root: Path) -> Path:
+    """Path write_midi uses for a sequence: out_root/seed_<seed>/seed_<seed>_<seq_name>.mid."""
+    return out_root / f"seed_{seed}" / f"seed_{seed}_{seq_name}.mid"
+
+
+def encode_midi(
+    events: Events,
+    *,
+    tempo: Tempo,
+    track_names: Tuple[str, ...] = ("Right", "Left"),
+    channel: int = 0,
+    backend: str = "native",
+) -> bytes:
+    """
+    Encode note events to .mid file contents with the chosen backend (see write_midi).
+    """
+    if backend == "native":
+        return encode_smf(events, tempo=tempo, track_names=track_names, channel=channel)
+    if backend == "midiutil":
+        return _encode_midiutil(events, tempo=tempo, track_names=track_names, channel=channel)
+    raise ValueError(f"Unknown MIDI backend {backend!r} (expected one of {BACKENDS})")
+
+
+def _columns(events: Events):
+    """Return (track, pitch, start_beats, duration_beats, velocity) columns for events."""
+    if isinstance(events, NoteBuffer):
+        return events.track, events.pitch, events.start, events.duration, events.velocity
+    return (
+        [int(e["track"]) for e in events],
+        [int(e["pitch"]) for e in events],
+        [float(e["start_beats"]) for e in events],
+        [float(e["duration_beats"]) for e in events],
+        [int(e["velocity"]) for e in events],
+    )
+
 
-    # --- Setup ---
+def _num_tracks(track_col, track_names) -> int:
     # Ensure we have enough tracks: take the maximum track index in events + 1,
     # and compare with the number of names in track_names.
-    num_tracks = max(max(e["track"] for e in events) + 1, len(track_names))
+    return max(max(track_col, default=-1) + 1, len(track_names))
+
+
+def track_name(t: int, track_names) -> str:
+    """Name written for track t: track_names[t] if given, otherwise "Track <t>"."""
+    return track_names[t] if t < len(track_names) else f"Track {t}"
+
+
+def _vlq(value: int) -> bytes:
+    """Encode a non-negative int as a MIDI variable-length quantity."""
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def encode_smf(
+    events: Events,
+    *,
+    tempo: Tempo,
+    track_names: Tuple[str, ...] = ("Right", "Left"),
+    channel: int = 0,
+    ppq: int = 960,
+) -> bytes:
+    """
+    Encode note events as a type-1 Standard MIDI File without midiutil.
+
+    The layout matches what write_midi produced through midiutil: a tempo
+    track (one tempo event per note track, as addTempo was called per track)
+    followed by one named track per hand. Within a track, events are ordered
+    by tick, note-offs before note-ons at the same tick, then by insertion
+    order, and ticks are truncated as in midiutil (int(beats * ppq)).
+
+    NoteBuffers filled from StateTemplates are encoded by concatenating the
+    templates' pre-encoded note runs. Other input goes through a per-note
+    path: capture_notes emits notes in time order with equal durations, so
+    the note-on and note-off streams are each already sorted and are merged
+    in a single pass; they are only sorted when the input is out of order.
+
+    Returns:
+        bytes: The complete .mid file contents.
+    """
+    bodies = None
+    if (isinstance(events, NoteBuffer) and events.templates is not None
+            and events.channel == channel):
+        bodies = _template_track_bodies(events, ppq)
+    if bodies is None:
+        bodies = _note_track_bodies(events, channel, ppq)
+    num_tracks = max(len(bodies), len(track_names))
+    bodies += [b""] * (num_tracks - len(bodies))
+
+    names = [track_name(t, track_names).encode("ISO-8859-1") for t in range(num_tracks)]
+
+    # Exact size is known up front: header, tempo track, then named note tracks
+    chunks = [_smf_header(num_tracks, tempo, ppq)]
+    for name, body in zip(names, bodies):
+        name_event = b"\x00\xff\x03" + _vlq(len(name)) + name
+        chunks.append(b"MTrk" + struct.pack(">I", len(name_event) + len(body) + 4))
+        chunks.append(name_event)
+        chunks.append(body)
+        chunks.append(_END_OF_TRACK)
+
+    buf = bytearray(sum(len(c) for c in chunks))
+    pos = 0
+    for c in chunks:
+        buf[pos:pos + len(c)] = c
+        pos += len(c)
+    return bytes(buf)
+
+
+_END_OF_TRACK = b"\x00\xff\x2f\x00"
+
+
+def _smf_header(num_tracks: int, tempo: Tempo, ppq: int) -> bytes:
+    """
+    MThd chunk plus the tempo track (one tempo event per note track, as midiutil wrote).
+
+    A TempoMap gets such a group of events at the start tick of each segment.
+    """
+    tempo = normalize(tempo)
+    segments = tempo.segments() if isinstance(tempo, TempoMap) else [(0.0, tempo, 0.0)]
+    tempo_body = bytearray()
+    last_tick = 0
+    for beat, bpm, _ in segments if num_tracks else ():
+        tick = int(beat * ppq)
+        tempo_event = b"\xff\x51\x03" + struct.pack(">I", int(60000000 / float(bpm)))[1:]
+        tempo_body += _vlq(tick - last_tick) + tempo_event
+        tempo_body += (b"\x00" + tempo_event) * (num_tracks - 1)
+        last_tick = tick
+    tempo_body += _END_OF_TRACK
+    return (b"MThd" + struct.pack(">IHHH", 6, 1, num_tracks + 1, ppq)
+            + b"MTrk" + struct.pack(">I", len(tempo_body)) + tempo_body)
+
+
+def _template_track_bodies(notes: NoteBuffer, ppq: int):
+    """
+    Encode each track's note events by concatenating precompiled state runs.
+
+    Returns None if the step grid is irregular (zero-length steps, or a
+    state's note-offs landing after the next state's note-ons), in which case
+    the per-note path has to interleave the events.
+    """
+    try:
+        encoder = _TemplateRunEncoder(notes.templates, notes.step_beats, ppq)
+        parts = encoder.feed(notes)
+    except _IrregularGrid:
+        return None
+    num_tracks = notes.num_tracks()
+    bodies = []
+    for tr, tail in enumerate(encoder.finish()[:num_tracks]):
+        bodies.append(b"".join(parts[tr] + tail))
+    return bodies
+
+
+class _IrregularGrid(ValueError):
+    """The steps overlap, so state runs cannot simply be concatenated."""
+
+
+class _TemplateRunEncoder:
+    """
+    Incremental form of the template fast path: feed() takes consecutive
+    template-filled NoteBuffers (windows of one sequence) and returns each
+    track's encoded event bytes so far; finish() returns the last note-offs.
+
+    The note-off run of a track's latest state is held back until that track's
+    next state (or finish()), so windows can be encoded one at a time.
+    """
+
+    def __init__(self, templates, step_beats: float, ppq: int):
+        self.templates = templates
+        self.ppq = ppq
+        self.step_ticks = int(step_beats * ppq)
+        if self.step_ticks <= 0:
+            raise _IrregularGrid("zero-length steps")
+        self.prev: List[int] = []       # per track: tick of the last written event
+        self.pending: List = []         # per track: note-off run of the last state played
+        self.pending_tick: List[int] = []
+        self.last_on = None
+        self.delta_cache: Dict[int, bytes] = {}
+
+    def _delta(self, value: int) -> bytes:
+        dv = self.delta_cache.get(value)
+        if dv is None:
+            dv = self.delta_cache[value] = _vlq(value)
+        return dv
+
+    def feed(self, notes: NoteBuffer) -> List[List[bytes]]:
+        ppq, step_ticks = self.ppq, self.step_ticks
+        on_ticks = [int(s * ppq) for s in notes.step_start]
+        if on_ticks and self.last_on is not None and self.last_on + step_ticks > on_ticks[0]:
+            raise _IrregularGrid("overlapping steps")
+        if any(a + step_ticks > b for a, b in zip(on_ticks, on_ticks[1:])):
+            raise _IrregularGrid("overlapping steps")
+        if on_ticks:
+            self.last_on = on_ticks[-1]
+
+        templates = self.templates
+        prev, pending, pending_tick = self.prev, self.pending, self.pending_tick
+        delta = self._delta
+        parts: List[List[bytes]] = [[] for _ in prev]
+        for d, on in zip(notes.steps, on_ticks):
+            tmpl = templates[d]
+            for tr, run in enumerate(tmpl.midi_on):
+                if not run:
+                    continue
+                while tr >= len(prev):
+                    prev.append(0)
+                    pending.append(None)
+                    pending_tick.append(0)
+                    parts.append([])
+                out = parts[tr]
+                if pending[tr] is not None:
+                    out.append(delta(pending_tick[tr] - prev[tr]))
+                    out.append(pending[tr])
+                    prev[tr] = pending_tick[tr]
+                out.append(delta(on - prev[tr]))
+                out.append(run)
+                prev[tr] = on
+                pending[tr] = tmpl.midi_off[tr]
+                pending_tick[tr] = on + step_ticks
+        return parts
+
+    def finish(self) -> List[List[bytes]]:
+        tails = []
+        for tr, run in enumerate(self.pending):
+            tail = []
+            if run is not None:
+                tail.append(self._delta(self.pending_tick[tr] - self.prev[tr]))
+                tail.append(run)
+                self.prev[tr] = self.pending_tick[tr]
+                self.pending[tr] = None
+            tails.append(tail)
+        return tails
+
+
+class SmfStreamWriter:
+    """
+    Write a type-1 SMF window by window, in bounded memory.
+
+    Produces the same bytes as encode_smf for the whole sequence. The header
+    and tempo track are written up front for one track per hand used by the
+    chord states (at least len(track_names)). Track 0's events go straight to
+    the output and its MTrk length is patched in close() (so `fh` must be
+    seekable); later tracks are spooled to temporary files and appended.
+
+    Windows must be template-filled NoteBuffers (capture_notes_chunks) on a
+    regular step grid; use encode_smf otherwise.
+    """
+
+    def __init__(self, fh: BinaryIO, templates, step_beats: float, *, tempo: Tempo,
+                 track_names: Tuple[str, ...] = ("Right", "Left"), channel: int = 0,
+                 ppq: int = 960):
+        if templates.channel != channel:
+            raise ValueError("templates were built for a different channel")
+        self.fh = fh
+        self.encoder = _TemplateRunEncoder(templates, step_beats, ppq)
+        used = max((t for i in range(len(templates)) for t in templates[i].track), default=-1)
+        self.num_tracks = max(used + 1, len(track_names))
+        self.track_names = track_names
+        self.spools = [tempfile.TemporaryFile() for _ in range(self.num_tracks - 1)]
+
+        fh.write(_smf_header(self.num_tracks, tempo, ppq))
+        name = track_name(0, track_names).encode("ISO-8859-1")
+        fh.write(b"MTrk")
+        self.length_pos = fh.tell()
+        fh.write(b"\x00\x00\x00\x00")           # patched in close()
+        fh.write(b"\x00\xff\x03" + _vlq(len(name)) + name)
+        self.track0_start = fh.tell()
+
+    def write(self, notes: NoteBuffer) -> None:
+        """Encode and append one window of the sequence."""
+        try:
+            parts = self.encoder.feed(notes)
+        except _IrregularGrid as e:
+            raise ValueError(f"chunked MIDI needs a regular step grid ({e})") from None
+        self._emit(parts)
+
+    def _emit(self, parts) -> None:
+        for tr, chunk in enumerate(parts):
+            if chunk:
+                (self.fh if tr == 0 else self.spools[tr - 1]).write(b"".join(chunk))
+
+    def close(self) -> None:
+        """Flush the last note-offs, finish every track and patch track 0's length."""
+        self._emit(self.encoder.finish())
+        fh = self.fh
+        fh.write(_END_OF_TRACK)
+        end = fh.tell()
+        fh.seek(self.length_pos)
+        fh.write(struct.pack(">I", end - self.length_pos - 4))
+        fh.seek(end)
+        for tr, spool in enumerate(self.spools, 1):
+            name = track_name(tr, self.track_names).encode("ISO-8859-1")
+            name_event = b"\x00\xff\x03" + _vlq(len(name)) + name
+            size = spool.tell()
+            fh.write(b"MTrk" + struct.pack(">I", len(name_event) + size + 4))
+            fh.write(name_event)
+            spool.seek(0)
+            shutil.copyfileobj(spool, fh)
+            fh.write(_END_OF_TRACK)
+            spool.close()
+        self.spools = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for spool in self.spools:
+                spool.close()
+        return False
+
+
+def _note_track_bodies(events: Events, channel: int, ppq: int):
+    """Encode each track's note events note by note (any input order)."""
+    track_col, pitch_col, start_col, dur_col, vel_col = _columns(events)
+    num_tracks = max(track_col, default=-1) + 1
+    on_status = 0x90 | channel
+    off_status = 0x80 | channel
+
+    # Split note indices per track, converting beats to ticks once per note
+    per_track: List[Tuple[List[int], List[int], List[int]]] = [
+        ([], [], []) for _ in range(num_tracks)
+    ]
+    for i, (t, s, d) in enumerate(zip(track_col, start_col, dur_col)):
+        idx, on_ticks, off_ticks = per_track[t]
+        on = int(s * ppq)
+        idx.append(i)
+        on_ticks.append(on)
+        off_ticks.append(on + int(d * ppq))
+
+    delta_cache: Dict[int, bytes] = {}
+    bodies = []
+    for idx, on_ticks, off_ticks in per_track:
+        # Preallocate: at most 2 * (4-byte delta + 3 bytes) per note
+        buf = bytearray(14 * len(idx))
+        pos = 0
+
+        # (tick, index) streams; already sorted for capture_notes output
+        ons = list(zip(on_ticks, idx))
+        offs = list(zip(off_ticks, idx))
+        if any(a > b for a, b in zip(on_ticks, on_ticks[1:])):
+            ons.sort()
+        if any(a > b for a, b in zip(off_ticks, off_ticks[1:])):
+            offs.sort()
+
+        # Merge: at equal ticks note-offs go first (midiutil's secondary sort key)
+        prev = 0
+        i_on = i_off = 0
+        n = len(ons)
+        while i_off < n or i_on < n:
+            if i_on < n and (i_off == n or ons[i_on][0] < offs[i_off][0]):
+                tick, i = ons[i_on]
+                status = on_status
+                i_on += 1
+            else:
+                tick, i = offs[i_off]
+                status = off_status
+                i_off += 1
+            delta = tick - prev
+            prev = tick
+            dv = delta_cache.get(delta)
+            if dv is None:
+                dv = delta_cache[delta] = _vlq(delta)
+            event = dv + bytes((status, pitch_col[i], vel_col[i]))
+            buf[pos:pos + len(event)] = event
+            pos += len(event)
+
+        del buf[pos:]
+        bodies.append(bytes(buf))
+    return bodies
+
+
+def _encode_midiutil(
+    events: Events,
+    *,
+    tempo: Tempo,
+    track_names: Tuple[str, ...],
+    channel: int,
+) -> bytes:
+    """
+    Encode note events through midiutil (the original backend, kept as a fallback).
+    """
+    from midiutil import MIDIFile
+
+    track_col, pitch_col, start_col, dur_col, vel_col = _columns(events)
+    num_tracks = _num_tracks(track_col, track_names)
 
     # Create a MIDIFile with the right number of tracks.
     mf = MIDIFile(
@@ -47,33 +472,17 @@ def write_midi(
     )
 
     # --- Add track metadata ---
+    tempo = normalize(tempo)
+    segments = tempo.segments() if isinstance(tempo, TempoMap) else [(0.0, tempo, 0.0)]
     for t in range(num_tracks):
-        # Use provided track name if available, otherwise fallback to "Track N"
-        name = track_names[t] if t < len(track_names) else f"Track {t}"
-        mf.addTrackName(t, 0, name)
-        mf.addTempo(t, 0, float(tempo))  # set tempo at start of track
+        mf.addTrackName(t, 0, track_name(t, track_names))
+        for beat, bpm, _ in segments:
+            mf.addTempo(t, beat, float(bpm))  # tempo at start of track (and at each change)
 
     # --- Add note events ---
-    for e in events:
-        t = int(e["track"])             # which track
-        p = int(e["pitch"])             # MIDI pitch
-        start = float(e["start_beats"]) # start time in beats
-        dur = float(e["duration_beats"])# duration in beats
-        vel = int(e["velocity"])        # velocity (0–127)
-
-        # Add the note event to the MIDI track
+    for t, p, start, dur, vel in zip(track_col, pitch_col, start_col, dur_col, vel_col):
         mf.addNote(t, channel, p, start, dur, vel)
 
-    # --- Save MIDI file ---
-    # Create folder for this seed (e.g. "seed_4")
-    seed_dir = out_root / f"seed_{seed}"
-    seed_dir.mkdir(parents=True, exist_ok=True)
-
-    # Build output path (e.g. "seed_4_Block_1.mid")
-    midi_path = seed_dir / f"seed_{seed}_{seq_name}.mid"
-
-    # Write binary MIDI file
-    with open(midi_path, "wb") as fh:
-        mf.writeFile(fh)
-
-    return midi_path
+    fh = io.BytesIO()
+    mf.writeFile(fh)
+    return fh.getvalue()
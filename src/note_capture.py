@@ -1,5 +1,14 @@
-from dataclasses import dataclass
-from typing import Dict, List, Sequence, Tuple, Set, Any
+import copy
+import struct
+import tempfile
+from array import array
+from dataclasses import dataclass, replace
+from functools import cached_property
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Set, Any
+
+from pitch_mask import pitch_mask, pitch_table
+from tempo_map import Tempo, TempoMap, normalize
 
 # A mapping of which pitches belong to each hand,
 # and which finger numbers (1–5) should be assigned to those pitches.
@@ -10,6 +19,30 @@ class HandMaps:
     lh_keys: Set[int]           # set of MIDI pitches that belong to the left hand
     rh_keys: Set[int]           # set of MIDI pitches that belong to the right hand
 
+    # Derived pitch-indexed forms (see pitch_mask), built on first use
+
+    @cached_property
+    def lh_mask(self) -> int:
+        """Bitmask of the left-hand keys."""
+        return pitch_mask(self.lh_keys)
+
+    @cached_property
+    def rh_mask(self) -> int:
+        """Bitmask of the right-hand keys."""
+        return pitch_mask(self.rh_keys)
+
+    @cached_property
+    def track_table(self) -> bytes:
+        """track_table[pitch]: 1 for left-hand keys, else 0 (right hand)."""
+        return pitch_table(dict.fromkeys(self.lh_keys, 1))
+
+    @cached_property
+    def finger_table(self) -> bytes:
+        """finger_table[pitch]: the finger of the hand playing the pitch (0 = none)."""
+        fingers = {p: f for p, f in self.rh_fingers.items() if p not in self.lh_keys}
+        fingers.update((p, self.lh_fingers.get(p) or 0) for p in self.lh_keys)
+        return pitch_table({p: f or 0 for p, f in fingers.items()})
+
 
 def build_default_maps(pitches_left: Dict[str, int],
                        pitches_right: Dict[str, int]) -> HandMaps:
@@ -62,25 +95,458 @@ def build_default_maps(pitches_left: Dict[str, int],
     )
 
 
+@dataclass(frozen=True)
+class HandNotes:
+    """
+    Columnar, JSON-oriented view of one hand's notes (timings in seconds).
+
+    All fields are parallel sequences of equal length:
+      - midi: MIDI pitch numbers
+      - start: start times in seconds
+      - duration: durations in seconds
+      - velocity: velocities scaled to 0..1
+      - finger: finger numbers (0 = no fingering)
+    """
+    midi: Sequence[int]
+    start: Sequence[float]
+    duration: Sequence[float]
+    velocity: Sequence[float]
+    finger: Sequence[int]
+
+    def __len__(self) -> int:
+        return len(self.midi)
+
+    @classmethod
+    def from_dicts(cls, notes: Sequence[Dict[str, Any]]) -> "HandNotes":
+        """Build columns from PianoVision-style note dicts (the dict-based API)."""
+        return cls(
+            midi=array("B", (n["midi"] for n in notes)),
+            start=array("d", (n["start"] for n in notes)),
+            duration=array("d", (n["duration"] for n in notes)),
+            velocity=array("d", (n["velocity"] for n in notes)),
+            finger=array("B", (n.get("finger") or 0 for n in notes)),
+        )
+
+    def scaled(self, scale: float) -> "HandNotes":
+        """Return a copy with start/duration multiplied by `scale` (pitches etc. shared)."""
+        if scale == 1.0:
+            return self
+        return replace(
+            self,
+            start=array("d", (s * scale for s in self.start)),
+            duration=array("d", (d * scale for d in self.duration)),
+        )
+
+    def to_dicts(self) -> List[dict]:
+        """Convert back to PianoVision-style note dicts."""
+        return [
+            {"midi": m, "start": s, "duration": d, "velocity": v, "finger": f or None}
+            for m, s, d, v, f in zip(self.midi, self.start, self.duration,
+                                     self.velocity, self.finger)
+        ]
+
+
+def as_hand_notes(notes) -> HandNotes:
+    """Accept either HandNotes or a list of note dicts and return HandNotes."""
+    if isinstance(notes, HandNotes):
+        return notes
+    return HandNotes.from_dicts(notes)
+
+
+@dataclass(frozen=True)
+class StateTemplate:
+    """
+    Precompiled form of one chord state, reused every time the state is played.
+
+      - pitch / track / finger: note columns in chord iteration order
+      - midi_on / midi_off: per track, the encoded note-on / note-off run
+        (status, pitch, velocity triplets joined by zero deltas, no leading delta)
+      - hand_midi / hand_finger: per track, the JSON-side pitch and finger columns
+      - mask: the chord as a pitch bitmask
+    """
+    pitch: array
+    track: array
+    finger: array
+    midi_on: Tuple[bytes, ...]
+    midi_off: Tuple[bytes, ...]
+    hand_midi: Tuple[array, ...]
+    hand_finger: Tuple[array, ...]
+    mask: int = 0
+
+
+class StateTemplates:
+    """
+    Per-seed cache of StateTemplate objects, one per chord state.
+
+    Hand routing, finger lookup and MIDI byte encoding are done once here;
+    capture_notes_columnar and the writers then only time-shift and
+    concatenate templates. Build it once per seed and share it across all
+    sequence files of that seed.
+    """
+
+    def __init__(self, chords: Sequence[frozenset[int]], maps: HandMaps, *,
+                 velocity: int = 100, channel: int = 0, num_tracks: int = 2):
+        self.velocity = int(velocity)
+        self.channel = channel
+        self.velocity_json = round(self.velocity / 127.0, 6)
+        self.num_tracks = num_tracks
+        self.templates = [self._compile(chord, maps) for chord in chords]
+
+    def __len__(self) -> int:
+        return len(self.templates)
+
+    def __getitem__(self, d: int) -> StateTemplate:
+        return self.templates[d]
+
+    def _compile(self, chord: frozenset[int], maps: HandMaps) -> StateTemplate:
+        # chord iteration order is kept: it is the note order in the files
+        pitches = array("B", (int(p) for p in chord))
+        track_table, finger_table = maps.track_table, maps.finger_table
+        tracks = array("B", (track_table[p] for p in pitches))
+        fingers = array("B", (finger_table[p] for p in pitches))
+
+        midi_on, midi_off, hand_midi, hand_finger = [], [], [], []
+        for tr in range(self.num_tracks):
+            sel = [i for i, t in enumerate(tracks) if t == tr]
+            on = [bytes((0x90 | self.channel, pitches[i], self.velocity)) for i in sel]
+            off = [bytes((0x80 | self.channel, pitches[i], self.velocity)) for i in sel]
+            midi_on.append(b"\x00".join(on))
+            midi_off.append(b"\x00".join(off))
+            hand_midi.append(array("B", (pitches[i] for i in sel)))
+            hand_finger.append(array("B", (fingers[i] for i in sel)))
+
+        return StateTemplate(pitches, tracks, fingers, tuple(midi_on), tuple(midi_off),
+                             tuple(hand_midi), tuple(hand_finger), pitch_mask(pitches))
+
+
+class NoteBuffer:
+    """
+    Compact columnar note container filled by capture_notes_columnar.
+
+    Instead of one dict per note, notes are stored in parallel typed arrays:
+      - pitch:    MIDI pitch (0–127)
+      - start:    start time in beats
+      - duration: duration in beats
+      - track:    0 = right hand, 1 = left hand
+      - finger:   finger number (0 = no fingering)
+      - velocity: MIDI velocity (0–127)
+
+    Notes are in time order, exactly as capture_notes emits them.
+
+    When filled from StateTemplates, the buffer also keeps the played state
+    indices and their start beats (`steps`, `step_start`, `step_beats`) so
+    writers can emit whole precompiled states instead of single notes.
+
+    `tempo` is a float BPM, or a TempoMap when the tempo changes.
+    """
+
+    def __init__(self, tempo: Tempo, channel: int = 0):
+        self.tempo = normalize(tempo)
+        self.channel = channel
+        self.templates: Optional[StateTemplates] = None
+        self.steps = array("I")
+        self.step_start = array("d")
+        self.step_beats = 0.0
+        self.pitch = array("B")
+        self.start = array("d")
+        self.duration = array("d")
+        self.track = array("B")
+        self.finger = array("B")
+        self.velocity = array("B")
+
+    def __len__(self) -> int:
+        return len(self.pitch)
+
+    def num_tracks(self) -> int:
+        """Highest track index + 1 (0 for an empty buffer)."""
+        return max(self.track) + 1 if self.track else 0
+
+    def at_tempo(self, tempo: Tempo) -> "NoteBuffer":
+        """
+        The same notes read at another tempo (BPM or TempoMap).
+
+        Notes are stored in beats, so only hand() (seconds) depends on the
+        tempo; the returned buffer shares every column with this one.
+        """
+        view = copy.copy(self)
+        view.tempo = normalize(tempo)
+        return view
+
+    def to_events(self) -> List[Dict[str, Any]]:
+        """Convert to the dict-based MIDI event list returned by capture_notes."""
+        return [
+            {"track": t, "channel": self.channel, "pitch": p, "start_beats": s,
+             "duration_beats": d, "velocity": v}
+            for t, p, s, d, v in zip(self.track, self.pitch, self.start,
+                                     self.duration, self.velocity)
+        ]
+
+    def hand(self, track: int) -> HandNotes:
+        """
+        Return the JSON view (seconds, rounded to 6 decimals) for one track.
+
+        Rounding is done once per distinct start/duration/velocity value rather
+        than once per note: all pitches of a chord share their timing.
+        """
+        if isinstance(self.tempo, TempoMap):
+            return self._hand_tempo_map(track)
+        if self.templates is not None:
+            return self._hand_from_templates(track)
+
+        spb = 60.0 / self.tempo
+        midi = array("B")
+        start = array("d")
+        duration = array("d")
+        velocity = array("d")
+        finger = array("B")
+
+        start_cache: Dict[float, float] = {}
+        dur_cache: Dict[float, float] = {}
+        vel_cache: Dict[int, float] = {}
+        for p, s, d, t, f, v in zip(self.pitch, self.start, self.duration,
+                                    self.track, self.finger, self.velocity):
+            if t != track:
+                continue
+            s_sec = start_cache.get(s)
+            if s_sec is None:
+                s_sec = start_cache[s] = round(s * spb, 6)
+            d_sec = dur_cache.get(d)
+            if d_sec is None:
+                d_sec = dur_cache[d] = round(d * spb, 6)
+            v_f = vel_cache.get(v)
+            if v_f is None:
+                v_f = vel_cache[v] = round(v / 127.0, 6)
+            midi.append(p)
+            start.append(s_sec)
+            duration.append(d_sec)
+            velocity.append(v_f)
+            finger.append(f)
+        return HandNotes(midi, start, duration, velocity, finger)
+
+    def _hand_from_templates(self, track: int) -> HandNotes:
+        """hand() for template-filled buffers: one rounding per step, columns concatenated."""
+        spb = 60.0 / self.tempo
+        templates = self.templates
+        midi = array("B")
+        start = array("d")
+        finger = array("B")
+        for d, s in zip(self.steps, self.step_start):
+            tmpl = templates[d]
+            n = len(tmpl.hand_midi[track])
+            if n:
+                midi.extend(tmpl.hand_midi[track])
+                finger.extend(tmpl.hand_finger[track])
+                start.extend((round(s * spb, 6),) * n)
+        n = len(midi)
+        duration = array("d", (round(self.step_beats * spb, 6),)) * n
+        velocity = array("d", (templates.velocity_json,)) * n
+        return HandNotes(midi, start, duration, velocity, finger)
+
+    def _hand_tempo_map(self, track: int) -> HandNotes:
+        """
+        hand() under a TempoMap: starts and ends are converted through the map,
+        so a note's duration in seconds depends on where it starts.
+        """
+        seconds = self.tempo.seconds
+        midi = array("B")
+        start = array("d")
+        duration = array("d")
+        velocity = array("d")
+        finger = array("B")
+
+        # (start, duration) beats -> rounded (start, duration) seconds
+        time_cache: Dict[Tuple[float, float], Tuple[float, float]] = {}
+        vel_cache: Dict[int, float] = {}
+        for p, s, d, t, f, v in zip(self.pitch, self.start, self.duration,
+                                    self.track, self.finger, self.velocity):
+            if t != track:
+                continue
+            times = time_cache.get((s, d))
+            if times is None:
+                s_sec = seconds(s)
+                times = time_cache[s, d] = (round(s_sec, 6), round(seconds(s + d) - s_sec, 6))
+            v_f = vel_cache.get(v)
+            if v_f is None:
+                v_f = vel_cache[v] = round(v / 127.0, 6)
+            midi.append(p)
+            start.append(times[0])
+            duration.append(times[1])
+            velocity.append(v_f)
+            finger.append(f)
+        return HandNotes(midi, start, duration, velocity, finger)
+
+
+def capture_notes_columnar(
+    state_sequence: Sequence[int],
+    chords: Sequence[frozenset[int]],
+    fingers_used: int,
+    tempo: Tempo,
+    maps: HandMaps,
+    *,
+    start_beat: float = 0.0,
+    step_beats: float = 1.0,
+    velocity: int = 100,
+    channel: int = 0,
+    templates: Optional[StateTemplates] = None,
+) -> NoteBuffer:
+    """
+    Convert a sequence of chord indices into a columnar NoteBuffer.
+
+    Every chord state is precompiled once into a StateTemplate (hand routing,
+    fingering, encoded MIDI runs), so the per-step work is just time-shifting
+    and concatenating templates.
+
+    Args: see capture_notes, plus
+        templates: Shared StateTemplates for `chords` (built here if omitted).
+            Must have been built with the same velocity and channel.
+
+    Returns:
+        NoteBuffer with one entry per played pitch, in time order.
+    """
+    vel = int(velocity)
+    if templates is None:
+        templates = StateTemplates(chords, maps, velocity=vel, channel=channel)
+    elif templates.velocity != vel or templates.channel != channel:
+        raise ValueError("templates were built for a different velocity/channel")
+
+    buf = NoteBuffer(tempo, channel)
+    buf.templates = templates
+    buf.step_beats = step_beats
+
+    t_beats = float(start_beat)
+    for d in state_sequence:
+        tmpl = templates[d]
+        n = len(tmpl.pitch)
+        buf.pitch.extend(tmpl.pitch)
+        buf.track.extend(tmpl.track)
+        buf.finger.extend(tmpl.finger)
+        buf.start.extend((t_beats,) * n)
+        buf.duration.extend((step_beats,) * n)
+        buf.velocity.extend((vel,) * n)
+        buf.steps.append(d)
+        buf.step_start.append(t_beats)
+        # Advance by one step (duration in beats)
+        t_beats += step_beats
+
+    return buf
+
+
+def capture_notes_chunks(
+    state_sequence: Iterable[int],
+    chords: Sequence[frozenset[int]],
+    fingers_used: int,
+    tempo: Tempo,
+    maps: HandMaps,
+    *,
+    window: int = 4096,
+    start_beat: float = 0.0,
+    step_beats: float = 1.0,
+    velocity: int = 100,
+    channel: int = 0,
+    templates: Optional[StateTemplates] = None,
+) -> Iterator[NoteBuffer]:
+    """
+    Capture a sequence in windows of at most `window` steps.
+
+    Yields one NoteBuffer per window, so a very long (or lazily generated)
+    sequence never exists as a whole note buffer. Each window continues the
+    beat clock of the previous one, so the windows' notes are exactly the
+    notes capture_notes_columnar would return for the whole sequence.
+
+    Args: see capture_notes_columnar, plus
+        window: Steps per window.
+    """
+    if window < 1:
+        raise ValueError("window must be at least one step")
+    vel = int(velocity)
+    if templates is None:
+        templates = StateTemplates(chords, maps, velocity=vel, channel=channel)
+
+    steps = iter(state_sequence)
+    t_beats = float(start_beat)
+    while True:
+        part = list(islice(steps, window))
+        if not part:
+            return
+        buf = capture_notes_columnar(part, chords, fingers_used, tempo, maps,
+                                     start_beat=t_beats, step_beats=step_beats,
+                                     velocity=vel, channel=channel, templates=templates)
+        # same accumulation as the unwindowed loop, so start times match bit for bit
+        t_beats = buf.step_start[-1] + step_beats
+        yield buf
+
+
+class HandSpool:
+    """
+    Append-only temporary file of HandNotes blocks (one hand of a chunked render).
+
+    Each block is stored as a note count followed by its raw column arrays;
+    blocks() reads them back one at a time and can be called repeatedly.
+    """
+
+    _COLUMNS = (("midi", "B"), ("start", "d"), ("duration", "d"),
+                ("velocity", "d"), ("finger", "B"))
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self.notes = 0
+
+    def append(self, notes: HandNotes) -> None:
+        n = len(notes)
+        self._file.write(struct.pack("<I", n))
+        for field, code in self._COLUMNS:
+            col = getattr(notes, field)
+            if not (isinstance(col, array) and col.typecode == code):
+                col = array(code, col)
+            col.tofile(self._file)
+        self.notes += n
+
+    def blocks(self) -> Iterator[HandNotes]:
+        """Yield the stored blocks in order."""
+        fh = self._file
+        end = fh.seek(0, 2)
+        fh.seek(0)
+        while fh.tell() < end:
+            (n,) = struct.unpack("<I", fh.read(4))
+            cols = {}
+            for field, code in self._COLUMNS:
+                cols[field] = col = array(code)
+                col.fromfile(fh, n)
+            yield HandNotes(**cols)
+        fh.seek(end)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
 def capture_notes(
     state_sequence: Sequence[int],
     chords: Sequence[frozenset[int]],
     fingers_used: int,
-    tempo: float,
+    tempo: Tempo,
     maps: HandMaps,
     *,
     start_beat: float = 0.0,
     step_beats: float = 1.0,
     velocity: int = 100,
     channel: int = 0,   # kept for convenience if you later write to a MIDIFile
-) -> Tuple[List[Dict[str, Any]], List[dict], List[dict], float]:
+) -> Tuple[List[Dict[str, Any]], List[dict], List[dict]]:
     """
     Convert a sequence of chord indices into MIDI-friendly events and JSON note dicts.
 
+    Thin dict-based adapter around capture_notes_columnar.
+
     Args:
         state_sequence: Sequence of indices selecting chords (sets of pitches).
         chords: List of frozensets containing pitches. Each state_sequence element indexes into this list.
-        tempo: Tempo in beats per minute.
+        tempo: Tempo in beats per minute, or a TempoMap (see tempo_map).
         maps: HandMaps object describing left/right hand keys and finger numbers.
         start_beat: Starting beat offset (default = 0.0).
         step_beats: Duration of each chord in beats (default = 1.0).
@@ -91,53 +557,10 @@ def capture_notes(
         events:      List of MIDI-friendly note events (beats, track, pitch, velocity).
         right_notes: List of PianoVision-style note dicts for right hand (in seconds).
         left_notes:  List of PianoVision-style note dicts for left hand (in seconds).
-        end_beat:    The final beat position after processing the sequence.
     """
-    events: List[Dict[str, Any]] = []
-    right_notes: List[dict] = []
-    left_notes: List[dict] = []
-
-    # Seconds per beat
-    spb = 60.0 / float(tempo)
-    # Current time in beats
-    t_beats = float(start_beat)
-    # Velocity scaled to 0..1 for JSON
-    vel_float = round(velocity / 127.0, 6)
-
-    # Iterate over sequence of chord indices
-    for d in state_sequence:
-        chord_notes = list(chords[d])  # convert frozenset to list (dynamic number of pitches)
-        for pitch in chord_notes:
-            p = int(pitch)
-            # Decide which track/hand this pitch belongs to
-            track = 1 if p in maps.lh_keys else 0
-
-            # --- MIDI-friendly event (timings in beats) ---
-            events.append({
-                "track": track,
-                "channel": channel,
-                "pitch": p,
-                "start_beats": t_beats,
-                "duration_beats": step_beats,
-                "velocity": int(velocity),
-            })
-
-            # --- JSON-friendly note dict (timings in seconds) ---
-            note_dict = {
-                "midi": p,
-                "start": round(t_beats * spb, 6),
-                "duration": round(step_beats * spb, 6),
-                "velocity": vel_float,  # scaled velocity
-                "finger": (
-                    maps.lh_fingers.get(p)
-                    if track == 1
-                    else maps.rh_fingers.get(p)
-                ),
-            }
-            (left_notes if track == 1 else right_notes).append(note_dict)
-
-        # Advance by one step (duration in beats)
-        t_beats += step_beats
-
-    # Return events, JSON note dicts
-    return events, right_notes, left_notes
+    buf = capture_notes_columnar(
+        state_sequence, chords, fingers_used, tempo, maps,
+        start_beat=start_beat, step_beats=step_beats,
+        velocity=velocity, channel=channel,
+    )
+    return buf.to_events(), buf.hand(0).to_dicts(), buf.hand(1).to_dicts()
@@ -0,0 +1,49 @@
+"""
+Integer bitmask form of chords and key sets: bit p is set when MIDI pitch p
+(0-127) is in the set.
+
+Masks make the set algebra on chords cheap: union, intersection and overlap
+tests are single integer operations and the size of a set is a popcount, with
+no hashing or per-element work. They are plain ints, so they hash, compare and
+pickle like any other key.
+
+Chords stay frozensets at the API boundary (generate_states, StateTemplates):
+their iteration order fixes the note order in the written files. Use
+pitch_mask() to get the mask of a chord and mask_pitches() for the view back.
+"""
+from typing import Iterable, Mapping, Tuple
+
+NUM_PITCHES = 128
+
+
+def pitch_mask(pitches: Iterable[int]) -> int:
+    """Mask with one bit per pitch."""
+    mask = 0
+    for p in pitches:
+        mask |= 1 << p
+    return mask
+
+
+def mask_pitches(mask: int) -> Tuple[int, ...]:
+    """The pitches in a mask, ascending."""
+    out = []
+    while mask:
+        low = mask & -mask
+        out.append(low.bit_length() - 1)
+        mask ^= low
+    return tuple(out)
+
+
+# number of pitches in a mask (the bound method avoids a Python-level call)
+popcount = int.bit_count
+
+
+def pitch_table(values: Mapping[int, int], default: int = 0) -> bytes:
+    """
+    Lookup table indexed by pitch: table[p] is values[p], or `default` for
+    pitches without a value. Values must fit in a byte.
+    """
+    table = bytearray([default]) * NUM_PITCHES
+    for p, v in values.items():
+        table[p] = v
+    return bytes(table)
@@ -0,0 +1,327 @@
+"""
+Live playback of captured notes to a synth or a response-capture process.
+
+A Schedule precompiles the notes of a sequence (a NoteBuffer from
+capture_notes_columnar, or capture_notes' event dicts) into flat,
+time-sorted arrays of (timestamp, status, pitch, velocity): one note-on and
+one note-off per note, note-offs before note-ons at the same instant (as in
+the written MIDI files). Messages due at the same instant are pre-joined into
+one bytes object, so play() does no encoding or sorting while it runs: it
+sleeps until shortly before each instant, spins for the last stretch on
+time.perf_counter, hands the bytes to the sink and records how late it was.
+
+Sinks take (message bytes, seconds since start):
+
+    MidiStreamSink(fh)       raw MIDI bytes to a binary file object (a MIDI
+                             device node like /dev/snd/midiC1D0, a pipe, stdout)
+    UnixSocketSink(path)     raw MIDI bytes to a listening UNIX stream socket
+    RecorderSink()           keeps every (time, message) in memory (tests)
+
+    python src/playback.py --seed 20 --sequence Pretest --sink socket:/tmp/synth.sock
+    python src/playback.py --seed 20 --sequence Pretest --tempo 240 --sink record
+"""
+import argparse
+import gc
+import socket
+import sys
+import time
+from array import array
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from note_capture import NoteBuffer
+from tempo_map import Tempo, TempoMap, normalize
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+
+# play(): sleep until this long before an event, then spin (time.sleep may
+# overshoot by a fraction of a millisecond)
+SPIN_SECONDS = 0.002
+
+Events = Union[NoteBuffer, Sequence[Dict[str, Any]]]
+
+
+class Schedule:
+    """
+    Flat, time-sorted note-on/note-off messages of one sequence.
+
+    Attributes:
+        time, status, pitch, velocity: parallel arrays, one entry per message
+            (time in seconds from the start).
+        instants: the distinct message times, ascending.
+        messages: messages[k] is the concatenated MIDI bytes due at instants[k].
+    """
+
+    def __init__(self, events: Events, tempo: Tempo, channel: Optional[int] = None):
+        """
+        Args:
+            events: NoteBuffer or capture_notes event dicts (start/duration in beats).
+            tempo: BPM or TempoMap used to convert beats to seconds.
+            channel: MIDI channel (default: the NoteBuffer's / each event's channel).
+        """
+        if isinstance(events, NoteBuffer):
+            ch = events.channel if channel is None else channel
+            notes = zip(events.pitch, events.start, events.duration, events.velocity)
+            rows = [(p, s, d, v, ch) for p, s, d, v in notes]
+        else:
+            rows = [(int(e["pitch"]), float(e["start_beats"]), float(e["duration_beats"]),
+                     int(e["velocity"]), int(e.get("channel", 0) if channel is None else channel))
+                    for e in events]
+
+        tempo = normalize(tempo)
+        if isinstance(tempo, TempoMap):
+            seconds = tempo.seconds
+        else:
+            spb = 60.0 / tempo
+            def seconds(beat):
+                return beat * spb
+
+        # (time, 0 = off / 1 = on, note index) sorts offs before ons at the same
+        # instant and keeps capture order otherwise
+        keyed = []
+        for i, (p, s, d, v, ch) in enumerate(rows):
+            keyed.append((seconds(s + d), 0, i, NOTE_OFF | ch, p, 0))
+            keyed.append((seconds(s), 1, i, NOTE_ON | ch, p, v))
+        keyed.sort()
+
+        self.time = array("d", (k[0] for k in keyed))
+        self.status = array("B", (k[3] for k in keyed))
+        self.pitch = array("B", (k[4] for k in keyed))
+        self.velocity = array("B", (k[5] for k in keyed))
+
+        self.instants = array("d")
+        self.messages: List[bytes] = []
+        i, n = 0, len(keyed)
+        while i < n:
+            j = i
+            t = self.time[i]
+            while j < n and self.time[j] == t:
+                j += 1
+            self.instants.append(t)
+            self.messages.append(bytes(b for k in range(i, j) for b in
+                                       (self.status[k], self.pitch[k], self.velocity[k])))
+            i = j
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    @property
+    def duration(self) -> float:
+        """Time of the last message in seconds."""
+        return self.time[-1] if self.time else 0.0
+
+    def sounding(self, instant: int) -> List[Tuple[int, int]]:
+        """(channel, pitch) of the notes still on once instants[:instant] were sent."""
+        is_on: Dict[Tuple[int, int], int] = {}
+        end = sum(len(m) for m in self.messages[:instant]) // 3
+        for k in range(end):
+            key = (self.status[k] & 0x0F, self.pitch[k])
+            is_on[key] = is_on.get(key, 0) + (1 if self.status[k] & 0xF0 == NOTE_ON else -1)
+        return [key for key, count in is_on.items() if count > 0]
+
+
+class JitterStats(NamedTuple):
+    """How late play() sent each instant relative to its scheduled time."""
+    instants: int
+    messages: int
+    mean_us: float
+    p50_us: float
+    p99_us: float
+    max_us: float
+    seconds: float      # wall time of the whole playback
+
+    def __str__(self):
+        return (f"{self.messages} messages at {self.instants} instants in {self.seconds:.3f}s; "
+                f"lateness mean {self.mean_us:.1f} us, p50 {self.p50_us:.1f} us, "
+                f"p99 {self.p99_us:.1f} us, max {self.max_us:.1f} us")
+
+
+def jitter_stats(lateness: Sequence[float], messages: int, seconds: float) -> JitterStats:
+    """Summarize per-instant lateness (in seconds)."""
+    if not lateness:
+        return JitterStats(0, messages, 0.0, 0.0, 0.0, 0.0, seconds)
+    ordered = sorted(lateness)
+    n = len(ordered)
+
+    def pct(q):
+        return ordered[min(n - 1, int(q * n))] * 1e6
+
+    return JitterStats(n, messages, sum(ordered) / n * 1e6, pct(0.5), pct(0.99),
+                       ordered[-1] * 1e6, seconds)
+
+
+def play(schedule: Schedule, sink, *, speed: float = 1.0, lead_in: float = 0.0,
+         spin: float = SPIN_SECONDS, clock=time.perf_counter, sleep=time.sleep) -> JitterStats:
+    """
+    Send a schedule to a sink in real time.
+
+    Args:
+        schedule: The precompiled messages.
+        sink: Object with send(message: bytes, t: float), t being seconds since start.
+        speed: Playback rate (2.0 = twice as fast).
+        lead_in: Seconds to wait before the first instant.
+        spin: Busy-wait this long before each instant instead of sleeping.
+        clock, sleep: Time source and sleep function (replaceable for tests).
+
+    The garbage collector is paused while playing (a collection can take
+    longer than the gap between two instants).
+
+    Returns:
+        JitterStats over every instant sent. On KeyboardInterrupt, note-offs
+        for the sounding notes (including those of an instant that was being
+        sent) are sent before the exception propagates.
+    """
+    if speed <= 0:
+        raise ValueError("speed must be positive")
+    instants, messages = schedule.instants, schedule.messages
+    lateness = array("d", bytes(8 * len(instants)))
+    send = sink.send
+    scale = 1.0 / speed
+    sent = 0
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    t0 = clock() + lead_in
+    try:
+        for k in range(len(instants)):
+            target = t0 + instants[k] * scale
+            remaining = target - clock()
+            if remaining > spin:
+                sleep(remaining - spin)
+            now = clock()
+            while now < target:
+                now = clock()
+            send(messages[k], now - t0)
+            sent = k + 1
+            lateness[k] = now - target
+    except KeyboardInterrupt:
+        hanging = dict.fromkeys(schedule.sounding(sent))
+        hanging.update(dict.fromkeys(schedule.sounding(min(sent + 1, len(instants)))))
+        send(bytes(b for ch, p in hanging for b in (NOTE_OFF | ch, p, 0)), clock() - t0)
+        raise
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return jitter_stats(lateness, len(schedule), clock() - t0)
+
+
+# --- Sinks ---
+
+class MidiStreamSink:
+    """Raw MIDI bytes to a binary file object, flushed after every instant."""
+
+    def __init__(self, fh: BinaryIO):
+        self.fh = fh
+
+    def send(self, message: bytes, t: float) -> None:
+        self.fh.write(message)
+        self.fh.flush()
+
+    def close(self) -> None:
+        self.fh.close()
+
+
+class UnixSocketSink:
+    """Raw MIDI bytes to a listening UNIX stream socket (e.g. a response-capture process)."""
+
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(str(path))
+
+    def send(self, message: bytes, t: float) -> None:
+        self.sock.sendall(message)
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class RecorderSink:
+    """Keeps (t, message) of every instant in memory."""
+
+    def __init__(self):
+        self.sent: List[Tuple[float, bytes]] = []
+
+    def send(self, message: bytes, t: float) -> None:
+        self.sent.append((t, message))
+
+    def close(self) -> None:
+        pass
+
+    def messages(self) -> List[Tuple[int, int, int]]:
+        """Every sent (status, pitch, velocity), in order."""
+        data = b"".join(m for _, m in self.sent)
+        return [tuple(data[i:i + 3]) for i in range(0, len(data), 3)]
+
+
+def open_sink(spec: str):
+    """Sink for a --sink spec: "record", "socket:PATH", "midi:PATH" or "midi:-" (stdout)."""
+    kind, _, target = spec.partition(":")
+    if kind == "record" and not target:
+        return RecorderSink()
+    if kind == "socket" and target:
+        return UnixSocketSink(target)
+    if kind == "midi" and target:
+        return MidiStreamSink(sys.stdout.buffer if target == "-" else open(target, "wb"))
+    raise ValueError(f"Invalid sink {spec!r}: expected record, socket:PATH or midi:PATH")
+
+
+def main(argv=None):
+    import generate_states
+    import load_sequences
+    import main as config
+    from note_capture import build_default_maps, capture_notes_columnar
+    from tempo_map import parse_tempo_map
+
+    here = Path(__file__).parent
+    parser = argparse.ArgumentParser(description="Play a sequence live to a MIDI sink.")
+    parser.add_argument("--seed", type=int, default=config.SEED,
+                        help="seed whose chord states to play (default: SEED)")
+    parser.add_argument("--sequence", required=True,
+                        help="sequence name (a file in state_sequences/, without .txt)")
+    parser.add_argument("--sink", default="record",
+                        help='"record" (in memory), "socket:PATH" or "midi:PATH" ("midi:-" = '
+                             "stdout) (default: record)")
+    parser.add_argument("--tempo", type=float, default=None,
+                        help="tempo in BPM (default: TEMPO_MAP, else TEMPO)")
+    parser.add_argument("--tempo-map", type=str, default=None,
+                        help='tempo changes, e.g. "0:100,16:100~32:140" (see main.py --tempo-map)')
+    parser.add_argument("--lead-in", type=float, default=0.5,
+                        help="seconds before the first note (default: 0.5)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.tempo_map:
+            tempo = parse_tempo_map(args.tempo_map)
+        else:
+            tempo = args.tempo or config.configured_tempo()
+        sequences = load_sequences.load_sequences(here / "state_sequences")
+        if args.sequence not in sequences:
+            raise ValueError(f"no sequence {args.sequence!r} (have: {', '.join(sequences)})")
+        sink = open_sink(args.sink)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+    chords, _ = generate_states.generate_states(
+        config.pitches_left, config.pitches_right,
+        n_left=config.CHORDS_LEFT_HAND, n_right=config.CHORDS_RIGHT_HAND,
+        n_cross=config.CHORDS_CROSS_HAND, fingers_used=config.FINGERS_USED,
+        seed=args.seed, sampler=config.SAMPLER,
+    )
+    notes = capture_notes_columnar(sequences[args.sequence], chords, config.FINGERS_USED,
+                                   tempo, maps)
+    t0 = time.perf_counter()
+    schedule = Schedule(notes, tempo)
+    print(f"Compiled {len(schedule)} messages ({schedule.duration:.1f}s) in "
+          f"{(time.perf_counter() - t0) * 1000:.1f} ms", file=sys.stderr)
+    try:
+        stats = play(schedule, sink, lead_in=args.lead_in)
+    except KeyboardInterrupt:
+        sys.exit("Stopped (sent note-offs for sounding notes).")
+    finally:
+        sink.close()
+    print(stats, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
+import os
 from pathlib import Path
+import instrument
+import json_writer
+from build_cache import BuildCache, input_key
 from json_writer import PianoVisionJsonWriter
-from midi_writer import write_midi
-from note_capture import capture_notes, HandMaps  # renamed back to capture_notes for clarity
+from note_capture import capture_notes_chunks, capture_notes_columnar, HandMaps, HandSpool, StateTemplates
+from tempo_map import Tempo
+
+# midi_writer is imported where MIDI is written, so JSON-only renders never load it
 
 def render_sequence(
     seq_name: str,
@@ -9,52 +15,244 @@ def render_sequence(
     chords,
     fingers_used,
     *,
-    tempo: float,
+    tempo: Tempo,
     maps: HandMaps,
     out_root: Path,
     seed: int,
     ts=(4, 4),
     ppq=960,
     scroll_speed: float = 1.0,
+    json_compact: bool = False,
+    json_gzip: bool = False,
+    midi_backend: str = "native",
+    templates: StateTemplates = None,
+    cache: BuildCache = None,
+    pipeline=None,
+    bundle=None,
+    chunk_steps: int = None,
+    midi: bool = True,
 ):
     """
     Render one state sequence into both a MIDI file and a PianoVision JSON file.
 
     Args:
         seq_name (str): Name of the sequence (used for filenames).
-        state_sequence: A list of integers indexing into `chords`.
+        state_sequence: A list of integers indexing into `chords`, or any re-iterable
+            sequence of them (e.g. a lazy sequence_grammar.GeneratedSequence).
         chords: List of (pitch_a, pitch_b) tuples, one per state.
-        tempo (float): Tempo in beats per minute.
+        tempo (float | TempoMap): Tempo in beats per minute, or a TempoMap for
+            tempo changes within the sequence (MIDI tempo events, JSON tempos/measures).
         maps (HandMaps): Object describing left/right key sets and fingerings.
         out_root (Path): Root folder where the output should be written.
         seed (int): Seed identifier (used in folder/filenames).
         ts (tuple): Time signature as (numerator, denominator). Default (4, 4).
         ppq (int): MIDI pulses per quarter note. Default 960.
+        scroll_speed (float): Visual speed multiplier for the PianoVision JSON.
+        json_compact (bool): Write the JSON without indentation.
+        json_gzip (bool): Gzip the JSON (written as .pv.json.gz).
+        midi_backend (str): "native" SMF encoder or the "midiutil" fallback.
+        templates (StateTemplates): Precompiled chord states shared by all sequences
+            of this seed (built per call if omitted).
+        cache (BuildCache): Optional per-seed build cache; if the outputs were already
+            built from identical inputs, nothing is rendered or written.
+        pipeline (WritePipeline): Optional write pipeline. The files are encoded here and
+            handed to its writer threads; they (and the cache entry) are complete once
+            the pipeline has been closed.
+        bundle (bundle.BundleWriter | bundle.MemoryBundle): Optional archive that receives
+            both files instead of the file system (not combinable with a pipeline).
+        chunk_steps (int): Render in windows of this many steps with bounded memory
+            (native MIDI backend, plain files only). Output is byte-identical.
+        midi (bool): Write the .mid file. False renders the PianoVision JSON only
+            (midi_writer is not even imported).
 
     Returns:
-        Tuple[Path, Path]:
-            - Path to the generated MIDI file
+        Tuple[Path | None, Path]:
+            - Path to the generated MIDI file (None when midi is False)
             - Path to the generated JSON file
     """
+    if bundle is not None and pipeline is not None:
+        raise ValueError("render_sequence: use either a bundle or a write pipeline, not both")
+    if chunk_steps and (bundle is not None or pipeline is not None
+                        or (midi and midi_backend != "native")):
+        raise ValueError("render_sequence: chunked rendering needs the native MIDI backend "
+                         "and writes plain files (no bundle or write pipeline)")
 
-    # --- Step 1: Convert the sequence into MIDI-friendly events + JSON note dicts ---
-    events, right_notes, left_notes = capture_notes(
-        state_sequence, chords, fingers_used, tempo=tempo, maps=maps
-    )
-
-    # --- Step 2: Write MIDI file from captured events ---
-    midi_path = write_midi(
-        seq_name,
-        events,
-        tempo=tempo,
-        seed=seed,
-        out_root=out_root,
-    )
-
-    # --- Step 3: Write PianoVision JSON next to the MIDI file ---
     # scroll_speed > 1 speeds up visuals relative to audio; kept separate from tempo
-    writer = PianoVisionJsonWriter(bpm=tempo, ts=ts, ppq=ppq, visual_speed=scroll_speed)
-    json_path = midi_path.with_suffix(".pv.json")
-    writer.write(json_path, right_notes, left_notes, f"seed_{seed}_{seq_name}")
+    writer = PianoVisionJsonWriter(bpm=tempo, ts=ts, ppq=ppq, visual_speed=scroll_speed,
+                                   compact=json_compact, gzip=json_gzip)
+
+    # --- Step 0: Skip if the outputs are up to date ---
+    if cache is not None:
+        with instrument.stage("cache_check", seed=seed, sequence=seq_name):
+            midi_path, json_path = _output_paths(writer, seq_name, seed, out_root, midi)
+            if midi:
+                import midi_writer
+                outputs = {"midi_backend": midi_backend, "midi_writer": midi_writer.WRITER_VERSION}
+            else:
+                outputs = {"outputs": "json"}
+            # generated sequences are keyed by their grammar, length and seed
+            spec = getattr(state_sequence, "cache_spec", None)
+            key = input_key(
+                seed=seed, seq_name=seq_name,
+                state_sequence=spec() if spec is not None else state_sequence,
+                chords=[sorted(c) for c in chords], fingers_used=fingers_used,
+                lh_fingers=maps.lh_fingers, rh_fingers=maps.rh_fingers,
+                lh_keys=maps.lh_keys, rh_keys=maps.rh_keys,
+                tempo=tempo, ts=ts, ppq=ppq, scroll_speed=scroll_speed,
+                json_compact=json_compact, json_gzip=json_gzip,
+                json_writer=json_writer.WRITER_VERSION, **outputs,
+            )
+            paths = (midi_path, json_path) if midi else (json_path,)
+            fresh = cache.is_fresh(seq_name, key, paths)
+        if fresh:
+            return midi_path, json_path
+
+    # optional cProfile session for the actual rendering (no-op unless enabled)
+    with instrument.profile(f"seed_{seed}_{seq_name}"):
+        if chunk_steps:
+            midi_path, json_path = _render_chunked(
+                writer, seq_name, state_sequence, chords, fingers_used, tempo=tempo,
+                maps=maps, out_root=out_root, seed=seed, templates=templates,
+                chunk_steps=chunk_steps, midi=midi)
+            if cache is not None:
+                cache.record(seq_name, key, paths)
+            return midi_path, json_path
+
+        # --- Step 1: Convert the sequence into a columnar note buffer ---
+        with instrument.stage("capture_notes", seed=seed, sequence=seq_name) as st:
+            notes = capture_notes_columnar(
+                state_sequence, chords, fingers_used, tempo=tempo, maps=maps, templates=templates
+            )
+            st.set(notes=len(notes))
+
+        if pipeline is not None:
+            return _submit_sequence(pipeline, writer, notes, seq_name, seed, out_root,
+                                    tempo=tempo, midi_backend=midi_backend, midi=midi,
+                                    record=None if cache is None else
+                                    (lambda paths: cache.record(seq_name, key, paths)))
+
+        # --- Step 2: Write MIDI file from captured notes ---
+        midi_path, json_path = _output_paths(writer, seq_name, seed, out_root, midi)
+        if midi:
+            from midi_writer import write_midi
+            with instrument.stage("write_midi", seed=seed, sequence=seq_name) as st:
+                midi_path = write_midi(
+                    seq_name,
+                    notes,
+                    tempo=tempo,
+                    seed=seed,
+                    out_root=out_root,
+                    backend=midi_backend,
+                    bundle=bundle,
+                )
+                if st:
+                    st.set(notes=len(notes), bytes=_file_size(midi_path, bundle))
+
+        # --- Step 3: Write PianoVision JSON next to the MIDI file ---
+        with instrument.stage("write_json", seed=seed, sequence=seq_name) as st:
+            if bundle is None:
+                json_path.parent.mkdir(parents=True, exist_ok=True)
+            writer.write(json_path, notes.hand(0), notes.hand(1), f"seed_{seed}_{seq_name}",
+                         bundle=bundle)
+            if st:
+                st.set(notes=len(notes), bytes=_file_size(json_path, bundle))
+
+    if cache is not None:
+        cache.record(seq_name, key, paths)
+
+    return midi_path, json_path
+
+
+def _output_paths(writer, seq_name, seed, out_root, midi):
+    """(.mid path or None, JSON path): both out_root/seed_<seed>/seed_<seed>_<seq_name>.*"""
+    stem = Path(out_root) / f"seed_{seed}" / f"seed_{seed}_{seq_name}"
+    json_path = stem.with_name(stem.name + writer.suffix)
+    return (stem.with_name(stem.name + ".mid") if midi else None), json_path
+
+
+def _file_size(path, bundle) -> int:
+    return path.stat().st_size if bundle is None else bundle.size(path)
+
+
+def _render_chunked(writer, seq_name, state_sequence, chords, fingers_used, *, tempo,
+                    maps, out_root, seed, templates, chunk_steps, midi=True):
+    """
+    Render a sequence window by window: peak memory is bounded by chunk_steps
+    steps, not by the length of the sequence.
+
+    Each window's MIDI events are appended to the .mid file as it is captured
+    (SmfStreamWriter patches the track lengths at the end); its JSON-side notes
+    are spooled to temporary files and streamed into the JSON afterwards, since
+    song_length and measures come before the notes in the file.
+    """
+    if templates is None:
+        templates = StateTemplates(chords, maps)
+    midi_path, json_path = _output_paths(writer, seq_name, seed, out_root, midi)
+    json_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with HandSpool() as right, HandSpool() as left:
+        windows = capture_notes_chunks(state_sequence, chords, fingers_used, tempo, maps,
+                                       window=chunk_steps, templates=templates)
+        if not midi:
+            # --- Step 1: Capture windows and spool the JSON notes ---
+            with instrument.stage("capture_notes", seed=seed, sequence=seq_name):
+                for window in windows:
+                    right.append(window.hand(0))
+                    left.append(window.hand(1))
+
+        # --- Steps 1-2: Capture windows, stream MIDI, spool the JSON notes ---
+        else:
+            from midi_writer import SmfStreamWriter
+            with instrument.stage("write_midi", seed=seed, sequence=seq_name) as st:
+                try:
+                    # one beat per step, as capture_notes_chunks defaults to
+                    with open(midi_path, "wb") as fh, \
+                            SmfStreamWriter(fh, templates, 1.0, tempo=tempo) as smf:
+                        for window in windows:
+                            smf.write(window)
+                            right.append(window.hand(0))
+                            left.append(window.hand(1))
+                except BaseException:
+                    # don't leave a truncated file that looks complete
+                    try:
+                        os.unlink(midi_path)
+                    except OSError:
+                        pass
+                    raise
+                if st:
+                    st.set(notes=right.notes + left.notes, bytes=midi_path.stat().st_size)
+
+        # --- Step 3: Stream the PianoVision JSON from the spools ---
+        with instrument.stage("write_json", seed=seed, sequence=seq_name) as st:
+            writer.write_blocks(json_path, right.blocks, left.blocks, f"seed_{seed}_{seq_name}")
+            if st:
+                st.set(notes=right.notes + left.notes, bytes=json_path.stat().st_size)
+
+    return midi_path, json_path
+
+
+def _submit_sequence(pipeline, writer, notes, seq_name, seed, out_root, *,
+                     tempo, midi_backend, record, midi=True):
+    """Encode both files of a sequence (or just the JSON) and queue them on the write pipeline."""
+    midi_path, json_path = _output_paths(writer, seq_name, seed, out_root, midi)
+    files = []
+
+    # --- Step 2: Encode MIDI bytes ---
+    if midi:
+        from midi_writer import encode_midi
+        with instrument.stage("encode_midi", seed=seed, sequence=seq_name) as st:
+            midi_data = encode_midi(notes, tempo=tempo, backend=midi_backend)
+            st.set(notes=len(notes), bytes=len(midi_data))
+        files.append((midi_path, midi_data))
+
+    # --- Step 3: Encode PianoVision JSON ---
+    with instrument.stage("encode_json", seed=seed, sequence=seq_name) as st:
+        json_data = writer.encode(notes.hand(0), notes.hand(1), f"seed_{seed}_{seq_name}")
+        st.set(notes=len(notes), bytes=len(json_data))
 
+    # --- Step 4: Hand the files to the writer threads (blocks if the queue is full) ---
+    files.append((json_path, json_data))
+    paths = tuple(path for path, _ in files)
+    with instrument.stage("queue_write", seed=seed, sequence=seq_name):
+        pipeline.submit(files, then=None if record is None else (lambda: record(paths)))
     return midi_path, json_path
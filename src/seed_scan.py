@@ -0,0 +1,293 @@
+"""
+Search for seeds whose 9 generated states satisfy experiment-design constraints.
+
+Each candidate seed runs the exact chord draws of generate_states (same
+states, same order), but the seed-independent part is prepared once: the
+chord spaces are materialized into an index of pitch bitmasks (see
+pitch_mask), so a draw is a few random numbers plus tuple lookups, no states
+text is formatted, and the constraints are integer bit operations. Seeds are
+scanned in chunks on a process pool; matches are ranked by a score (lower is
+better) and the best `top` are returned.
+
+Constraints (--require NAME[:ARG], all must hold):
+    balanced_hands[:D]        left- and right-hand notes over all states differ by <= D (0)
+    no_shared_neighbors[:K]   consecutive states (state i, i+1) share <= K notes (1)
+    covers_all_keys           every key of both hands is used by some state
+    max_key_use:K             no key appears in more than K states
+
+Scores (--score NAME):
+    balance                   spread of per-key usage (max - min) plus hand imbalance (default)
+    overlap                   total notes shared by consecutive states
+
+Examples:
+    python src/seed_scan.py --seeds 1-1000000 --require covers_all_keys --require no_shared_neighbors
+    python src/seed_scan.py --seeds 1-200000 --require balanced_hands:2 --score overlap --top 5 --show
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from collections.abc import Sequence as _SequenceABC
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import generate_states
+import main as config
+from pitch_mask import NUM_PITCHES, mask_pitches, pitch_mask, popcount
+
+# A seed's states as pitch bitmasks, in generate_states order
+States = List[int]
+
+# chord spaces up to this size are materialized (O(1) lookups instead of unranking)
+INDEX_LIMIT = 200_000
+CHUNK_SIZE = 20_000
+
+
+class ScanContext(NamedTuple):
+    """Pitch sets the constraints are evaluated against (as bitmasks, plus the key list)."""
+    left: int
+    right: int
+    keys: int
+    key_pitches: Tuple[int, ...]
+
+
+Predicate = Callable[[States, ScanContext], bool]
+Score = Callable[[States, ScanContext], float]
+
+
+# --- Constraints ---
+# Each factory returns a partial of a module-level check, so predicates can be
+# pickled into the worker processes.
+
+# states come from a few hundred distinct chords, so their pitch lists are cached
+_pitches_of = lru_cache(maxsize=1 << 16)(mask_pitches)
+
+
+def _key_counts(states, ctx) -> List[int]:
+    """How many states use each key of ctx.key_pitches."""
+    counts = [0] * NUM_PITCHES
+    for s in states:
+        for p in _pitches_of(s):
+            counts[p] += 1
+    return [counts[p] for p in ctx.key_pitches]
+
+
+def _balanced_hands(max_diff, states, ctx):
+    left = sum(popcount(s & ctx.left) for s in states)
+    right = sum(popcount(s & ctx.right) for s in states)
+    return abs(left - right) <= max_diff
+
+
+def _no_shared_neighbors(max_shared, states, ctx):
+    return all(popcount(a & b) <= max_shared for a, b in zip(states, states[1:]))
+
+
+def _covers_all_keys(states, ctx):
+    union = 0
+    for s in states:
+        union |= s
+    return union & ctx.keys == ctx.keys
+
+
+def _max_key_use(limit, states, ctx):
+    return max(_key_counts(states, ctx), default=0) <= limit
+
+
+def balanced_hands(max_diff: int = 0) -> Predicate:
+    return partial(_balanced_hands, max_diff)
+
+
+def no_shared_neighbors(max_shared: int = 1) -> Predicate:
+    return partial(_no_shared_neighbors, max_shared)
+
+
+def covers_all_keys() -> Predicate:
+    return _covers_all_keys
+
+
+def max_key_use(limit: int) -> Predicate:
+    return partial(_max_key_use, limit)
+
+
+CONSTRAINTS: Dict[str, Callable[..., Predicate]] = {
+    "balanced_hands": balanced_hands,
+    "no_shared_neighbors": no_shared_neighbors,
+    "covers_all_keys": covers_all_keys,
+    "max_key_use": max_key_use,
+}
+
+
+# --- Scores (lower is better) ---
+
+def balance_score(states, ctx) -> float:
+    counts = _key_counts(states, ctx)
+    left = sum(popcount(s & ctx.left) for s in states)
+    right = sum(popcount(s & ctx.right) for s in states)
+    return (max(counts) - min(counts)) + abs(left - right)
+
+
+def overlap_score(states, ctx) -> float:
+    return sum(popcount(a & b) for a, b in zip(states, states[1:]))
+
+
+SCORES: Dict[str, Score] = {"balance": balance_score, "overlap": overlap_score}
+
+
+def parse_constraint(spec: str) -> Predicate:
+    """Build a predicate from "name" or "name:arg" (see CONSTRAINTS)."""
+    name, _, arg = spec.partition(":")
+    factory = CONSTRAINTS.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown constraint {name!r} (expected one of {sorted(CONSTRAINTS)})")
+    return factory(int(arg)) if arg else factory()
+
+
+# --- Scanning ---
+
+class _MaskSpace(_SequenceABC):
+    """A chord space read as pitch masks (for spaces too large to materialize)."""
+
+    def __init__(self, space):
+        self.space = space
+
+    def __len__(self):
+        return len(self.space)
+
+    def __getitem__(self, rank):
+        return pitch_mask(self.space[rank])
+
+
+class StateIndex:
+    """
+    The seed-independent half of generate_states for one configuration, with
+    chord spaces materialized as pitch masks so drawing a seed's states is cheap.
+    """
+
+    def __init__(self, pitches_left, pitches_right, n_left, n_right, n_cross,
+                 fingers_used, sampler="legacy"):
+        plan = generate_states.plan_states(pitches_left, pitches_right, n_left, n_right,
+                                           n_cross, fingers_used)
+        # the draws only depend on the space sizes, so masks select the same chords
+        self.plan = [(tuple(map(pitch_mask, space)) if len(space) <= INDEX_LIMIT
+                      else _MaskSpace(space), n)
+                     for space, n in plan]
+        self.sampler = sampler
+        left = pitch_mask(pitches_left.values())
+        right = pitch_mask(pitches_right.values())
+        self.context = ScanContext(left, right, left | right, mask_pitches(left | right))
+        self._rng = random.Random()
+
+    def states(self, seed: int) -> States:
+        """The chords generate_states returns for `seed` (same order), as pitch masks."""
+        rng = self._rng
+        rng.seed(seed)
+        return generate_states.draw_states(rng, self.plan, self.sampler)
+
+
+# per-process scan settings (filled once per worker by _init_scan)
+_scan: Dict[str, object] = {}
+
+
+def _init_scan(index: StateIndex, constraints: Sequence[Predicate], score: Score,
+               top: int) -> None:
+    _scan.update(index=index, constraints=list(constraints), score=score, top=top)
+
+
+def _scan_chunk(seeds: Sequence[int]) -> Tuple[int, List[Tuple[float, int]]]:
+    """Check a chunk of seeds; returns (n_matched, best `top` (score, seed) pairs)."""
+    index: StateIndex = _scan["index"]
+    constraints = _scan["constraints"]
+    score = _scan["score"]
+    ctx = index.context
+    matched = []
+    for seed in seeds:
+        states = index.states(seed)
+        if all(check(states, ctx) for check in constraints):
+            matched.append((score(states, ctx), seed))
+    return len(matched), heapq.nsmallest(_scan["top"], matched)
+
+
+def scan_seeds(seeds: Sequence[int], constraints: Sequence[Predicate],
+               score: Score = balance_score, *, top: int = 20, workers: Optional[int] = None,
+               index: Optional[StateIndex] = None):
+    """
+    Find the best-scoring seeds whose states satisfy every constraint.
+
+    Args:
+        seeds: Candidate seeds.
+        constraints: Predicates (states, ScanContext) -> bool, states being pitch masks
+            (see pitch_mask); they must be picklable
+            (module-level functions or the factories above) when workers > 1.
+        score: Ranking function (states, ScanContext) -> number, lower is better.
+        top: How many seeds to return.
+        workers: Worker processes (default: CPU count). 1 scans in-process.
+        index: StateIndex to draw from (default: main.py's configuration).
+
+    Returns:
+        Tuple[list[tuple[float, int]], int]: The ranked (score, seed) pairs and the
+        number of seeds that matched.
+    """
+    if index is None:
+        index = StateIndex(config.pitches_left, config.pitches_right,
+                           config.CHORDS_LEFT_HAND, config.CHORDS_RIGHT_HAND,
+                           config.CHORDS_CROSS_HAND, config.FINGERS_USED, config.SAMPLER)
+    seeds = list(seeds)
+    chunks = [seeds[i:i + CHUNK_SIZE] for i in range(0, len(seeds), CHUNK_SIZE)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(chunks)))
+
+    if workers == 1:
+        _init_scan(index, constraints, score, top)
+        results = [_scan_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_scan,
+                                 initargs=(index, constraints, score, top)) as pool:
+            results = list(pool.map(_scan_chunk, chunks))
+
+    n_matched = sum(n for n, _ in results)
+    ranked = heapq.nsmallest(top, (m for _, best in results for m in best))
+    return ranked, n_matched
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find seeds whose states meet design constraints.")
+    parser.add_argument("--seeds", type=config.parse_seeds, required=True,
+                        help='candidate seeds, e.g. "1-1000000"')
+    parser.add_argument("--require", action="append", default=[], metavar="NAME[:ARG]",
+                        help=f"constraint that must hold (repeatable): {', '.join(CONSTRAINTS)}")
+    parser.add_argument("--score", choices=sorted(SCORES), default="balance",
+                        help="ranking of matching seeds, lower is better (default: balance)")
+    parser.add_argument("--top", type=int, default=20, help="number of seeds to report")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--fingers", type=int, default=config.FINGERS_USED,
+                        help="FINGERS_USED to generate states for (default: FINGERS_USED)")
+    parser.add_argument("--show", action="store_true", help="print the states of the reported seeds")
+    args = parser.parse_args(argv)
+
+    try:
+        constraints = [parse_constraint(spec) for spec in args.require]
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    index = StateIndex(config.pitches_left, config.pitches_right,
+                       config.CHORDS_LEFT_HAND, config.CHORDS_RIGHT_HAND,
+                       config.CHORDS_CROSS_HAND, args.fingers, config.SAMPLER)
+
+    t0 = time.perf_counter()
+    ranked, n_matched = scan_seeds(args.seeds, constraints, SCORES[args.score],
+                                   top=args.top, workers=args.workers, index=index)
+    secs = time.perf_counter() - t0
+    rate = len(args.seeds) / secs if secs > 0 else float("inf")
+    print(f"Scanned {len(args.seeds)} seeds in {secs:.2f}s ({rate * 60:,.0f} seeds/min); "
+          f"{n_matched} matched")
+    for rank, (value, seed) in enumerate(ranked, 1):
+        print(f"{rank:>4}. seed {seed}  {args.score}={value:g}")
+        if args.show:
+            for i, state in enumerate(index.states(seed)):
+                print(f"        state{i}: {list(mask_pitches(state))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Generated state sequences: a Markov transition grammar over the chord states.
+
+Instead of a hand-written list of indices, a sequence can be described by a
+transition matrix (row i = weights of the next state after state i) plus an
+optional initial distribution, a length and a seed. GeneratedSequence yields
+the indices lazily and reproducibly (same seed, same sequence), so
+render_sequence can consume million-step sequences without the index list
+ever existing.
+
+A grammar file in state_sequences/ (NAME.grammar.json) is picked up by
+load_sequences next to the .txt sequences:
+
+    {
+      "transitions": [[0, 1, 1, 0, 0, 0, 0, 0, 1], ...],   # 9 x 9 weights
+      "initial": [1, 1, 1, 1, 1, 1, 1, 1, 1],              # optional (default uniform)
+      "length": 1000000,
+      "seed": 7
+    }
+"""
+import json
+import random
+from itertools import chain
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Bump when the same grammar + seed would produce a different sequence
+GRAMMAR_VERSION = 1
+# uniforms drawn per batch while sampling
+BATCH = 4096
+SUFFIX = ".grammar.json"
+
+
+def _alias_table(weights: Sequence[float]) -> Tuple[List[float], List[int]]:
+    """
+    Walker/Vose alias table for sampling an index with the given weights from
+    one uniform draw (see TransitionGrammar.iter_batches).
+    """
+    n = len(weights)
+    total = float(sum(weights))
+    if n == 0 or total <= 0 or any(w < 0 for w in weights):
+        raise ValueError("transition weights must be non-negative with a positive sum")
+    prob = [w * n / total for w in weights]
+    alias = list(range(n))
+    small = [i for i, p in enumerate(prob) if p < 1.0]
+    large = [i for i, p in enumerate(prob) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        alias[s] = l
+        prob[l] -= 1.0 - prob[s]
+        (small if prob[l] < 1.0 else large).append(l)
+    for i in small + large:      # leftovers are 1 up to rounding
+        prob[i] = 1.0
+    return prob, alias
+
+
+class TransitionGrammar:
+    """
+    First-order Markov grammar over the state indices 0..n-1.
+
+    Args:
+        transitions: n x n weights; row i gives the weights of the state after state i.
+        initial: Weights of the first state (default: uniform).
+    """
+
+    def __init__(self, transitions: Sequence[Sequence[float]],
+                 initial: Optional[Sequence[float]] = None):
+        self.transitions = [list(map(float, row)) for row in transitions]
+        self.n = len(self.transitions)
+        if any(len(row) != self.n for row in self.transitions):
+            raise ValueError("transition matrix must be square (one row/column per state)")
+        self.initial = list(map(float, initial)) if initial is not None else [1.0] * self.n
+        if len(self.initial) != self.n:
+            raise ValueError("initial distribution must have one weight per state")
+        self._tables = [_alias_table(row) for row in self.transitions]
+        self._start = _alias_table(self.initial)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TransitionGrammar":
+        return cls(data["transitions"], data.get("initial"))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"transitions": self.transitions, "initial": self.initial}
+
+    def iter_batches(self, seed: int, length: Optional[int] = None,
+                     batch: int = BATCH) -> Iterator[List[int]]:
+        """
+        Yield the sequence in lists of up to `batch` state indices.
+
+        Uniforms are drawn a batch at a time; each step turns one uniform into
+        the next state through the current state's alias table (O(1) per step).
+        length=None never stops.
+        """
+        rng = random.Random(seed)
+        n = self.n
+        tables = self._tables
+        state = -1
+        remaining = length
+        while remaining is None or remaining > 0:
+            k = batch if remaining is None else min(batch, remaining)
+            uniforms = [rng.random() for _ in range(k)]
+            out = []
+            for u in uniforms:
+                prob, alias = tables[state] if state >= 0 else self._start
+                x = u * n
+                i = int(x)
+                if i == n:       # u * n can round up to n
+                    i -= 1
+                state = i if x - i < prob[i] else alias[i]
+                out.append(state)
+            if remaining is not None:
+                remaining -= k
+            yield out
+
+    def iter_states(self, seed: int, length: Optional[int] = None) -> Iterator[int]:
+        """Yield the state indices one at a time (see iter_batches)."""
+        return chain.from_iterable(self.iter_batches(seed, length))
+
+
+class GeneratedSequence:
+    """
+    A fixed-length, seeded sequence from a TransitionGrammar.
+
+    Behaves like the list load_sequences returns for a .txt file (len(),
+    iteration; iterating again replays the same sequence) but stores no indices.
+    """
+
+    def __init__(self, grammar: TransitionGrammar, length: int, seed: int = 0):
+        if length < 0:
+            raise ValueError("sequence length must be non-negative")
+        self.grammar = grammar
+        self.length = int(length)
+        self.seed = seed
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[int]:
+        return self.grammar.iter_states(self.seed, self.length)
+
+    def cache_spec(self) -> Dict[str, Any]:
+        """Everything the sequence depends on (used for build-cache keys)."""
+        return {"grammar": self.grammar.to_dict(), "length": self.length, "seed": self.seed,
+                "version": GRAMMAR_VERSION}
+
+
+def load_grammar(path: Path, n_states: Optional[int] = None) -> GeneratedSequence:
+    """
+    Read a NAME.grammar.json file (see module docstring) into a GeneratedSequence.
+
+    Args:
+        path: The grammar file.
+        n_states: Number of chord states the sequence will index; the matrix
+            must have one row per state (None = don't check).
+
+    Raises:
+        ValueError: An invalid grammar (e.g. a missing key), or a matrix of
+            the wrong size.
+    """
+    with open(path, encoding="utf-8") as fh:
+        data = json.load(fh)
+    try:
+        grammar = TransitionGrammar.from_dict(data)
+        length = data["length"]
+    except KeyError as e:
+        raise ValueError(f"{path}: missing key {e}") from None
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"{path}: {e}") from None
+    if n_states is not None and grammar.n != n_states:
+        raise ValueError(f"{path}: transition matrix is {grammar.n} x {grammar.n}, but the "
+                         f"sequences are rendered against {n_states} chord states")
+    return GeneratedSequence(grammar, length, data.get("seed", 0))
@@ -0,0 +1,335 @@
+"""
+Split a cohort across machines that share one output folder.
+
+A participant manifest (CSV with a header, columns `participant` and `seed`)
+lists the cohort. `main.py --manifest cohort.csv --shard i/N` renders the
+i-th of N shards (1-based): participants are dealt out round-robin in
+manifest order, so shard sizes differ by at most one and appending
+participants to the manifest never moves earlier ones to another shard.
+Every seed renders the same sequences, so equal-sized shards take about
+equally long.
+
+Progress lives in out_root/.shards/:
+
+    done/seed_<n>.json     written once a seed is complete (its summary row and
+                           the render key of the settings it was built with)
+    shard_<i>-of-<N>.json  written once every seed of the shard is complete
+
+A rerun of a shard skips seeds that already have a done marker with the
+current render key (and the build cache skips finished sequences of a seed
+interrupted mid-way), so after a crash only unfinished work is redone. A
+seed done with other settings (tempo, --set overrides, sequences, writer
+versions, ...) counts as pending and is rendered again. When the last shard
+of a run finishes, the per-seed summaries are merged into
+out_root/cohort_summary.csv; seeds built with different keys are never merged.
+
+    python src/main.py --manifest cohort.csv --shard 2/4 --workers 8
+    python src/shard.py cohort.csv --shards 4              # status; merge if complete
+    python src/shard.py cohort.csv --shards 4 --simulate   # run all 4 shards locally
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+MARKER_DIR = ".shards"
+SUMMARY_NAME = "cohort_summary.csv"
+SUMMARY_COLUMNS = ("participant", "seed", "shard", "files", "bytes", "notes", "seconds",
+                   "up_to_date", "rebuilt")
+
+
+class Participant(NamedTuple):
+    participant: str
+    seed: int
+
+
+def read_manifest(path: Path) -> List[Participant]:
+    """
+    Read a participant manifest (CSV with `participant` and `seed` columns).
+
+    Raises:
+        ValueError: Missing columns, a seed that is not an integer, or a
+            participant or seed listed twice.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as fh:
+        reader = csv.DictReader(fh)
+        fields = [f.strip().lower() for f in reader.fieldnames or []]
+        if "participant" not in fields or "seed" not in fields:
+            raise ValueError(f"{path}: expected a header with 'participant' and 'seed' columns")
+        participants = []
+        for line, row in enumerate(reader, start=2):
+            row = {k.strip().lower(): (v or "").strip() for k, v in row.items() if k}
+            if not row["participant"] and not row["seed"]:
+                continue
+            try:
+                participants.append(Participant(row["participant"], int(row["seed"])))
+            except ValueError:
+                raise ValueError(f"{path}, line {line}: seed {row['seed']!r} is not an integer") from None
+
+    for field in ("participant", "seed"):
+        seen = set()
+        for p in participants:
+            value = getattr(p, field)
+            if value in seen:
+                raise ValueError(f"{path}: {field} {value!r} is listed more than once")
+            seen.add(value)
+    return participants
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """Parse "i/N" (1-based) into (i, N)."""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {text!r}: expected i/N, e.g. 2/4") from None
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {text!r}: i must be between 1 and N")
+    return index, count
+
+
+def assign(participants: Sequence[Participant], index: int, count: int) -> List[Participant]:
+    """The participants of shard `index` of `count` (round-robin in manifest order)."""
+    return list(participants[index - 1::count])
+
+
+# --- Markers ---
+
+def _marker_dir(out_root: Path) -> Path:
+    return Path(out_root) / MARKER_DIR
+
+
+def done_marker(out_root: Path, seed: int) -> Path:
+    return _marker_dir(out_root) / "done" / f"seed_{seed}.json"
+
+
+def shard_marker(out_root: Path, index: int, count: int) -> Path:
+    return _marker_dir(out_root) / f"shard_{index}-of-{count}.json"
+
+
+def _write_json(path: Path, data) -> None:
+    """Write atomically, so a crash never leaves a half-written marker."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(data, fh, indent=2)
+    os.replace(tmp, path)
+
+
+def _read_marker(out_root: Path, seed: int) -> Optional[dict]:
+    try:
+        with open(done_marker(out_root, seed), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def pending(participants: Sequence[Participant], out_root: Path,
+            key: Optional[str] = None) -> List[Participant]:
+    """
+    Participants whose seed has no completion marker yet, or (when `key` is
+    given) one recorded with a different render key.
+    """
+    todo = []
+    for p in participants:
+        marker = _read_marker(out_root, p.seed)
+        if marker is None or (key is not None and marker.get("key") != key):
+            todo.append(p)
+    return todo
+
+
+def render_key(state_sequences, maps, *, tempo=None, bundle_mode: str = None,
+               bundle_format: str = "zip") -> str:
+    """
+    Hash of everything a seed's outputs depend on apart from the seed itself:
+    main's config (including --config / --set overrides), the sequences, hand
+    maps, tempo, writer versions and the output layout.
+    """
+    import json_writer
+    import main as config
+    from build_cache import input_key
+    from tempo_map import TempoMap
+
+    if tempo is None:
+        tempo = config.configured_tempo()
+    midi = {}
+    if config.WRITE_MIDI:
+        import midi_writer
+        midi = dict(midi_backend=config.MIDI_BACKEND, midi_writer=midi_writer.WRITER_VERSION)
+    return input_key(
+        pitches_left=config.pitches_left, pitches_right=config.pitches_right,
+        chords=(config.CHORDS_LEFT_HAND, config.CHORDS_RIGHT_HAND, config.CHORDS_CROSS_HAND),
+        fingers_used=config.FINGERS_USED, sampler=config.SAMPLER,
+        scroll_speed=config.SCROLL_SPEED, json_compact=config.JSON_COMPACT,
+        json_gzip=config.JSON_GZIP, json_writer=json_writer.WRITER_VERSION,
+        tempo=tempo.tolist() if isinstance(tempo, TempoMap) else tempo,
+        sequences={name: seq.cache_spec() if hasattr(seq, "cache_spec") else seq
+                   for name, seq in state_sequences.items()},
+        lh_fingers=maps.lh_fingers, rh_fingers=maps.rh_fingers,
+        lh_keys=maps.lh_keys, rh_keys=maps.rh_keys,
+        bundle=bundle_mode and [bundle_mode, bundle_format], **midi,
+    )
+
+
+def mark_done(out_root: Path, participant: Participant, shard: str, result: tuple,
+              key: Optional[str] = None) -> None:
+    """Record a finished seed with its summary (a batch.run_batch result tuple) and render key."""
+    seed, n_files, n_bytes, n_notes, secs, hits, rebuilds = result[:7]
+    _write_json(done_marker(out_root, seed), {
+        "participant": participant.participant, "seed": seed, "shard": shard,
+        "files": n_files, "bytes": n_bytes, "notes": n_notes, "seconds": round(secs, 6),
+        "up_to_date": hits, "rebuilt": rebuilds, "key": key,
+    })
+
+
+def merge_summaries(participants: Sequence[Participant], out_root: Path,
+                    key: Optional[str] = None) -> Optional[Path]:
+    """
+    Merge the per-seed markers into out_root/cohort_summary.csv (manifest order).
+
+    Returns the summary path, or None if some participant is not done yet,
+    was done with another render key than `key`, or (without `key`) the
+    markers do not all share one key.
+    """
+    rows = []
+    for p in participants:
+        row = _read_marker(out_root, p.seed)
+        if row is None:
+            return None
+        rows.append(row)
+    keys = {row.get("key") for row in rows}
+    if len(keys) > 1 or (key is not None and keys != {key}):
+        return None
+    path = Path(out_root) / SUMMARY_NAME
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.DictWriter(fh, SUMMARY_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        for p, row in zip(participants, rows):
+            writer.writerow(dict(row, participant=p.participant))
+    os.replace(tmp, path)
+    return path
+
+
+# --- Running ---
+
+def run_shard(participants: Sequence[Participant], index: int, count: int,
+              state_sequences, maps, out_root: Path, *, force: bool = False,
+              **batch_options) -> Dict[str, object]:
+    """
+    Render this node's shard of the cohort, resuming after a crash.
+
+    Seeds already marked done are skipped unless `force`. Each seed is
+    marked done as soon as it finishes; the shard marker is written at the
+    end, and the cohort summary is merged if every shard is complete.
+    batch_options are passed on to batch.run_batch (workers, write_threads, ...).
+
+    Returns:
+        The shard marker contents.
+    """
+    from batch import run_batch
+
+    shard = f"{index}/{count}"
+    key = render_key(state_sequences, maps, tempo=batch_options.get("tempo"),
+                     bundle_mode=batch_options.get("bundle_mode"),
+                     bundle_format=batch_options.get("bundle_format", "zip"))
+    mine = assign(participants, index, count)
+    todo = list(mine) if force else pending(mine, out_root, key)
+    stale = 0 if force else len(todo) - len(pending(mine, out_root))
+    by_seed = {p.seed: p for p in mine}
+    print(f"Shard {shard}: {len(mine)} participants, {len(mine) - len(todo)} already done, "
+          f"{len(todo)} to render"
+          + (f" ({stale} done with other settings)" if stale else ""))
+
+    t0 = time.perf_counter()
+    if todo:
+        run_batch([p.seed for p in todo], state_sequences, maps, out_root, force=force,
+                  on_result=lambda res: mark_done(out_root, by_seed[res[0]], shard, res, key),
+                  **batch_options)
+    marker = {"shard": shard, "participants": len(mine), "rendered": len(todo),
+              "seconds": round(time.perf_counter() - t0, 6)}
+    _write_json(shard_marker(out_root, index, count), marker)
+
+    summary = merge_summaries(participants, out_root, key)
+    if summary is not None:
+        print(f"All {len(participants)} participants done; merged summary: {summary}")
+    return marker
+
+
+def status(participants: Sequence[Participant], count: int, out_root: Path) -> None:
+    """Print per-shard progress, and whether the done seeds were built with different settings."""
+    for index in range(1, count + 1):
+        mine = assign(participants, index, count)
+        left = len(pending(mine, out_root))
+        marker = shard_marker(out_root, index, count)
+        state = "complete" if marker.exists() and not left else \
+            f"{len(mine) - left}/{len(mine)} done"
+        print(f" - shard {index}/{count}: {state}")
+    keys = {m.get("key") for m in (_read_marker(out_root, p.seed) for p in participants) if m}
+    if len(keys) > 1:
+        print(f"Done seeds were rendered with {len(keys)} different settings; rerun the shards "
+              f"with the intended settings to re-render the others")
+
+
+def simulate(manifest: Path, count: int, out_root: Path, extra_args: Sequence[str] = ()):
+    """
+    Run all `count` shards at once as separate main.py processes (one per
+    simulated node) on this machine, and report how long each took.
+    """
+    main_py = Path(__file__).with_name("main.py")
+    t0 = time.perf_counter()
+    procs = []
+    for index in range(1, count + 1):
+        cmd = [sys.executable, str(main_py), "--manifest", str(manifest),
+               "--shard", f"{index}/{count}", "--out-root", str(out_root), *extra_args]
+        log = open(_marker_dir(out_root) / f"shard_{index}-of-{count}.log", "w")
+        procs.append((index, subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT), log,
+                      time.perf_counter()))
+    failed = 0
+    for index, proc, log, started in procs:
+        code = proc.wait()
+        log.close()
+        print(f" - shard {index}/{count}: exit {code} after {time.perf_counter() - started:.2f}s")
+        failed += code != 0
+    print(f"{count} shards in {time.perf_counter() - t0:.2f}s wall"
+          + (f"; {failed} failed (see {_marker_dir(out_root)}/*.log)" if failed else ""))
+    return failed
+
+
+def main(argv=None):
+    here = Path(__file__).parent
+    parser = argparse.ArgumentParser(description="Show, merge or simulate a sharded cohort run.")
+    parser.add_argument("manifest", type=Path, help="participant manifest CSV (participant,seed)")
+    parser.add_argument("--shards", type=int, required=True, help="number of shards N")
+    parser.add_argument("--out-root", type=Path, default=here.parent / "generated_midis",
+                        help="shared output folder (default: generated_midis/)")
+    parser.add_argument("--simulate", action="store_true",
+                        help="run all N shards now as local processes, then merge")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes per simulated shard (default: 1)")
+    args = parser.parse_args(argv)
+
+    try:
+        participants = read_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Error: {e}")
+    if args.shards < 1:
+        sys.exit("Error: --shards must be at least 1")
+
+    if args.simulate:
+        _marker_dir(args.out_root).mkdir(parents=True, exist_ok=True)
+        if simulate(args.manifest, args.shards, args.out_root,
+                    ["--workers", str(args.workers)]):
+            sys.exit(1)
+    status(participants, args.shards, args.out_root)
+    summary = merge_summaries(participants, args.out_root)
+    if summary is not None:
+        print(f"Merged summary: {summary}")
+
+
+if __name__ == "__main__":
+    main()
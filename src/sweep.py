@@ -0,0 +1,332 @@
+"""
+Render the same seeds over a grid of TEMPO x SCROLL_SPEED x FINGERS_USED.
+
+Rendering every combination separately repeats most of the work: the chord
+states only depend on seed + fingers, captured notes (in beats) not on tempo
+or scroll speed, and the MIDI file not on scroll speed. The sweep planner
+builds a DAG of these stages for the whole grid, in which each distinct
+intermediate is one node:
+
+    generate_states  (seed, fingers)
+    compile_templates (seed, fingers)                       <- generate_states
+    capture_notes    (seed, fingers, sequence)              <- generate_states, compile_templates
+    hand_notes       (seed, fingers, sequence, tempo)       <- capture_notes
+    encode_midi      (seed, fingers, sequence, tempo)       <- capture_notes
+    encode_json      (seed, fingers, sequence, tempo, scroll_speed) <- hand_notes
+
+Every node is computed exactly once and dropped as soon as its last consumer
+is done, so memory stays at about one seed's intermediates. Each variant is
+written to its own folder (out_root/tempo_<t>_speed_<s>_fingers_<f>/, with
+<t> = "map" for TEMPO_MAP), laid out like generated_midis/; the variant with
+main.py's settings is byte-identical to a normal run. With WRITE_MIDI off no
+MIDI is encoded or written.
+
+Examples:
+    python src/sweep.py --seeds 1-20 --tempos 100,120 --scroll-speeds 1,20 --fingers 2,3
+    python src/sweep.py --seeds 1-300 --tempos 90,120 --scroll-speeds 20 --dry-run
+"""
+import argparse
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
+
+import generate_states
+import load_sequences
+import main as config
+from json_writer import PianoVisionJsonWriter
+from midi_writer import encode_midi, midi_file_path
+from note_capture import HandMaps, StateTemplates, build_default_maps, capture_notes_columnar
+from tempo_map import Tempo, TempoMap, normalize
+
+STAGES = ("generate_states", "compile_templates", "capture_notes",
+          "hand_notes", "encode_midi", "encode_json")
+
+Key = Tuple[Any, ...]   # (stage, *parameters the stage depends on)
+
+
+class Variant(NamedTuple):
+    tempo: Tempo
+    scroll_speed: float
+    fingers_used: int
+
+    @property
+    def dirname(self) -> str:
+        tempo = "map" if isinstance(self.tempo, TempoMap) else f"{self.tempo:g}"
+        return f"tempo_{tempo}_speed_{self.scroll_speed:g}_fingers_{self.fingers_used}"
+
+
+class Target(NamedTuple):
+    """One output of the sweep: the states list (seq_name None) or a sequence's files."""
+    variant: Variant
+    seed: int
+    seq_name: Any
+    needs: Tuple[Key, ...]
+
+
+def _deps(key: Key) -> Tuple[Key, ...]:
+    """Direct dependencies of a node."""
+    stage, seed, fingers = key[:3]
+    if stage == "generate_states":
+        return ()
+    if stage == "compile_templates":
+        return (("generate_states", seed, fingers),)
+    if stage == "capture_notes":
+        return (("generate_states", seed, fingers), ("compile_templates", seed, fingers))
+    seq_name = key[3]
+    if stage in ("hand_notes", "encode_midi"):
+        return (("capture_notes", seed, fingers, seq_name),)
+    if stage == "encode_json":
+        return (("hand_notes",) + key[1:5],)
+    raise ValueError(f"Unknown sweep stage {stage!r}")
+
+
+class SweepPlan:
+    """
+    The deduplicated stage DAG for a parameter grid.
+
+    Attributes:
+        nodes: Every distinct node -> its dependencies, in topological order.
+        targets: Outputs to write, ordered seed by seed (bounds live memory).
+        refs: Number of consumers (nodes + targets) of each node.
+        uses: Per stage, how often it would run if every variant were rendered
+            separately (what the sweep saves is uses - len(nodes of that stage)).
+    """
+
+    def __init__(self):
+        self.nodes: Dict[Key, Tuple[Key, ...]] = {}
+        self.targets: List[Target] = []
+        self.refs: Counter = Counter()
+        self.uses: Counter = Counter()
+        self._used = set()
+
+    def _require(self, key: Key, variant: Variant) -> Key:
+        if (variant, key) not in self._used:
+            self._used.add((variant, key))
+            self.uses[key[0]] += 1
+            for dep in _deps(key):
+                self._require(dep, variant)
+        if key not in self.nodes:
+            deps = _deps(key)
+            for dep in deps:
+                self.refs[dep] += 1
+            self.nodes[key] = deps
+        return key
+
+    def add_target(self, variant: Variant, seed: int, seq_name, needs: Sequence[Key]) -> None:
+        needs = tuple(self._require(k, variant) for k in needs)
+        for k in needs:
+            self.refs[k] += 1
+        self.targets.append(Target(variant, seed, seq_name, needs))
+
+    def computed(self) -> Counter:
+        """Number of distinct nodes per stage (what the sweep actually computes)."""
+        return Counter(key[0] for key in self.nodes)
+
+
+def plan_sweep(seeds: Sequence[int], sequence_names: Sequence[str], tempos: Sequence[Tempo],
+               scroll_speeds: Sequence[float], fingers: Sequence[int],
+               midi: bool = True) -> SweepPlan:
+    """
+    Build the deduplicated stage DAG for every (seed, tempo, scroll speed, fingers) variant.
+
+    Tempos are BPM or TempoMaps; with midi=False no encode_midi nodes are planned
+    (like a WRITE_MIDI = False run).
+    """
+    plan = SweepPlan()
+    for seed in seeds:
+        for f in fingers:
+            variants = [Variant(normalize(t), float(s), int(f))
+                        for t in tempos for s in scroll_speeds]
+            for v in variants:
+                plan.add_target(v, seed, None, [("generate_states", seed, f)])
+            for name in sequence_names:
+                for v in variants:
+                    needs = [("encode_json", seed, f, name, v.tempo, v.scroll_speed)]
+                    if midi:
+                        needs.insert(0, ("encode_midi", seed, f, name, v.tempo))
+                    plan.add_target(v, seed, name, needs)
+    return plan
+
+
+class _Executor:
+    """Evaluates plan nodes on demand, caching each until its last consumer is done."""
+
+    def __init__(self, plan: SweepPlan, state_sequences: Dict[str, List[int]], maps: HandMaps):
+        self.plan = plan
+        self.state_sequences = state_sequences
+        self.maps = maps
+        self.values: Dict[Key, Any] = {}
+        self.remaining = Counter(plan.refs)
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.peak_live = 0
+
+    def get(self, key: Key) -> Any:
+        if key in self.values:
+            return self.values[key]
+        deps = self.plan.nodes[key]
+        args = [self.get(dep) for dep in deps]
+        t0 = time.perf_counter()
+        value = self._compute(key, *args)
+        self.seconds[key[0]] += time.perf_counter() - t0
+        self.values[key] = value
+        self.peak_live = max(self.peak_live, len(self.values))
+        for dep in deps:
+            self.release(dep)
+        return value
+
+    def release(self, key: Key) -> None:
+        self.remaining[key] -= 1
+        if self.remaining[key] <= 0:
+            self.values.pop(key, None)
+
+    def _compute(self, key: Key, *deps):
+        stage, seed, fingers = key[:3]
+        if stage == "generate_states":
+            return generate_states.generate_states(
+                config.pitches_left, config.pitches_right,
+                n_left=config.CHORDS_LEFT_HAND, n_right=config.CHORDS_RIGHT_HAND,
+                n_cross=config.CHORDS_CROSS_HAND, fingers_used=fingers, seed=seed,
+                sampler=config.SAMPLER,
+            )
+        if stage == "compile_templates":
+            chords, _ = deps[0]
+            return StateTemplates(chords, self.maps)
+        if stage == "capture_notes":
+            (chords, _), templates = deps
+            # notes are kept in beats; the tempo is applied per variant by hand_notes
+            return capture_notes_columnar(self.state_sequences[key[3]], chords, fingers,
+                                          config.configured_tempo(), self.maps,
+                                          templates=templates)
+        if stage == "hand_notes":
+            notes = deps[0].at_tempo(key[4])
+            return notes.hand(0), notes.hand(1)
+        if stage == "encode_midi":
+            return encode_midi(deps[0], tempo=key[4], backend=config.MIDI_BACKEND)
+        if stage == "encode_json":
+            right, left = deps[0]
+            writer = PianoVisionJsonWriter(bpm=key[4], visual_speed=key[5],
+                                           compact=config.JSON_COMPACT, gzip=config.JSON_GZIP)
+            return writer.encode(right, left, f"seed_{seed}_{key[3]}")
+        raise ValueError(f"Unknown sweep stage {stage!r}")
+
+
+def run_sweep(plan: SweepPlan, state_sequences: Dict[str, List[int]], maps: HandMaps,
+              out_root: Path) -> Dict[str, Any]:
+    """
+    Compute every node of the plan once and write all variants under out_root.
+
+    Returns:
+        Dict with per-stage "uses", "computed" and "seconds", plus "files",
+        "bytes" and "peak_live" (most intermediates held at once).
+    """
+    ex = _Executor(plan, state_sequences, maps)
+    n_files = n_bytes = 0
+    for target in plan.targets:
+        vdir = out_root / target.variant.dirname
+        if target.seq_name is None:
+            _, states_listed = ex.get(target.needs[0])
+            generate_states.write_states_file(vdir, states_listed, target.seed, verbose=False)
+            n_files += 1
+        else:
+            midi_path = midi_file_path(target.seq_name, target.seed, vdir)
+            json_path = midi_path.with_suffix(".pv.json.gz" if config.JSON_GZIP else ".pv.json")
+            midi_path.parent.mkdir(parents=True, exist_ok=True)
+            for key in target.needs:
+                path = midi_path if key[0] == "encode_midi" else json_path
+                data = ex.get(key)
+                with open(path, "wb") as fh:
+                    fh.write(data)
+                n_files += 1
+                n_bytes += len(data)
+        for key in target.needs:
+            ex.release(key)
+
+    computed = plan.computed()
+    return {
+        "stages": {stage: {"uses": plan.uses[stage], "computed": computed[stage],
+                           "seconds": ex.seconds[stage]} for stage in STAGES},
+        "files": n_files,
+        "bytes": n_bytes,
+        "peak_live": ex.peak_live,
+    }
+
+
+def print_report(plan: SweepPlan, report: Dict[str, Any] = None) -> None:
+    """Print how much work the plan deduplicates (and stage times after a run)."""
+    computed = plan.computed()
+    total_uses = sum(plan.uses.values())
+    total_computed = sum(computed.values())
+    print(f"Sweep: {len({t.variant for t in plan.targets})} variants, "
+          f"{len(plan.targets)} outputs, {total_computed} stage runs "
+          f"instead of {total_uses} ({1 - total_computed / max(total_uses, 1):.0%} deduplicated)")
+    for stage in STAGES:
+        uses, done = plan.uses[stage], computed[stage]
+        line = (f" - {stage}: {done} computed for {uses} uses "
+                f"({uses - done} deduplicated)")
+        if report is not None:
+            line += f", {report['stages'][stage]['seconds']:.2f}s"
+        print(line)
+    if report is not None:
+        print(f"Wrote {report['files']} files ({report['bytes'] / 1e6:.2f} MB); "
+              f"at most {report['peak_live']} intermediates held at once")
+
+
+def _float_list(text):
+    return [float(x) for x in text.split(",") if x.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render seeds over a TEMPO x SCROLL_SPEED x FINGERS_USED grid, "
+                    "computing shared intermediates once.")
+    parser.add_argument("--seeds", type=config.parse_seeds, default=[config.SEED],
+                        help=f'seed range or list, e.g. "1-300" (default: {config.SEED})')
+    parser.add_argument("--tempos", type=_float_list,
+                        help='tempos in BPM, e.g. "100,120" '
+                             '(default: TEMPO, or TEMPO_MAP when that is set)')
+    parser.add_argument("--scroll-speeds", type=_float_list, default=[config.SCROLL_SPEED],
+                        help='scroll speeds, e.g. "1,20" (default: SCROLL_SPEED)')
+    parser.add_argument("--fingers", type=config.parse_seeds, default=[config.FINGERS_USED],
+                        help='FINGERS_USED values, e.g. "2,3" (default: FINGERS_USED)')
+    parser.add_argument("--out", type=Path,
+                        default=Path(__file__).parent.parent / "generated_midis" / "sweep",
+                        help="root folder for the variant folders")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print the plan and how much it deduplicates")
+    args = parser.parse_args(argv)
+
+    if any(f < 1 or f > 10 for f in args.fingers):
+        sys.exit("Error: --fingers values must be between 1 and 10")
+    if args.tempos is not None and any(t <= 0 for t in args.tempos):
+        sys.exit("Error: --tempos must be positive")
+    for f in args.fingers:
+        # too few chords for the states generate_states would draw (e.g. 10 fingers)
+        for space, k in generate_states.plan_states(
+                config.pitches_left, config.pitches_right, config.CHORDS_LEFT_HAND,
+                config.CHORDS_RIGHT_HAND, config.CHORDS_CROSS_HAND, f):
+            if k > len(space):
+                sys.exit(f"Error: --fingers {f} leaves only {len(space)} possible chords "
+                         f"where {k} are needed")
+    tempos = args.tempos or [config.configured_tempo()]
+
+    try:
+        state_sequences = load_sequences.load_sequences(Path(__file__).parent / "state_sequences")
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    plan = plan_sweep(args.seeds, list(state_sequences), tempos, args.scroll_speeds,
+                      args.fingers, midi=config.WRITE_MIDI)
+    if args.dry_run:
+        print_report(plan)
+        return
+
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+    t0 = time.perf_counter()
+    report = run_sweep(plan, state_sequences, maps, args.out)
+    print_report(plan, report)
+    print(f"Done in {time.perf_counter() - t0:.2f}s: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Tempo maps: tempo that changes over the course of a sequence.
+
+A TempoMap is a sorted list of segments, each starting at a beat with a
+constant tempo. Cumulative prefix sums of the segment start times make a
+beat -> seconds conversion (and its inverse) one binary search plus one
+multiply, however many segments there are. Gradual changes (accelerating
+blocks) are approximated by short constant steps, which is also how they
+end up in a MIDI file (tempo meta events are constant until the next one).
+
+Everything that takes a `tempo` also accepts a TempoMap. normalize() turns
+a map with a single segment back into its plain float BPM, so constant-tempo
+renders keep using the closed-form `60.0 / bpm` arithmetic and their output
+stays byte-identical.
+
+    TempoMap([(0, 100), (16, 120)])                  # 100 BPM, 120 from beat 16
+    TempoMap([(0, 100), *ramp(16, 32, 100, 140)])    # accelerate over beats 16-32
+    parse_tempo_map("0:100,16:100~32:140")           # the same, as on the CLI
+"""
+from bisect import bisect_right
+from typing import Iterable, List, Tuple, Union
+
+
+class TempoMap:
+    """
+    Piecewise-constant tempo over beats.
+
+    Args:
+        segments: (start_beat, bpm) pairs. The first must start at beat 0;
+            they are sorted by beat, and a segment that repeats the previous
+            tempo is merged into it.
+
+    Raises:
+        ValueError: No segments, no segment at beat 0, a non-positive BPM or
+            two segments at the same beat.
+    """
+
+    def __init__(self, segments: Iterable[Tuple[float, float]]):
+        points = sorted((float(b), float(t)) for b, t in segments)
+        if not points or points[0][0] != 0.0:
+            raise ValueError("a tempo map needs a segment starting at beat 0")
+        beats: List[float] = []
+        bpms: List[float] = []
+        for beat, bpm in points:
+            if bpm <= 0:
+                raise ValueError(f"tempo at beat {beat:g} must be positive, got {bpm:g}")
+            if beats and beat == beats[-1]:
+                raise ValueError(f"two tempos at beat {beat:g}")
+            if bpms and bpm == bpms[-1]:
+                continue
+            beats.append(beat)
+            bpms.append(bpm)
+        self.beats = tuple(beats)                     # segment start beats
+        self.bpms = tuple(bpms)
+        self.spb = tuple(60.0 / b for b in bpms)      # seconds per beat in each segment
+        times = [0.0]
+        for i in range(1, len(beats)):
+            times.append(times[-1] + (beats[i] - beats[i - 1]) * self.spb[i - 1])
+        self.times = tuple(times)                     # segment start times in seconds
+
+    @property
+    def bpm(self) -> float:
+        """Tempo at beat 0."""
+        return self.bpms[0]
+
+    @property
+    def is_constant(self) -> bool:
+        return len(self.bpms) == 1
+
+    def seconds(self, beat: float) -> float:
+        """Time in seconds of a beat position."""
+        i = bisect_right(self.beats, beat) - 1
+        if i <= 0:
+            return beat * self.spb[0]
+        return self.times[i] + (beat - self.beats[i]) * self.spb[i]
+
+    def beat_at(self, seconds: float) -> float:
+        """Beat position at a time in seconds (the inverse of seconds())."""
+        i = bisect_right(self.times, seconds) - 1
+        if i <= 0:
+            return seconds / self.spb[0]
+        return self.beats[i] + (seconds - self.times[i]) / self.spb[i]
+
+    def segments(self) -> List[Tuple[float, float, float]]:
+        """(start_beat, bpm, start_seconds) of every segment."""
+        return list(zip(self.beats, self.bpms, self.times))
+
+    def __eq__(self, other):
+        if not isinstance(other, TempoMap):
+            return NotImplemented
+        return self.beats == other.beats and self.bpms == other.bpms
+
+    def __hash__(self):
+        return hash((self.beats, self.bpms))
+
+    def __repr__(self):
+        return f"TempoMap({list(zip(self.beats, self.bpms))!r})"
+
+    def tolist(self) -> List[List[float]]:
+        """[[beat, bpm], ...], e.g. for build_cache.input_key."""
+        return [[b, t] for b, t in zip(self.beats, self.bpms)]
+
+
+# A tempo argument: constant BPM or a TempoMap
+Tempo = Union[float, TempoMap]
+
+
+def normalize(tempo: Tempo) -> Tempo:
+    """A float BPM for constant tempos (including one-segment maps), else the TempoMap."""
+    if isinstance(tempo, TempoMap):
+        return tempo.bpm if tempo.is_constant else tempo
+    return float(tempo)
+
+
+def initial_bpm(tempo: Tempo) -> float:
+    """Tempo at beat 0."""
+    return tempo.bpm if isinstance(tempo, TempoMap) else float(tempo)
+
+
+def ramp(start_beat: float, end_beat: float, start_bpm: float, end_bpm: float,
+         step_beats: float = 1.0) -> List[Tuple[float, float]]:
+    """
+    Segments for a linear tempo change from start_bpm at start_beat to end_bpm
+    at end_beat, in constant steps of step_beats (the last step may be shorter).
+    end_bpm holds from end_beat on.
+    """
+    if end_beat <= start_beat or step_beats <= 0:
+        raise ValueError("a ramp needs end_beat > start_beat and a positive step")
+    span = end_beat - start_beat
+    segments = []
+    beat = start_beat
+    while beat < end_beat:
+        segments.append((beat, start_bpm + (end_bpm - start_bpm) * (beat - start_beat) / span))
+        beat += step_beats
+    segments.append((end_beat, end_bpm))
+    return segments
+
+
+def parse_tempo_map(text: str, step_beats: float = 1.0) -> TempoMap:
+    """
+    Parse a tempo map like "0:100,16:100~32:140".
+
+    Comma-separated items are either "beat:bpm" (the tempo changes to bpm at
+    beat) or "beat:bpm~beat:bpm" (a linear ramp between the two points, in
+    steps of step_beats beats).
+    """
+    segments = []
+    try:
+        for item in text.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            points = [tuple(float(x) for x in p.split(":")) for p in item.split("~")]
+            if any(len(p) != 2 for p in points) or len(points) > 2:
+                raise ValueError
+            if len(points) == 2:
+                (b0, t0), (b1, t1) = points
+                segments.extend(ramp(b0, b1, t0, t1, step_beats))
+            else:
+                segments.append(points[0])
+    except ValueError:
+        raise ValueError(f"Invalid tempo map {text!r}: expected items like "
+                         f'"beat:bpm" or "beat:bpm~beat:bpm"') from None
+    # a ramp's end point may coincide with an explicit item for the same beat
+    return TempoMap(dict(segments).items())
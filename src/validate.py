@@ -0,0 +1,358 @@
+"""
+Round-trip check of the generated files against their sources.
+
+For every seed folder under generated_midis/ the states are regenerated with
+main.py's configuration (generate_states) and the sequences re-read
+(load_sequences). Then:
+
+  - states_seed_<n>.txt must list exactly those states;
+  - every .mid is parsed (midi_reader) and each note-track note compared with
+    the expected note: pitch, start tick, duration, velocity, channel, and the
+    track it is on (hand routing); the tempo events must match TEMPO (or
+    TEMPO_MAP / --tempo-map);
+  - every .pv.json(.gz) is parsed and each tracksV2 note compared: pitch,
+    start, duration (seconds, at the file's SCROLL_SPEED), finger and hand;
+  - each sequence must have the files its run produced (both, or only the
+    .pv.json for JSON-only runs: per the seed's build manifest, else
+    WRITE_MIDI / --json-only), and every file a source sequence.
+
+Seeds are checked in parallel on a process pool. Each mismatch is reported
+with its file and exact location (track / measure, note index, step), and
+the exit status is 1 if anything did not match.
+
+Examples:
+    python src/validate.py
+    python src/validate.py --seeds 1-300 --workers 8 --limit 5
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import generate_states
+import load_sequences
+import main as config
+from build_cache import BuildCache
+from midi_reader import read_smf
+from midi_writer import track_name
+from note_capture import HandMaps, NoteBuffer, StateTemplates, build_default_maps, capture_notes_columnar
+from tempo_map import Tempo, TempoMap, normalize, parse_tempo_map
+
+PPQ = 960                 # what write_midi / the JSON writer use
+TOLERANCE = 1e-6          # seconds; JSON times are rounded to 6 decimals
+DEFAULT_LIMIT = 10        # mismatches reported per file
+
+_SEED_DIR = re.compile(r"^seed_(-?\d+)$")
+
+
+class Problem(NamedTuple):
+    path: str
+    where: str
+    message: str
+
+    def __str__(self):
+        return f"{self.path}: {self.where}: {self.message}" if self.where else \
+            f"{self.path}: {self.message}"
+
+
+# --- Single files ---
+
+def check_states_file(path: Path, states_listed: Sequence[str]) -> List[Problem]:
+    """Compare states_seed_<n>.txt with the regenerated states."""
+    expected = [f"state{i}: {line}" for i, line in enumerate(states_listed)]
+    try:
+        with open(path, encoding="utf-8") as fh:
+            found = fh.read().splitlines()
+    except OSError as e:
+        return [Problem(str(path), "", f"cannot read: {e}")]
+    problems = []
+    for i in range(max(len(expected), len(found))):
+        want = expected[i] if i < len(expected) else None
+        got = found[i] if i < len(found) else None
+        if want != got:
+            problems.append(Problem(str(path), f"line {i + 1}",
+                                    f"expected {want!r}, found {got!r}"))
+    return problems
+
+
+def _as_map(tempo: Tempo) -> TempoMap:
+    tempo = normalize(tempo)
+    return tempo if isinstance(tempo, TempoMap) else TempoMap([(0, tempo)])
+
+
+def check_midi(path: Path, notes: NoteBuffer, *, tempo: Tempo,
+               limit: int = DEFAULT_LIMIT) -> List[Problem]:
+    """Compare a .mid file note by note with the expected NoteBuffer."""
+    problems: List[Problem] = []
+
+    def report(where, message):
+        problems.append(Problem(str(path), where, message))
+        return len(problems) >= limit
+
+    try:
+        midi = read_smf(path.read_bytes())
+    except (OSError, ValueError) as e:
+        return [Problem(str(path), "", f"cannot parse: {e}")]
+    if midi.ppq != PPQ:
+        report("header", f"expected {PPQ} ticks per quarter, found {midi.ppq}")
+    want_tempos = {(int(beat * PPQ), int(60000000 / bpm))
+                   for beat, bpm, _ in _as_map(tempo).segments()}
+    tempos = {event for track in midi.tracks for event in track.tempos}
+    if tempos != want_tempos:
+        report("tempo track", f"expected (tick, us/quarter) tempo events {sorted(want_tempos)}, "
+                              f"found {sorted(tempos)}")
+
+    note_tracks = midi.tracks[1:]
+    for tr in range(max(len(note_tracks), notes.num_tracks())):
+        name = track_name(tr, ("Right", "Left"))
+        # as the writer: note-off at int(start * ppq) + int(duration * ppq)
+        expected = [(p, int(s * PPQ), int(d * PPQ), v, notes.channel, s)
+                    for p, s, d, t, v in zip(notes.pitch, notes.start, notes.duration,
+                                             notes.track, notes.velocity) if t == tr]
+        if tr >= len(note_tracks):
+            if expected and report(f"track {tr + 1}", f"missing ({name}, {len(expected)} notes)"):
+                return problems
+            continue
+        track = note_tracks[tr]
+        where = f"track {tr + 1} ({track.name})"
+        if track.name != name and report(where, f"expected track name {name!r}"):
+            return problems
+        for i, (want, got) in enumerate(zip(expected, track.notes)):
+            p, start, dur, vel, ch, beat = want
+            if (got.pitch, got.start, got.duration, got.velocity, got.channel) != want[:5]:
+                held = "never released" if got.duration < 0 else f"for {got.duration} ticks"
+                if report(f"{where} note {i} (step {int(beat)})",
+                          f"expected pitch {p} at tick {start} for {dur} ticks "
+                          f"(velocity {vel}, channel {ch}), found pitch {got.pitch} at tick "
+                          f"{got.start} {held} (velocity {got.velocity}, "
+                          f"channel {got.channel})"):
+                    return problems
+        if len(expected) != len(track.notes):
+            report(where, f"expected {len(expected)} notes, found {len(track.notes)}")
+    return problems
+
+
+def check_json(path: Path, notes: NoteBuffer, *, tempo: Tempo, scroll_speed: float,
+               limit: int = DEFAULT_LIMIT) -> List[Problem]:
+    """Compare a .pv.json(.gz) file note by note with the expected NoteBuffer."""
+    problems: List[Problem] = []
+
+    def report(where, message):
+        problems.append(Problem(str(path), where, message))
+        return len(problems) >= limit
+
+    try:
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rt", encoding="utf-8") as fh:
+            doc = json.load(fh)
+    except (OSError, ValueError) as e:
+        return [Problem(str(path), "", f"cannot parse: {e}")]
+
+    try:
+        tempo_map = _as_map(tempo)
+        want_bpms = list(tempo_map.bpms)
+        bpms = [t["bpm"] for t in doc["tempos"]]
+        if bpms != want_bpms:
+            report("tempos", f"expected bpm {want_bpms}, found {bpms}")
+        if doc["visual_speed"] != scroll_speed:
+            report("visual_speed", f"expected {scroll_speed}, found {doc['visual_speed']}")
+        scale = 1.0 / scroll_speed
+        song_len = 0.0
+        for tr, hand in ((0, "right"), (1, "left")):
+            expected = notes.hand(tr)
+            song_len = max([song_len] + [s * scale + d * scale
+                                         for s, d in zip(expected.start, expected.duration)])
+            found = [(m_i, j, n) for m_i, chunk in enumerate(doc["tracksV2"][hand])
+                     for j, n in enumerate(chunk["notes"])]
+            for m, s, d, f, (m_i, j, n) in zip(expected.midi, expected.start, expected.duration,
+                                               expected.finger, found):
+                start, duration = s * scale, d * scale
+                if (n["note"] != m or (n["finger"] or 0) != f
+                        or abs(n["start"] - start) > TOLERANCE
+                        or abs(n["duration"] - duration) > TOLERANCE):
+                    step = int(round(tempo_map.beat_at(s), 6))
+                    if report(f"tracksV2.{hand}[{m_i}].notes[{j}] (id {n.get('id')}, step {step})",
+                              f"expected pitch {m} finger {f or None} at {start:.6f}s for "
+                              f"{duration:.6f}s, found pitch {n['note']} finger {n['finger']} "
+                              f"at {n['start']}s for {n['duration']}s"):
+                        return problems
+            if len(expected) != len(found):
+                report(f"tracksV2.{hand}",
+                       f"expected {len(expected)} {hand}-hand notes, found {len(found)}")
+        if abs(doc["song_length"] - song_len) > TOLERANCE:
+            report("song_length", f"expected {round(song_len, 6)}, found {doc['song_length']}")
+    except (KeyError, IndexError, TypeError) as e:
+        report("", f"unexpected document layout: missing {e}")
+    return problems
+
+
+# --- Seeds ---
+
+# per-process inputs (filled once per worker by _init_validate)
+_shared: Dict[str, object] = {}
+
+
+def _init_validate(state_sequences, maps: HandMaps, out_root: Path, limit: int,
+                   tempo: Tempo, midi: bool = True) -> None:
+    _shared.update(state_sequences=state_sequences, maps=maps, out_root=out_root, limit=limit,
+                   tempo=tempo, midi=midi)
+
+
+def _expected_kinds(entry: Optional[dict], midi: bool) -> Sequence[str]:
+    """The kinds of file a sequence must have: those its build manifest entry lists, if any."""
+    if entry is not None:
+        names = entry.get("files", [])
+        return [kind for kind, suffix in (("midi", ".mid"), ("json", ".pv.json"))
+                if any(suffix in n for n in names)]
+    return ("midi", "json") if midi else ("json",)
+
+
+def validate_seed(seed: int):
+    """
+    Check every file of one seed folder.
+
+    Returns:
+        Tuple[int, int, list[Problem]]: (seed, files checked, problems).
+    """
+    state_sequences = _shared["state_sequences"]
+    maps, out_root, limit = _shared["maps"], _shared["out_root"], _shared["limit"]
+    tempo = _shared["tempo"]
+    seed_dir = out_root / f"seed_{seed}"
+    chords, states_listed = generate_states.generate_states(
+        config.pitches_left, config.pitches_right,
+        n_left=config.CHORDS_LEFT_HAND, n_right=config.CHORDS_RIGHT_HAND,
+        n_cross=config.CHORDS_CROSS_HAND, fingers_used=config.FINGERS_USED,
+        seed=seed, sampler=config.SAMPLER,
+    )
+    problems = check_states_file(out_root / f"states_seed_{seed}.txt", states_listed)[:limit]
+    n_files = 1
+    templates = StateTemplates(chords, maps)
+
+    # what the run produced: JSON-only runs write no .mid
+    manifest = BuildCache(seed_dir).entries
+    prefix = f"seed_{seed}_"
+    found: Dict[str, Dict[str, Path]] = {}
+    for path in sorted(seed_dir.iterdir()):
+        for kind, suffix in (("midi", ".mid"), ("json", ".pv.json"), ("json", ".pv.json.gz")):
+            if path.name.startswith(prefix) and path.name.endswith(suffix):
+                found.setdefault(path.name[len(prefix):-len(suffix)], {})[kind] = path
+
+    for name in sorted(set(found) | set(state_sequences)):
+        files = found.get(name, {})
+        if name not in state_sequences:
+            for path in files.values():
+                problems.append(Problem(str(path), "", "no source sequence "
+                                        f"state_sequences/{name}.txt"))
+            continue
+        for kind in _expected_kinds(manifest.get(name), _shared["midi"]):
+            if kind not in files:
+                problems.append(Problem(str(seed_dir / f"{prefix}{name}"), "",
+                                        f"{'.mid' if kind == 'midi' else '.pv.json'} file missing"))
+        if not files:
+            continue
+        notes = capture_notes_columnar(state_sequences[name], chords, config.FINGERS_USED,
+                                       tempo=tempo, maps=maps, templates=templates)
+        if "midi" in files:
+            problems += check_midi(files["midi"], notes, tempo=tempo, limit=limit)
+        if "json" in files:
+            problems += check_json(files["json"], notes, tempo=tempo,
+                                   scroll_speed=config.SCROLL_SPEED, limit=limit)
+        n_files += len(files)
+    return seed, n_files, problems
+
+
+def find_seeds(out_root: Path) -> List[int]:
+    """Seeds that have a seed_<n> folder under out_root, ascending."""
+    seeds = []
+    for path in Path(out_root).iterdir():
+        m = _SEED_DIR.match(path.name)
+        if m and path.is_dir():
+            seeds.append(int(m.group(1)))
+    return sorted(seeds)
+
+
+def validate(seeds: Sequence[int], state_sequences, maps: HandMaps, out_root: Path, *,
+             workers: Optional[int] = None, limit: int = DEFAULT_LIMIT, tempo: Tempo = None,
+             midi: Optional[bool] = None):
+    """
+    Validate the given seeds' folders, in parallel.
+
+    tempo is the BPM or TempoMap the files were rendered with (None = main's
+    configured tempo). midi says whether .mid files are expected where a seed
+    has no build manifest (None = main's WRITE_MIDI). Yields (seed, files
+    checked, problems) per seed, in seed order.
+    """
+    if tempo is None:
+        tempo = config.configured_tempo()
+    if midi is None:
+        midi = config.WRITE_MIDI
+    workers = max(1, min(workers or os.cpu_count() or 1, len(seeds) or 1))
+    if workers == 1:
+        _init_validate(state_sequences, maps, out_root, limit, tempo, midi)
+        for seed in seeds:
+            yield validate_seed(seed)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_validate,
+                             initargs=(state_sequences, maps, out_root, limit, tempo,
+                                       midi)) as pool:
+        yield from pool.map(validate_seed, seeds, chunksize=max(1, len(seeds) // (workers * 8)))
+
+
+def main(argv=None):
+    here = Path(__file__).parent
+    parser = argparse.ArgumentParser(description="Check generated MIDI/JSON files against their sources.")
+    parser.add_argument("--seeds", type=config.parse_seeds, default=None,
+                        help='seeds to check, e.g. "1-300" (default: every seed_<n> folder)')
+    parser.add_argument("--out-root", type=Path, default=here.parent / "generated_midis",
+                        help="folder with the generated files (default: generated_midis/)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT,
+                        help=f"mismatches reported per file (default: {DEFAULT_LIMIT})")
+    parser.add_argument("--tempo-map", type=parse_tempo_map, default=None,
+                        help="the --tempo-map the files were rendered with (default: TEMPO_MAP, "
+                             "else constant TEMPO)")
+    parser.add_argument("--json-only", action="store_true",
+                        help="the files were rendered with --json-only: expect no .mid files "
+                             "(seeds with a build manifest are checked against it anyway)")
+    args = parser.parse_args(argv)
+
+    if not args.out_root.is_dir():
+        sys.exit(f"Error: {args.out_root} does not exist")
+    seeds = args.seeds if args.seeds is not None else find_seeds(args.out_root)
+    missing = [s for s in seeds if not (args.out_root / f"seed_{s}").is_dir()]
+    if missing:
+        sys.exit(f"Error: no folder for seed(s) {missing[:10]} in {args.out_root}")
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+    try:
+        state_sequences = load_sequences.load_sequences(here / "state_sequences")
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+
+    t0 = time.perf_counter()
+    n_files = n_bad = n_problems = 0
+    for seed, files, problems in validate(seeds, state_sequences, maps, args.out_root,
+                                          workers=args.workers, limit=max(1, args.limit),
+                                          tempo=args.tempo_map,
+                                          midi=False if args.json_only else None):
+        n_files += files
+        if problems:
+            n_bad += 1
+            n_problems += len(problems)
+            for problem in problems:
+                print(problem)
+    secs = time.perf_counter() - t0
+    print(f"Checked {n_files} files of {len(seeds)} seeds in {secs:.2f}s: "
+          + (f"{n_problems} mismatches in {n_bad} seeds" if n_problems else "all match"))
+    if n_problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
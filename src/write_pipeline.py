@@ -0,0 +1,105 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Deque, Optional, Sequence, Tuple
+
+# One job = the files of one rendered sequence, as (path, contents) pairs
+Files = Sequence[Tuple[Path, bytes]]
+
+
+def _write_files(files: Files) -> None:
+    """Write one job's files; a file that fails part-way is removed again."""
+    for path, data in files:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(path, "wb") as fh:
+                fh.write(data)
+        except BaseException:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            raise
+
+
+class WritePipeline:
+    """
+    Flush rendered files on a small writer thread pool while the caller
+    renders the next sequence.
+
+    The caller encodes each sequence to bytes and submit()s the files. At most
+    `max_pending` jobs are queued or being written; submit() blocks on the
+    oldest job once that many are outstanding, so memory stays bounded by
+    max_pending sequences' worth of file contents.
+
+    `then` callbacks (e.g. recording the outputs in the build cache) run on the
+    submitting thread, in submission order, after the job's files are written.
+
+    If a write fails, the next submit() or close() cancels the queued jobs,
+    waits for the running ones and re-raises the error; callbacks of jobs that
+    did not finish are not run. Use it as a context manager so an error in the
+    renderer also stops the writers.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 4):
+        if workers < 1:
+            raise ValueError("WritePipeline needs at least one writer thread")
+        self.max_pending = max(1, max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="writer")
+        self._pending: Deque[tuple] = deque()   # (future, n_bytes, then) in submission order
+        self.jobs_written = 0
+        self.bytes_written = 0
+
+    def submit(self, files: Files, then: Optional[Callable[[], None]] = None) -> None:
+        """Queue files for writing, blocking while max_pending jobs are outstanding."""
+        # fail fast: surface an error from any finished job before queueing more
+        if any(fut.done() and fut.exception() is not None for fut, _, _ in self._pending):
+            self._reap(block=True)
+        self._reap(block=False)
+        while len(self._pending) >= self.max_pending:
+            self._reap_one()
+        files = list(files)
+        fut = self._pool.submit(_write_files, files)
+        self._pending.append((fut, sum(len(data) for _, data in files), then))
+
+    def _reap(self, block: bool) -> None:
+        """Complete finished jobs at the head of the queue (all jobs if block)."""
+        while self._pending and (block or self._pending[0][0].done()):
+            self._reap_one()
+
+    def _reap_one(self) -> None:
+        fut, n_bytes, then = self._pending.popleft()
+        try:
+            fut.result()
+        except BaseException:
+            self.abort()
+            raise
+        self.jobs_written += 1
+        self.bytes_written += n_bytes
+        if then is not None:
+            then()
+
+    def abort(self) -> None:
+        """Cancel queued jobs and wait for the writes already in progress."""
+        for fut, _, _ in self._pending:
+            fut.cancel()
+        self._pending.clear()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def close(self) -> None:
+        """Wait for every queued job, run its callback, and stop the writer threads."""
+        try:
+            self._reap(block=True)
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
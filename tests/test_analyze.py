@@ -0,0 +1,41 @@
+import analyze
+import main as config
+from note_capture import build_default_maps
+
+
+def _count_rows(table):
+    with open(table, encoding="utf-8") as fh:
+        return sum(1 for _ in fh)
+
+
+def test_force_rewrites_table(tmp_path):
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+    sequences = {"a": [0, 1, 2, 3, 4, 5, 6, 7, 8], "b": [8, 7, 6, 5, 4, 3, 2, 1, 0]}
+    table = tmp_path / "analysis.csv"
+
+    computed, kept = analyze.analyze([1, 2], sequences, maps, table, workers=1)
+    assert (computed, kept) == (4, 0)
+    lines = _count_rows(table)
+
+    computed, kept = analyze.analyze([1, 2], sequences, maps, table, workers=1, force=True)
+    assert (computed, kept) == (4, 0)
+    assert _count_rows(table) == lines == 5
+
+
+def test_partial_rerun_keeps_other_seeds(tmp_path):
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+    sequences = {"a": [0, 1, 2, 3, 4, 5, 6, 7, 8], "b": [8, 7, 6, 5, 4, 3, 2, 1, 0]}
+    table = tmp_path / "analysis.csv"
+    analyze.analyze([1, 2, 3], sequences, maps, table, workers=1)
+
+    # "a" changes, so its row for seed 1 is stale; the table must be rewritten
+    sequences["a"] = [0, 0, 1, 1, 2, 2]
+    computed, kept = analyze.analyze([1], sequences, maps, table, workers=1)
+    assert (computed, kept) == (1, 5)
+    rows, _ = analyze._read_table(table)
+    assert sorted((int(r["seed"]), r["sequence"]) for r in rows) == [
+        (1, "a"), (1, "b"), (2, "a"), (2, "b"), (3, "a"), (3, "b")]
+
+    computed, kept = analyze.analyze([2], sequences, maps, table, workers=1, force=True)
+    assert (computed, kept) == (2, 4)
+    assert _count_rows(table) == 7
@@ -0,0 +1,21 @@
+import pytest
+
+from bundle import BundleWriter, read_index
+
+
+@pytest.mark.parametrize("fmt", ["zip", "tar"])
+def test_failed_block_leaves_no_archive(tmp_path, fmt):
+    archive = tmp_path / f"seed_1.{fmt}"
+    with pytest.raises(RuntimeError):
+        with BundleWriter(archive, tmp_path, fmt) as b:
+            b.add(tmp_path / "seed_1" / "seed_1_a.mid", b"MThd")
+            raise RuntimeError("render failed")
+    assert not archive.exists()
+
+
+@pytest.mark.parametrize("fmt", ["zip", "tar"])
+def test_complete_archive_has_index(tmp_path, fmt):
+    archive = tmp_path / f"seed_1.{fmt}"
+    with BundleWriter(archive, tmp_path, fmt) as b:
+        b.add(tmp_path / "seed_1" / "seed_1_a.mid", b"MThd")
+    assert list(read_index(archive)) == ["seed_1/seed_1_a.mid"]
@@ -0,0 +1,52 @@
+"""
+The PianoVision JSON of every output path must stay byte-identical to the
+original writer (json.dump of the fully built payload), checked in as
+data/seed_20_Block_1.pv.json: seed 20, the first 24 steps of Block_1,
+tempo 120, scroll speed 1.
+"""
+from pathlib import Path
+
+import pytest
+
+import generate_states
+import main as config
+from bundle import BundleWriter, extract_seed
+from note_capture import build_default_maps
+from renderer import render_sequence
+from write_pipeline import WritePipeline
+
+GOLDEN = Path(__file__).parent / "data" / "seed_20_Block_1.pv.json"
+SEQUENCE = [5, 6, 7, 8, 0, 1, 2, 3, 4, 5, 6, 8, 0, 1, 2, 3, 4, 5, 4, 5, 6, 7, 8, 0]
+
+
+def _render(out_root, **options):
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+    chords, _ = generate_states.generate_states(
+        config.pitches_left, config.pitches_right, n_left=2, n_right=2, n_cross=5,
+        fingers_used=2, seed=20)
+    return render_sequence("Block_1", SEQUENCE, chords, 2, tempo=120, maps=maps,
+                           out_root=out_root, seed=20, scroll_speed=1.0, **options)
+
+
+@pytest.mark.parametrize("options", [{}, {"chunk_steps": 5}, {"midi": False},
+                                     {"chunk_steps": 7, "midi": False}],
+                         ids=["plain", "chunked", "json-only", "chunked-json-only"])
+def test_files_match_golden(tmp_path, options):
+    _, json_path = _render(tmp_path, **options)
+    assert json_path.read_bytes() == GOLDEN.read_bytes()
+
+
+def test_pipeline_matches_golden(tmp_path):
+    with WritePipeline(2, 2) as pipeline:
+        _, json_path = _render(tmp_path, pipeline=pipeline)
+    assert json_path.read_bytes() == GOLDEN.read_bytes()
+
+
+@pytest.mark.parametrize("fmt", ["zip", "tar"])
+def test_bundle_matches_golden(tmp_path, fmt):
+    archive = tmp_path / f"seed_20.{fmt}"
+    with BundleWriter(archive, tmp_path, fmt) as b:
+        _render(tmp_path, bundle=b)
+    extracted = extract_seed(archive, 20, tmp_path / "extracted")
+    json_path = next(p for p in extracted if p.name.endswith(".pv.json"))
+    assert json_path.read_bytes() == GOLDEN.read_bytes()
@@ -0,0 +1,8 @@
+import benchmark
+
+
+def test_chunked_render_memory_is_flat():
+    # two lengths 8x apart, each many windows long
+    rows = benchmark.memory_check([2_000, 16_000], chunk_steps=256)
+    (_, base, _), (_, peak, _) = rows
+    assert peak <= base * (1.0 + benchmark.MEMORY_TOLERANCE)
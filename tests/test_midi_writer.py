@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+import generate_states
+import main as config
+from midi_writer import _encode_midiutil, encode_smf
+from note_capture import NoteBuffer, StateTemplates, build_default_maps, capture_notes_columnar
+from tempo_map import TempoMap, ramp
+
+pytest.importorskip("midiutil")
+
+TEMPOS = [120, TempoMap([(0, 100), *ramp(16, 32, 100, 140), (48, 90)])]
+NAMES = ("Right", "Left")
+
+
+def _same_bytes(notes, tempo):
+    assert encode_smf(notes, tempo=tempo, track_names=NAMES) == \
+        _encode_midiutil(notes, tempo=tempo, track_names=NAMES, channel=0)
+
+
+def _random_buffer(rng, n, tempo, ordered):
+    notes = NoteBuffer(tempo)
+    starts = [rng.randrange(0, 400) * rng.choice((0.25, 0.5, 1.0)) for _ in range(n)]
+    if ordered:
+        starts.sort()
+    for start in starts:
+        notes.pitch.append(rng.randint(21, 108))
+        notes.start.append(start)
+        notes.duration.append(rng.choice((0.25, 0.5, 1.0, 1.5, 3.0)))
+        notes.track.append(rng.randint(0, 1))
+        notes.finger.append(rng.randint(0, 5))
+        notes.velocity.append(rng.randint(1, 127))
+    return notes
+
+
+@pytest.mark.parametrize("tempo", TEMPOS)
+@pytest.mark.parametrize("case", range(20))
+def test_random_buffers_match_midiutil(tempo, case):
+    rng = random.Random(case)
+    notes = _random_buffer(rng, rng.randint(0, 300), tempo, ordered=case % 2 == 0)
+    _same_bytes(notes, tempo)
+
+
+@pytest.mark.parametrize("tempo", TEMPOS)
+@pytest.mark.parametrize("seed", [1, 20, 300])
+def test_captured_sequences_match_midiutil(tempo, seed):
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+    chords, _ = generate_states.generate_states(
+        config.pitches_left, config.pitches_right,
+        n_left=config.CHORDS_LEFT_HAND, n_right=config.CHORDS_RIGHT_HAND,
+        n_cross=config.CHORDS_CROSS_HAND, fingers_used=config.FINGERS_USED, seed=seed)
+    rng = random.Random(seed)
+    sequence = [rng.randrange(len(chords)) for _ in range(200)]
+    for step_beats in (1.0, 0.5, 1 / 3):
+        # the template (precompiled state) path and the per-note path
+        notes = capture_notes_columnar(sequence, chords, config.FINGERS_USED, tempo, maps,
+                                       step_beats=step_beats,
+                                       templates=StateTemplates(chords, maps))
+        _same_bytes(notes, tempo)
+        _same_bytes(notes.to_events(), tempo)
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from sequence_grammar import load_grammar
+
+
+def _grammar_file(tmp_path, n):
+    path = tmp_path / "g.grammar.json"
+    path.write_text(json.dumps({"transitions": [[1] * n] * n, "length": 20, "seed": 1}))
+    return path
+
+
+def test_matrix_must_match_state_count(tmp_path):
+    path = _grammar_file(tmp_path, 3)
+    with pytest.raises(ValueError, match="g.grammar.json"):
+        load_grammar(path, n_states=9)
+
+
+def test_matching_matrix_loads(tmp_path):
+    seq = load_grammar(_grammar_file(tmp_path, 9), n_states=9)
+    assert len(list(seq)) == 20 and all(0 <= i < 9 for i in seq)
+
+
+@pytest.mark.parametrize("key", ["transitions", "length"])
+def test_missing_key_is_a_value_error(tmp_path, key):
+    path = _grammar_file(tmp_path, 9)
+    data = json.loads(path.read_text())
+    del data[key]
+    path.write_text(json.dumps(data))
+    with pytest.raises(ValueError, match=f"g.grammar.json: missing key '{key}'"):
+        load_grammar(path, n_states=9)
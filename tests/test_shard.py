@@ -0,0 +1,23 @@
+import shard
+from shard import Participant
+
+
+def _done(out_root, participant, key):
+    shard.mark_done(out_root, participant, "1/1", (participant.seed, 1, 1, 1, 0.1, 0, 1), key)
+
+
+def test_seed_done_with_other_key_is_pending(tmp_path):
+    a, b = Participant("P1", 1), Participant("P2", 2)
+    _done(tmp_path, a, "old")
+    _done(tmp_path, b, "new")
+    assert shard.pending([a, b], tmp_path) == []
+    assert shard.pending([a, b], tmp_path, "new") == [a]
+
+
+def test_mixed_keys_are_not_merged(tmp_path):
+    a, b = Participant("P1", 1), Participant("P2", 2)
+    _done(tmp_path, a, "old")
+    _done(tmp_path, b, "new")
+    assert shard.merge_summaries([a, b], tmp_path) is None
+    _done(tmp_path, a, "new")
+    assert shard.merge_summaries([a, b], tmp_path, "new") == tmp_path / shard.SUMMARY_NAME
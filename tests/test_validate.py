@@ -0,0 +1,28 @@
+from pathlib import Path
+
+import load_sequences
+import main as config
+import validate
+from note_capture import build_default_maps
+
+SEQUENCES = Path(config.__file__).parent / "state_sequences"
+
+
+def _problems(out_root, state_sequences, maps, **kwargs):
+    results = validate.validate([5], state_sequences, maps, out_root, workers=1, **kwargs)
+    return [p for _, _, problems in results for p in problems]
+
+
+def test_json_only_run_validates(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WRITE_MIDI", False)
+    maps = build_default_maps(config.pitches_left, config.pitches_right)
+    state_sequences = load_sequences.load_sequences(SEQUENCES)
+    created, _ = config.render_seed(5, state_sequences, maps, tmp_path, verbose=False,
+                                    write_threads=0)
+    assert created and all(p.suffix == ".json" for p in created)
+
+    # from the build manifest, and without one from midi=False
+    assert _problems(tmp_path, state_sequences, maps, midi=True) == []
+    (tmp_path / "seed_5" / ".build_manifest.json").unlink()
+    assert _problems(tmp_path, state_sequences, maps, midi=False) == []
+    assert len(_problems(tmp_path, state_sequences, maps, midi=True)) == len(state_sequences)